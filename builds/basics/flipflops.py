@@ -1,4 +1,6 @@
-from fpga import CustomVHDL
+from myhdl import ResetSignal
+
+from fpga.vhdl_cache import cached_vhdl
 from fpga.utils import create_signals, create_clock_reset
 
 import fpga.basics.flipflops as ff
@@ -6,18 +8,17 @@ import fpga.basics.flipflops as ff
 
 def convert_async_dff():
     q, d = create_signals(2, 4)
-    clk, rst = create_clock_reset(rst_async=True)
+    clk = create_signals(1)
+    rst = ResetSignal(0, active=1, isasync=True)
 
-    converter = CustomVHDL()
-    converter(ff.dff, q, d, clk, rst)
+    cached_vhdl(ff.dff, clk, d, q, reset=rst)
 
 
 def convert_dff():
     q, d = create_signals(2, 4)
-    clk, rst = create_clock_reset(rst_async=True)
+    clk, rst = create_clock_reset()
 
-    converter = CustomVHDL()
-    converter(ff.dff, q, d, clk)
+    cached_vhdl(ff.dff, clk, d, q)
 
 
 if __name__ == '__main__':
@@ -1,16 +1,18 @@
-from fpga import toVHDL
-from fpga.utils import create_signals, create_clock_reset
+from myhdl import ResetSignal
+
+from fpga.vhdl_cache import cached_vhdl
+from fpga.utils import create_signals
 
 import fpga.basics.parallel2serial as p2s
 
 
 def convert_p2s_msb():
-    i, o = create_signals(2, 8, signed=True)
-    load = create_signals(1)
-    clk, rst = create_clock_reset()
+    i = create_signals(1, 8, signed=True)
+    o, load = create_signals(2)
+    clk = create_signals(1)
+    rst = ResetSignal(0, active=1, isasync=False)
 
-    toVHDL(p2s.p2s_msb, i, load, o, clk, rst)
+    cached_vhdl(p2s.Parallel2Serial, clk, rst, load, i, o)
 
 if __name__ == '__main__':
     convert_p2s_msb()
-
@@ -1,6 +1,6 @@
-from fpga import toVHDL
+from fpga.vhdl_cache import cached_vhdl
 from fpga.utils import create_signals
-from fpga.interfaces.aes3 import AES3_TX, AES3_RX_DEMUXED
+from fpga.interfaces.aes3 import AES3_TX, AES3_RX
 
 
 def convert_tx():
@@ -8,8 +8,8 @@ def convert_tx():
         ce_bp, sdata, clk, rst = create_signals(13)
     audio_ch1, audio_ch2 = create_signals(2, 24, signed=True)
 
-    toVHDL(AES3_TX, audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2,
-           user2, frame0, ce_word, ce_bit, ce_bp, sdata, clk, rst)
+    cached_vhdl(AES3_TX, audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2,
+                user2, frame0, ce_word, ce_bit, ce_bp, sdata, clk, rst)
 
 
 def convert_rx():
@@ -18,9 +18,11 @@ def convert_rx():
     audio_ch1, audio_ch2 = create_signals(2, 24, signed=True)
     frames = create_signals(1, 8)
 
-    toVHDL(AES3_RX_DEMUXED, din, audio_ch1, valid1, user1, cs1, out_en,
-           audio_ch2, valid2, user2, cs2, parity_error, frames, frame0, locked,
-           clk, rst)
+    cached_vhdl(AES3_RX, din, audio_ch1, valid1, user1, cs1, out_en,
+                audio_ch2, valid2, user2, cs2, parity_error, frames, frame0,
+                locked, clk, rst)
 
-convert_rx()
-convert_tx()
+
+if __name__ == '__main__':
+    convert_rx()
+    convert_tx()
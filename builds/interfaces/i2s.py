@@ -1,4 +1,4 @@
-from fpga import toVHDL
+from fpga.vhdl_cache import cached_vhdl
 from fpga.utils import create_signals
 from fpga.interfaces.i2s import I2S_Transmitter, I2S_Receiver
 
@@ -8,8 +8,8 @@ def convert_transmitter():
     # left, right = [Signal(intbv(0)[32:]) for _ in range(2)]
     load_left, load_right, sdata, ws, sclk, reset = create_signals(6, delay=None)
 
-    toVHDL(I2S_Transmitter, left, right, load_left, load_right, sdata, ws, sclk,
-           reset)
+    cached_vhdl(I2S_Transmitter, left, right, load_left, load_right, sdata, ws, sclk,
+                reset)
 
 
 def convert_receiver():
@@ -17,8 +17,8 @@ def convert_receiver():
     # left, right = [Signal(intbv(0)[32:]) for _ in range(2)]
     left_ready, right_ready, sdata, ws, sclk, reset = create_signals(6, delay=None)
 
-    toVHDL(I2S_Receiver, sdata, ws, left, right, left_ready, right_ready, sclk,
-           reset)
+    cached_vhdl(I2S_Receiver, sdata, ws, left, right, left_ready, right_ready, sclk,
+                reset)
 
 if __name__ == '__main__':
     convert_transmitter()
@@ -2,24 +2,73 @@
 
 __author__ = 'michiel'
 
-import myhdl.conversion._toVHDL as conv2vhdl
+import importlib
 
-from . import utils
-from . import basics
+import myhdl.conversion._toVHDL as conv2vhdl
 
-from .utils import *
-from .basics import *
+#: Subpackages and modules, imported on first use (PEP 562)
+_submodules = ['basics', 'build', 'encoders', 'examples', 'generators',
+               'interfaces', 'sim', 'templates', 'tests', 'utils',
+               'vhdl_cache']
+#: Modules of which the public names are available directly from fpga
+_exporting = ['utils', 'basics']
 
 
 class CustomVHDL(conv2vhdl._ToVHDLConvertor):
 
     def __init__(self):
         super(CustomVHDL, self).__init__()
+        self._set_defaults()
+
+    def _set_defaults(self):
         self.library = "work"
         self.architecture = "ScryverDesign"
         self.numeric_ports = False
         self.std_logic_ports = True
 
-conv2vhdl.toVHDL = CustomVHDL()
+    def _cleanup(self, siglist, memlist):
+        # MyHDL resets the attributes to its own defaults after a conversion
+        super(CustomVHDL, self)._cleanup(siglist, memlist)
+        self._set_defaults()
+
+
+class _LazyConvertor(object):
+    """Stands in for MyHDL's toVHDL until a conversion (or a setting) needs
+    it, then installs a CustomVHDL in its place."""
+
+    def _convertor(self):
+        if conv2vhdl.toVHDL is self:
+            conv2vhdl.toVHDL = CustomVHDL()
+        return conv2vhdl.toVHDL
+
+    def __call__(self, *args, **kwargs):
+        return self._convertor()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._convertor(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._convertor(), name, value)
+
+conv2vhdl.toVHDL = _LazyConvertor()
+
+
+def __getattr__(name):
+    if name in _submodules:
+        return importlib.import_module('.' + name, __name__)
+    elif name == 'toVHDL':
+        return conv2vhdl.toVHDL
+    elif name == '__all__':
+        return [n for module in _exporting
+                for n in importlib.import_module('.' + module, __name__).__all__]
+
+    for module in _exporting:
+        module = importlib.import_module('.' + module, __name__)
+        if name in module.__all__:
+            return getattr(module, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__,
+                                                                    name))
+
 
-__all__ = utils.__all__ + basics.__all__
+def __dir__():
+    return sorted(list(globals()) + _submodules + __getattr__('__all__'))
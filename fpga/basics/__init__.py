@@ -3,11 +3,19 @@
 __author__ = 'michiel'
 
 from .counter import ModCounter, CountTo
+from .fifo import SyncFifo, AsyncFifo
 from .flipflops import dff
-from .ram import ShiftRegister, OnePortRam, OnePortRomSyncRead
+from .gearbox import Gearbox
+from .multiplexers import MuxTree, mux2, mux3
+from .ram import ShiftRegister, OnePortRam, OnePortRomSyncRead, \
+    SimpleTwoPortRam, TrueTwoPortRam
 
 __all__ = [
     'ModCounter', 'CountTo',
+    'SyncFifo', 'AsyncFifo',
     'dff',
-    'ShiftRegister', 'OnePortRam', 'OnePortRomSyncRead'
+    'Gearbox',
+    'MuxTree', 'mux2', 'mux3',
+    'ShiftRegister', 'OnePortRam', 'OnePortRomSyncRead',
+    'SimpleTwoPortRam', 'TrueTwoPortRam'
 ]
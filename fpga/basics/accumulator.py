@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 
-from myhdl import block, always_comb, always_seq
+from myhdl import block, always, always_comb, always_seq, Signal, intbv, \
+    concat
 from fpga.utils import create_signals
+from .multiplier import PipelinedMultiplier, multiplier_latency, \
+    _product_range, DSP_25X18
+from .ram import ShiftRegister
 
 __author__ = 'michiel'
 
@@ -27,3 +31,251 @@ def Accumulator(clk, ce, clr, din, dout):
         dout.next = accum
 
     return logic, clocked, output
+
+
+#: Rounding of the read-out of PipelinedAccumulator
+TRUNCATE = 'truncate'
+ROUND_HALF_UP = 'round_half_up'
+
+
+def guard_bits(terms):
+    """Extra accumulator bits so the sum of terms values can't overflow."""
+    return (terms - 1).bit_length()
+
+
+def _accumulator_chunks(din, terms, chunk):
+    """Number and width of the chunks of a PipelinedAccumulator."""
+    # A signed accumulator needs a sign bit for unsigned values
+    width = len(din) + guard_bits(terms) + (din.min >= 0)
+    chunks = -(-width // chunk)
+    return chunks, -(-width // chunks)
+
+
+def accumulator_latency(din, terms, chunk=24):
+    """Clock cycles from din (and ce/clr) to dout of a PipelinedAccumulator.
+
+    :param din:     Input signal
+    :param terms:   Largest number of values summed between clears
+    :param chunk:   Largest adder width
+    """
+    chunks, _ = _accumulator_chunks(din, terms, chunk)
+    return chunks + 1
+
+
+@block
+def AccumulatorChunk(clk, rst, ce, clr, din, acc_in, acc_out, carry_in,
+                     carry_out, INDEX, CHUNKS, WIDTH, BIAS):
+    """Adder INDEX of PipelinedAccumulator.
+
+    Takes its WIDTH bits of din, ce and clr INDEX clocks late, adds the carry
+    the lower chunk produced the clock before and delays its sum so it lines
+    up with the other chunks: acc_out is the sum of all chunks up to this one.
+    The lowest chunk has no acc_in and carry_in and the top chunk no
+    carry_out, pass None for them.
+    """
+    LOW = INDEX * WIDTH
+    CHUNK_BIAS = BIAS >> LOW & (2 ** WIDTH - 1)
+    din_slice, din_chunk, total_aligned = [Signal(intbv(0)[WIDTH:])
+                                           for _ in range(3)]
+    # Biased from the start, so the first sum rounds without a rst or clr
+    total = Signal(intbv(CHUNK_BIAS)[WIDTH:])
+    full = Signal(intbv(0)[WIDTH + 1:])
+    ce_chunk, clr_chunk = [Signal(False) for _ in range(2)]
+
+    @always_comb
+    def select():
+        din_slice.next = din[LOW + WIDTH:LOW]
+
+    if INDEX:
+        din_skew = ShiftRegister(clk, True, din_slice, din_chunk, length=INDEX)
+        ce_skew = ShiftRegister(clk, True, ce, ce_chunk, length=INDEX)
+        clr_skew = ShiftRegister(clk, True, clr, clr_chunk, length=INDEX)
+        skew = [din_skew, ce_skew, clr_skew]
+    else:
+        @always_comb
+        def skew():
+            din_chunk.next = din_slice
+            ce_chunk.next = ce
+            clr_chunk.next = clr
+
+    if INDEX:
+        @always_comb
+        def add():
+            full.next = total + din_chunk + carry_in
+    else:
+        @always_comb
+        def add():
+            full.next = total + din_chunk
+
+    if INDEX < CHUNKS - 1:
+        @always(clk.posedge)
+        def accumulate():
+            if rst or clr_chunk:
+                total.next = CHUNK_BIAS
+                carry_out.next = 0
+            elif ce_chunk:
+                total.next = full[WIDTH:]
+                carry_out.next = full[WIDTH + 1:WIDTH]
+            else:
+                carry_out.next = 0
+    else:
+        @always(clk.posedge)
+        def accumulate():
+            if rst or clr_chunk:
+                total.next = CHUNK_BIAS
+            elif ce_chunk:
+                total.next = full[WIDTH:]
+
+    if INDEX < CHUNKS - 1:
+        deskew = ShiftRegister(clk, True, total, total_aligned,
+                               length=CHUNKS - 1 - INDEX)
+    else:
+        @always_comb
+        def deskew():
+            total_aligned.next = total
+
+    if INDEX:
+        @always_comb
+        def combine():
+            acc_out.next = concat(total_aligned, acc_in)
+    else:
+        @always_comb
+        def combine():
+            acc_out.next = total_aligned
+
+    return select, skew, add, accumulate, deskew, combine
+
+
+@block
+def PipelinedAccumulator(clk, rst, ce, clr, din, dout, terms=1024, chunk=24,
+                         shift=0, rounding=TRUNCATE, saturate=False):
+    """Accumulator for wide sums: dout = sum of din while ce, since clr.
+
+    The accumulator is guard_bits(terms) wider than din and split into
+    chunks of at most chunk bits. Each chunk adds the carry of the chunk
+    below a clock later (split carry), with din, ce and clr skewed to match,
+    so no adder is wider than a chunk. ce and clr therefore go along with
+    din, dout shows the sum accumulator_latency() clocks later.
+
+    The read-out divides by 2 ** shift, rounded by rounding: TRUNCATE (to
+    minus infinity) or ROUND_HALF_UP (by starting every sum at half an output
+    LSB, so it costs no adder). With saturate a sum outside the range of
+    dout gives its minimum or maximum, otherwise it wraps.
+
+    :param rst:     Synchronous reset, clears the accumulator
+    :param clr:     Start a new sum; drops din of that clock like Accumulator
+    :param terms:   Largest number of values summed between clears
+    :param chunk:   Largest adder width
+    """
+    assert rounding in (TRUNCATE, ROUND_HALF_UP)
+    CHUNKS, WIDTH = _accumulator_chunks(din, terms, chunk)
+    ACC_WIDTH = CHUNKS * WIDTH
+    BIAS = 2 ** (shift - 1) if shift and rounding == ROUND_HALF_UP else 0
+    OUT_WIDTH = ACC_WIDTH - shift
+    assert OUT_WIDTH > 0
+    OUT_MIN, OUT_MAX = dout.min, dout.max - 1
+    SATURATING = saturate and (OUT_MIN > -2 ** (OUT_WIDTH - 1) or
+                               OUT_MAX < 2 ** (OUT_WIDTH - 1) - 1)
+
+    if din.min < 0:
+        din_ext = Signal(intbv(0, min=-2 ** (ACC_WIDTH - 1),
+                               max=2 ** (ACC_WIDTH - 1)))
+    else:
+        din_ext = Signal(intbv(0)[ACC_WIDTH:])
+    # The sums up to each chunk and the carries out of each chunk but the top
+    accs = [Signal(intbv(0)[(i + 1) * WIDTH:]) for i in range(CHUNKS)]
+    carries = [Signal(intbv(0)[1:]) for _ in range(CHUNKS - 1)]
+    acc = accs[-1]
+    acc_value = Signal(intbv(0, min=-2 ** (ACC_WIDTH - 1),
+                             max=2 ** (ACC_WIDTH - 1)))
+    shifted = Signal(intbv(0, min=-2 ** (OUT_WIDTH - 1),
+                           max=2 ** (OUT_WIDTH - 1)))
+
+    @always_comb
+    def extend():
+        din_ext.next = din
+
+    # The lowest chunk has nothing below it, the top one nothing above it
+    adders = [AccumulatorChunk(clk, rst, ce, clr, din_ext,
+                               accs[i - 1] if i else None, accs[i],
+                               carries[i - 1] if i else None,
+                               carries[i] if i < CHUNKS - 1 else None,
+                               i, CHUNKS, WIDTH, BIAS)
+              for i in range(CHUNKS)]
+
+    @always_comb
+    def read_value():
+        acc_value.next = acc.signed()
+
+    @always_comb
+    def divide():
+        shifted.next = acc_value >> shift
+
+    if SATURATING:
+        @always(clk.posedge)
+        def read_out():
+            if rst:
+                dout.next = 0
+            elif shifted > OUT_MAX:
+                dout.next = OUT_MAX
+            elif shifted < OUT_MIN:
+                dout.next = OUT_MIN
+            else:
+                dout.next = shifted
+    elif len(dout) < OUT_WIDTH:
+        DOUT_WIDTH = len(dout)
+        if dout.min < 0:
+            @always(clk.posedge)
+            def read_out():
+                if rst:
+                    dout.next = 0
+                else:
+                    dout.next = shifted[DOUT_WIDTH:].signed()
+        else:
+            @always(clk.posedge)
+            def read_out():
+                if rst:
+                    dout.next = 0
+                else:
+                    dout.next = shifted[DOUT_WIDTH:]
+    else:
+        @always(clk.posedge)
+        def read_out():
+            if rst:
+                dout.next = 0
+            else:
+                dout.next = shifted
+
+    return extend, adders, read_value, divide, read_out
+
+
+def mac_latency(a, b, terms, dsp=DSP_25X18, latency=None, chunk=24):
+    """Clock cycles from a, b, ce and clr to dout of a MultiplyAccumulate."""
+    p_min, p_max = _product_range((a.min, a.max - 1), (b.min, b.max - 1))
+    p = Signal(intbv(0, min=p_min, max=p_max + 1))
+    return multiplier_latency(a, b, dsp, latency) + \
+        accumulator_latency(p, terms, chunk)
+
+
+@block
+def MultiplyAccumulate(clk, rst, ce, clr, a, b, dout, terms=1024,
+                       dsp=DSP_25X18, latency=None, chunk=24, shift=0,
+                       rounding=TRUNCATE, saturate=False):
+    """dout = sum of a * b while ce, since clr: a PipelinedMultiplier into a
+    PipelinedAccumulator, with ce and clr delayed along with the products.
+
+    See mac_latency() for the clocks from a, b, ce and clr to dout and
+    PipelinedAccumulator for terms, chunk, shift, rounding and saturate.
+    """
+    p_min, p_max = _product_range((a.min, a.max - 1), (b.min, b.max - 1))
+    p = Signal(intbv(0, min=p_min, max=p_max + 1))
+    ce_p, clr_p = [Signal(False) for _ in range(2)]
+    MULT_LATENCY = multiplier_latency(a, b, dsp, latency)
+
+    multiplier = PipelinedMultiplier(clk, rst, a, b, p, dsp, latency)
+    ce_delay = ShiftRegister(clk, True, ce, ce_p, rst, length=MULT_LATENCY)
+    clr_delay = ShiftRegister(clk, True, clr, clr_p, rst, length=MULT_LATENCY)
+    accumulator = PipelinedAccumulator(clk, rst, ce_p, clr_p, p, dout, terms,
+                                       chunk, shift, rounding, saturate)
+
+    return multiplier, ce_delay, clr_delay, accumulator
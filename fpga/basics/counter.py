@@ -2,6 +2,9 @@
 
 __author__ = 'michiel'
 
+from fractions import Fraction
+from math import gcd
+
 from myhdl import block, always, always_comb, Signal, intbv, modbv
 
 
@@ -59,3 +62,114 @@ def CountTo(clk, enable, clear, reached, MAX_CLOCK=32):
         reached.next = count == MAX_CLOCK
 
     return counting, reach_logic
+
+
+def fractional_increment(f_out, f_clk, bits=32, shaping=True,
+                         denominator=None):
+    """Settings of a FractionalClockEnable for f_out enables per second out
+    of f_clk clocks per second.
+
+    With shaping the rate is exact: f_out / f_clk = (increment + remainder /
+    denominator) / 2 ** bits. For integer frequencies the denominator only
+    depends on f_clk and bits, so one FractionalClockEnable serves every
+    rate. Without shaping the remainder is dropped, the rate is a bit low.
+
+    :param denominator: Force a (common) denominator
+    :return:            (increment, remainder, denominator)
+    """
+    x = Fraction(f_out) / Fraction(f_clk) * 2 ** bits
+    assert 0 < x < 2 ** bits, "f_out must be below f_clk"
+    increment = x.numerator // x.denominator
+    if not shaping:
+        return increment, 0, 1
+
+    fraction = x - increment
+    if denominator is None:
+        f_clk = Fraction(f_clk)
+        denominator = f_clk.numerator // gcd(f_clk.numerator, 2 ** bits)
+        if (fraction * denominator).denominator != 1:
+            denominator = fraction.denominator
+    remainder = fraction * denominator
+    assert remainder.denominator == 1, "No exact remainder for denominator"
+    return increment, int(remainder), denominator
+
+
+def fractional_rate(increment, bits, remainder=0, denominator=1):
+    """Enables per clock of a FractionalClockEnable (exact)."""
+    return (increment + Fraction(remainder, denominator)) / 2 ** bits
+
+
+def fractional_jitter(increment, bits, remainder=0, denominator=1):
+    """Worst-case peak-to-peak jitter, in clock cycles, of the enables of a
+    FractionalClockEnable against an ideal enable at the same rate.
+
+    An enable comes on the first clock at or after its ideal time. With rate
+    p / q (reduced) the errors are the multiples of 1 / p, so the jitter is
+    (p - 1) / p: below one clock, zero for integer divisions."""
+    p = fractional_rate(increment, bits, remainder, denominator).numerator
+    return float(Fraction(p - 1, p))
+
+
+@block
+def FractionalClockEnable(clk, rst, increment, enable, remainder=0,
+                          DENOMINATOR=1):
+    """Phase accumulator clock enable: enable is high on a fraction
+    (increment + remainder / DENOMINATOR) / 2 ** len(increment) of the
+    clocks, evenly spread. See fractional_increment() for the settings.
+
+    The enable is the carry out of a len(increment) bit accumulator. With a
+    DENOMINATOR above 1 the truncation error of the increment is shaped
+    (first order): a second accumulator adds remainder modulo DENOMINATOR
+    and adds its carry to the main accumulator, so the long-term rate is
+    exact. fractional_jitter() gives the worst-case jitter.
+
+    :param rst:         Synchronous reset, restarts the phase
+    :param increment:   Phase increment, a signal so the rate can change
+    :param remainder:   Signal or constant, below DENOMINATOR
+    """
+    BITS = len(increment)
+    acc = Signal(modbv(0)[BITS:])
+    total = Signal(intbv(0)[BITS + 1:])
+    carry = Signal(intbv(0)[1:])
+
+    @always_comb
+    def add():
+        total.next = acc + increment + carry
+
+    @always(clk.posedge)
+    def accumulate():
+        if rst:
+            acc.next = 0
+            enable.next = 0
+        else:
+            acc.next = total[BITS:]
+            enable.next = total[BITS]
+
+    if DENOMINATOR == 1:
+        return add, accumulate
+
+    error, error_next = [Signal(intbv(0, min=0, max=DENOMINATOR))
+                         for _ in range(2)]
+    error_sum = Signal(intbv(0, min=0, max=2 * DENOMINATOR))
+
+    @always_comb
+    def error_add():
+        error_sum.next = error + remainder
+
+    @always_comb
+    def shape():
+        if error_sum >= DENOMINATOR:
+            carry.next = 1
+            error_next.next = error_sum - DENOMINATOR
+        else:
+            carry.next = 0
+            error_next.next = error_sum
+
+    @always(clk.posedge)
+    def error_feedback():
+        if rst:
+            error.next = 0
+        else:
+            error.next = error_next
+
+    return add, accumulate, error_add, shape, error_feedback
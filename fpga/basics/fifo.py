@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+__author__ = 'michiel'
+
+from myhdl import block, always, always_comb, Signal, intbv, modbv, downrange
+
+from .ram import SimpleTwoPortRam
+
+
+def _check_levels(depth, almost_full_level, almost_empty_level):
+    assert depth >= 2 and depth & (depth - 1) == 0, \
+        "The depth must be a power of 2"
+    if almost_full_level is None:
+        almost_full_level = depth - 1
+    assert 0 <= almost_empty_level <= depth and \
+        0 <= almost_full_level <= depth, "Levels must be within the depth"
+    return almost_full_level, almost_empty_level
+
+
+@block
+def FifoReadControl(clk, rst, re, core_empty, do_read, empty, fwft=False):
+    """Read side of the FIFOs: which reads reach the RAM and when the FIFO
+    is empty.
+
+    Without fwft the RAM output register shows a word the clock after re.
+    With fwft the next word is read ahead into the output register, so dout
+    shows it while not empty and re acknowledges it.
+    """
+    if not fwft:
+        @always_comb
+        def control():
+            do_read.next = re and not core_empty
+            empty.next = core_empty
+
+        return control
+
+    valid = Signal(False)
+
+    @always_comb
+    def read_ahead():
+        do_read.next = not core_empty and (re or not valid)
+
+    @always_comb
+    def output_empty():
+        empty.next = not valid
+
+    @always(clk.posedge)
+    def output_valid():
+        if rst:
+            valid.next = False
+        elif do_read:
+            valid.next = True
+        elif re:
+            valid.next = False
+
+    return read_ahead, output_empty, output_valid
+
+
+@block
+def SyncFifo(clk, rst, we, din, full, almost_full, re, dout, empty,
+             almost_empty, depth=16, almost_full_level=None,
+             almost_empty_level=1, fwft=False):
+    """FIFO on a SimpleTwoPortRam, with a single clock.
+
+    Writes when full and reads when empty are ignored. The almost flags
+    compare the number of words in the RAM with the levels: almost_full when
+    at least almost_full_level words, almost_empty when at most
+    almost_empty_level words. With fwft the output register holds one word
+    more.
+
+    :param rst:                 Synchronous reset, empties the FIFO
+    :param depth:               Number of words, a power of 2
+    :param almost_full_level:   Defaults to depth - 1
+    :param fwft:                First word fall through, see FifoReadControl
+    """
+    almost_full_level, almost_empty_level = _check_levels(
+        depth, almost_full_level, almost_empty_level)
+    ADDR_WIDTH = (depth - 1).bit_length()
+    assert len(din) == len(dout)
+
+    wr_ptr, rd_ptr = [Signal(modbv(0)[ADDR_WIDTH:]) for _ in range(2)]
+    level = Signal(intbv(0, min=0, max=depth + 1))
+    do_write, do_read, core_empty = [Signal(False) for _ in range(3)]
+
+    ram = SimpleTwoPortRam(clk, do_write, wr_ptr, din, clk, rd_ptr, dout,
+                           re=do_read)
+    read_control = FifoReadControl(clk, rst, re, core_empty, do_read, empty,
+                                   fwft)
+
+    @always_comb
+    def write_control():
+        do_write.next = we and level != depth
+
+    @always(clk.posedge)
+    def pointers():
+        if rst:
+            wr_ptr.next = 0
+            rd_ptr.next = 0
+            level.next = 0
+        else:
+            if do_write:
+                wr_ptr.next = wr_ptr + 1
+            if do_read:
+                rd_ptr.next = rd_ptr + 1
+            if do_write and not do_read:
+                level.next = level + 1
+            elif do_read and not do_write:
+                level.next = level - 1
+
+    @always_comb
+    def flags():
+        full.next = level == depth
+        almost_full.next = level >= almost_full_level
+        core_empty.next = level == 0
+        almost_empty.next = level <= almost_empty_level
+
+    return ram, read_control, write_control, pointers, flags
+
+
+@block
+def GrayToBinary(gray, binary):
+
+    WIDTH = len(gray)
+
+    @always_comb
+    def convert():
+        value = intbv(0)[WIDTH:]
+        value[WIDTH - 1] = gray[WIDTH - 1]
+        for i in downrange(WIDTH - 1):
+            value[i] = value[i + 1] ^ gray[i]
+        binary.next = value
+
+    return convert
+
+
+@block
+def AsyncFifo(wclk, wrst, we, din, full, almost_full, rclk, rrst, re, dout,
+              empty, almost_empty, depth=16, almost_full_level=None,
+              almost_empty_level=1, fwft=False):
+    """FIFO on a SimpleTwoPortRam, with a write and a read clock.
+
+    The pointers cross the clock domains Gray coded, through two registers.
+    Full and almost_full therefore see reads, and empty and almost_empty
+    see writes, a few clocks late: the flags are pessimistic, never wrong.
+
+    :param wrst:                Reset, synchronous to wclk
+    :param rrst:                Reset, synchronous to rclk, reset both
+                                sides together to empty the FIFO
+    :param depth:               Number of words, a power of 2
+    :param almost_full_level:   Defaults to depth - 1, see SyncFifo
+    :param fwft:                First word fall through, see FifoReadControl
+    """
+    almost_full_level, almost_empty_level = _check_levels(
+        depth, almost_full_level, almost_empty_level)
+    ADDR_WIDTH = (depth - 1).bit_length()
+    PTR_WIDTH = ADDR_WIDTH + 1
+    assert len(din) == len(dout)
+
+    # Write side
+    wbin, wbin_inc, wgray, wlevel = [Signal(modbv(0)[PTR_WIDTH:])
+                                     for _ in range(4)]
+    rgray_meta, rgray_sync, rbin_sync = [Signal(modbv(0)[PTR_WIDTH:])
+                                         for _ in range(3)]
+    waddr = Signal(modbv(0)[ADDR_WIDTH:])
+    do_write = Signal(False)
+    # Read side
+    rbin, rbin_inc, rgray, rlevel = [Signal(modbv(0)[PTR_WIDTH:])
+                                     for _ in range(4)]
+    wgray_meta, wgray_sync, wbin_sync = [Signal(modbv(0)[PTR_WIDTH:])
+                                         for _ in range(3)]
+    raddr = Signal(modbv(0)[ADDR_WIDTH:])
+    do_read, core_empty = [Signal(False) for _ in range(2)]
+
+    ram = SimpleTwoPortRam(wclk, do_write, waddr, din, rclk, raddr, dout,
+                           re=do_read)
+    read_control = FifoReadControl(rclk, rrst, re, core_empty, do_read, empty,
+                                   fwft)
+    rgray_to_binary = GrayToBinary(rgray_sync, rbin_sync)
+    wgray_to_binary = GrayToBinary(wgray_sync, wbin_sync)
+
+    @always_comb
+    def write_pointer():
+        wbin_inc.next = wbin + 1
+        waddr.next = wbin[ADDR_WIDTH:]
+        wlevel.next = wbin - rbin_sync
+
+    @always_comb
+    def write_control():
+        do_write.next = we and wlevel != depth
+
+    @always_comb
+    def write_flags():
+        full.next = wlevel == depth
+        almost_full.next = wlevel >= almost_full_level
+
+    @always(wclk.posedge)
+    def write_registers():
+        if wrst:
+            wbin.next = 0
+            wgray.next = 0
+            rgray_meta.next = 0
+            rgray_sync.next = 0
+        else:
+            if do_write:
+                wbin.next = wbin_inc
+                wgray.next = wbin_inc ^ (wbin_inc >> 1)
+            rgray_meta.next = rgray
+            rgray_sync.next = rgray_meta
+
+    @always_comb
+    def read_pointer():
+        rbin_inc.next = rbin + 1
+        raddr.next = rbin[ADDR_WIDTH:]
+        rlevel.next = wbin_sync - rbin
+
+    @always_comb
+    def read_flags():
+        core_empty.next = rlevel == 0
+        almost_empty.next = rlevel <= almost_empty_level
+
+    @always(rclk.posedge)
+    def read_registers():
+        if rrst:
+            rbin.next = 0
+            rgray.next = 0
+            wgray_meta.next = 0
+            wgray_sync.next = 0
+        else:
+            if do_read:
+                rbin.next = rbin_inc
+                rgray.next = rbin_inc ^ (rbin_inc >> 1)
+            wgray_meta.next = wgray
+            wgray_sync.next = wgray_meta
+
+    return ram, read_control, rgray_to_binary, wgray_to_binary, \
+        write_pointer, write_control, write_flags, write_registers, \
+        read_pointer, read_flags, read_registers
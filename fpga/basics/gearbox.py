@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+__author__ = 'michiel'
+
+from myhdl import block, always, always_comb, Signal, intbv, concat
+
+
+@block
+def Gearbox(clk, rst, din, din_valid, din_ready, dout, dout_valid, dout_ready,
+            MSB_FIRST=True):
+    """Width converter from len(din) to len(dout) bits per word, for any
+    widths (24 bit samples to bytes, bits to 32 bit SERDES words, ...).
+
+    Both sides handshake: a word moves when valid and ready are high at the
+    clock. The bits stream through a buffer of len(din) + len(dout) bits, so
+    words move every clock the widths allow: an N to M gearbox takes an
+    input word every clock when N <= M and gives an output word every clock
+    when N >= M. dout and dout_valid come straight from registers, din_ready
+    too, so neither side waits for the other within a clock.
+
+    :param rst:         Synchronous reset, empties the buffer
+    :param MSB_FIRST:   The MSB of every word is the first bit in time,
+                        otherwise the LSB
+    """
+    N = len(din)
+    M = len(dout)
+    C = N + M
+
+    buf, kept, placed = [Signal(intbv(0)[C:]) for _ in range(3)]
+    din_bits = Signal(intbv(0)[C:])
+    count, left = [Signal(intbv(0, min=0, max=C + 1)) for _ in range(2)]
+    take, put = [Signal(False) for _ in range(2)]
+
+    @always_comb
+    def handshake():
+        dout_valid.next = count >= M
+        din_ready.next = count <= C - N
+
+    @always_comb
+    def moves():
+        take.next = dout_valid and dout_ready
+        put.next = din_valid and din_ready
+
+    if isinstance(din.val, bool):
+        @always_comb
+        def input_bits():
+            din_bits.next = din
+    else:
+        @always_comb
+        def input_bits():
+            din_bits.next = din[N:]
+
+    # The checks on count are implied by take and put, but keep the
+    # simulation in range while the signals settle
+    @always_comb
+    def remaining():
+        if take and count >= M:
+            left.next = count - M
+        else:
+            left.next = count
+
+    if MSB_FIRST:
+        # The oldest bit at the top
+        if isinstance(dout.val, bool):
+            @always_comb
+            def output():
+                dout.next = buf[C - 1]
+        elif dout.min < 0:
+            @always_comb
+            def output():
+                dout.next = buf[C:C - M].signed()
+        else:
+            @always_comb
+            def output():
+                dout.next = buf[C:C - M]
+
+        @always_comb
+        def remove():
+            if take:
+                kept.next = concat(buf[C - M:], intbv(0)[M:])
+            else:
+                kept.next = buf
+
+        @always_comb
+        def insert():
+            if put and left <= C - N:
+                placed.next = din_bits << (C - N - left)
+            else:
+                placed.next = 0
+    else:
+        # The oldest bit at the bottom
+        if isinstance(dout.val, bool):
+            @always_comb
+            def output():
+                dout.next = buf[0]
+        elif dout.min < 0:
+            @always_comb
+            def output():
+                dout.next = buf[M:].signed()
+        else:
+            @always_comb
+            def output():
+                dout.next = buf[M:]
+
+        @always_comb
+        def remove():
+            if take:
+                kept.next = buf >> M
+            else:
+                kept.next = buf
+
+        @always_comb
+        def insert():
+            if put and left <= C - N:
+                placed.next = din_bits << left
+            else:
+                placed.next = 0
+
+    @always(clk.posedge)
+    def store():
+        if rst:
+            buf.next = 0
+            count.next = 0
+        else:
+            buf.next = kept | placed
+            if put:
+                count.next = left + N
+            else:
+                count.next = left
+
+    return handshake, moves, input_bits, remaining, output, remove, insert, \
+        store
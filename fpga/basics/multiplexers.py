@@ -1,46 +1,218 @@
-#!/usr/env/python
+#!/usr/bin/env python
 
 from __future__ import print_function
-from myhdl import block, Signal, intbv, always
+from myhdl import block, Signal, intbv, always, always_comb
+
+from fpga.basics.flipflops import dff
 
 __author__ = 'michiel'
 
 
-@block
-def mux3(a, b, c, dout, sel, zero_start=True):
+def mux_levels(inputs):
+    """Number of 2:1 levels of a MuxTree over inputs signals."""
+    return (inputs - 1).bit_length()
+
+
+def mux_latency(inputs, stages=0):
+    """Clocks from (inputs, sel) to dout of a MuxTree.
+
+    :param inputs:  Number of inputs
+    :param stages:  Register stages, None for a register after every level
+    """
+    return mux_levels(inputs) if stages is None else stages
+
 
-    if zero_start:
-        @always(a, b, c, sel)
+def _registered_levels(levels, stages):
+    """The levels followed by a register, spread evenly with the last one at
+    the output."""
+    return set(-(-k * levels // stages) for k in range(1, stages + 1))
+
+
+def _like(example):
+    if isinstance(example.val, bool):
+        return Signal(False)
+    return Signal(intbv(0, min=example.min, max=example.max))
+
+
+@block
+def MuxNode(a, b, sel, dout, clk=None):
+    """2:1 mux of a MuxTree, registered with a clk."""
+    if clk is None:
+        @always_comb
         def logic():
-            if sel == 0:
-                dout.next = a
-            elif sel == 1:
+            if sel:
                 dout.next = b
             else:
-                dout.next = c
+                dout.next = a
     else:
-        @always(a, b, c, sel)
+        @always(clk.posedge)
         def logic():
-            if sel == 1:
-                dout.next = a
-            elif sel == 2:
+            if sel:
                 dout.next = b
-            elif sel == 3:
-                dout.next = c
             else:
-                dout.next = 0
+                dout.next = a
 
     return logic
 
 
 @block
-def mux2(a, b, dout, sel):
-
-    @always(a, b, sel)
+def SelectGate(din, sel, dout):
+    """din when sel, otherwise 0."""
+    @always_comb
     def logic():
-        if sel == 0:
-            dout.next = a
+        if sel:
+            dout.next = din
         else:
-            dout.next = b
+            dout.next = 0
+
+    return logic
+
+
+@block
+def OrNode(a, b, dout, clk=None):
+    """OR of a one-hot MuxTree, registered with a clk."""
+    if clk is None:
+        @always_comb
+        def logic():
+            dout.next = a | b
+    else:
+        @always(clk.posedge)
+        def logic():
+            dout.next = a | b
 
     return logic
+
+
+@block
+def MuxTree(clk, inputs, sel, dout, stages=0, one_hot=False):
+    """Multiplexer of any number of inputs as a balanced tree of 2:1 muxes,
+    log2(len(inputs)) levels deep instead of a priority chain of
+    len(inputs).
+
+    With a binary select, input sel goes to dout and level n of the tree
+    switches on bit n - 1 of sel. Higher bits of sel are ignored, selects
+    past the last input give one of the inputs. With a one-hot select,
+    input i goes to dout when bit i of sel is set: every input is gated by
+    its bit and the tree ORs them, so no bits set gives 0.
+
+    The register stages are spread evenly over the levels, the last one at
+    the output, and the select is delayed along with the data. See
+    mux_latency() for the clocks from inputs to dout.
+
+    :param clk:     Clock, may be None without register stages
+    :param inputs:  Signals of the same type as dout
+    :param stages:  Register stages, at most mux_levels(len(inputs)) or None
+                    for a register after every level
+    :param one_hot: Select with len(inputs) one-hot bits, otherwise binary
+    """
+    N = len(inputs)
+    if N < 2:
+        raise ValueError("A multiplexer needs at least 2 inputs")
+    LEVELS = mux_levels(N)
+    STAGES = mux_latency(N, stages)
+    if not 0 <= STAGES <= LEVELS:
+        raise ValueError("{} inputs have {} levels to register, not {}".format(
+            N, LEVELS, STAGES))
+    if STAGES and clk is None:
+        raise ValueError("Register stages need a clock")
+    WIDTH = 1 if isinstance(sel.val, bool) else len(sel)
+    if one_hot and WIDTH != N:
+        raise ValueError("A one-hot select of {} inputs needs {} bits, not "
+                         "{}".format(N, N, WIDTH))
+    if not one_hot and WIDTH < LEVELS:
+        raise ValueError("A binary select of {} inputs needs {} bits, not "
+                         "{}".format(N, LEVELS, WIDTH))
+    registered = _registered_levels(LEVELS, STAGES) if STAGES else set()
+
+    def select_bit(signal, i):
+        return signal if isinstance(signal.val, bool) else signal(i)
+
+    instances = []
+    if one_hot:
+        signals = [_like(dout) for _ in range(N)]
+        for i in range(N):
+            instances.append(SelectGate(inputs[i], select_bit(sel, i),
+                                        signals[i]))
+    else:
+        signals = list(inputs)
+        # The select as seen by the level after every register stage
+        delayed = [sel]
+        for _ in range(STAGES - 1):
+            delayed.append(_like(sel))
+            instances.append(dff(clk, delayed[-2], delayed[-1]))
+
+    for level in range(1, LEVELS + 1):
+        register = clk if level in registered else None
+        if not one_hot:
+            bit = select_bit(
+                delayed[len([l for l in registered if l < level])], level - 1)
+        outputs = []
+        for i in range(0, len(signals), 2):
+            out = dout if level == LEVELS else _like(dout)
+            if i + 1 == len(signals):
+                # An odd one out, just the register if any
+                if register is None:
+                    out = signals[i]
+                else:
+                    instances.append(dff(clk, signals[i], out))
+            elif one_hot:
+                instances.append(OrNode(signals[i], signals[i + 1], out,
+                                          register))
+            else:
+                instances.append(MuxNode(signals[i], signals[i + 1], bit,
+                                           out, register))
+            outputs.append(out)
+        signals = outputs
+
+    return instances
+
+
+@block
+def _SelectLookup(sel, pick, TABLE):
+    """pick is TABLE[sel], a constant lookup instead of a priority chain."""
+
+    @always_comb
+    def lookup():
+        pick.next = TABLE[int(sel)]
+
+    return lookup
+
+
+def _select_table(sel, table):
+    """The constant lookup table[sel] for every value of sel as a tuple,
+    None when it doesn't change the select."""
+    WIDTH = 1 if isinstance(sel.val, bool) else len(sel)
+    table = tuple(table(i) for i in range(2 ** WIDTH))
+    return None if table == tuple(range(2 ** WIDTH)) else table
+
+
+@block
+def mux3(a, b, c, dout, sel, zero_start=True):
+    """sel 0, 1 and 2 select a, b and c, larger values c as well. Without
+    zero_start sel 1, 2 and 3 do and any other value gives 0."""
+    if not zero_start:
+        # Was: if sel == 1: a, elif sel == 2: b, elif sel == 3: c, else 0
+        TABLE = tuple(1 << (i - 1) if 1 <= i <= 3 else 0
+                      for i in range(2 ** len(sel)))
+        pick = Signal(intbv(0)[3:])
+        return _SelectLookup(sel, pick, TABLE), \
+            MuxTree(None, [a, b, c], pick, dout, one_hot=True)
+
+    # Was: if sel == 0: a, elif sel == 1: b, else c
+    TABLE = _select_table(sel, lambda i: min(i, 2))
+    if TABLE is None:
+        return MuxTree(None, [a, b, c], sel, dout)
+    pick = Signal(intbv(0)[2:])
+    return _SelectLookup(sel, pick, TABLE), MuxTree(None, [a, b, c], pick, dout)
+
+
+@block
+def mux2(a, b, dout, sel):
+    """sel 0 selects a, any other value b."""
+    # Was: if sel == 0: a, else b
+    TABLE = _select_table(sel, lambda i: min(i, 1))
+
+    if TABLE is None:
+        return MuxTree(None, [a, b], sel, dout)
+    pick = Signal(False)
+    return _SelectLookup(sel, pick, TABLE), MuxTree(None, [a, b], pick, dout)
@@ -3,7 +3,7 @@
 __author__ = 'michiel'
 
 from myhdl import block, Signal, intbv, always, always_comb, concat, toVHDL
-from fpga.utils import create_signals
+from fpga.utils import create_signals, create_same_signals
 from .ram import ShiftRegister
 
 
@@ -114,19 +114,152 @@ def Multiplier35Bit(clk, rst, a, b, p):
 
 
 @block
-def AddressableMultiplier35Bit(clk, ce, rst, a, b, p, address_in, address_out):
+def KaratsubaMultiplier35Bit(clk, rst, a, b, p):
+    """
+    Multiplier35Bit with three instead of four 18x18 multipliers, same ports
+    and the same delay of 5 clock cycles.
+
+    With a = ah * 2**17 + al and b = bh * 2**17 + bl the cross terms come
+    from one product (Karatsuba):
+
+        ah * bl + al * bh = (ah + al) * (bh + bl) - ah * bh - al * bl
+
+    The sums sa = ah + al and sb = bh + bl are 19 bits, so their LSBs are
+    split off (sa = 2 * X + x0) and added in the fabric:
+
+        sa * sb = 4 * X * Y + 2 * x0 * Y + y0 * sa
+
+    Clock 1: slices and sums, 2: ah * bh, al * bl, X * Y and the correction,
+    3: cross terms, 4: sum of all, 5: output register.
+
+    :param a:
+    :param b:
+    :param p:
+    :param clk:
+    :param rst:
+    :return:
+    """
+    A_MAX = len(a)
+    assert A_MAX == len(b) == 35
+    LOW = 17
+
+    def signal(low, high):
+        return Signal(intbv(0, min=low, max=high + 1))
+
+    high_range, low_range = (-2 ** LOW, 2 ** LOW - 1), (0, 2 ** LOW - 1)
+    sum_range = (-2 ** LOW, 2 ** (LOW + 1) - 2)
+    half_range = (sum_range[0] >> 1, sum_range[1] >> 1)
+    m1_range = _product_range(high_range, high_range)
+    m2_range = _product_range(low_range, low_range)
+    m3_range = _product_range(half_range, half_range)
+    corr_range = (2 * half_range[0] + sum_range[0],
+                  2 * half_range[1] + sum_range[1])
+    cross_range = (2 * _product_range(high_range, low_range)[0],
+                   2 * _product_range(high_range, low_range)[1])
+
+    a_upper, b_upper, au_buf, bu_buf = [signal(*high_range) for _ in range(4)]
+    a_lower, b_lower, al_buf, bl_buf = [signal(*low_range) for _ in range(4)]
+    sa_buf, sb_buf = [signal(*sum_range) for _ in range(2)]
+    x_half, y_half = [signal(*half_range) for _ in range(2)]
+    x_corr, y_corr = signal(*half_range), signal(*sum_range)
+    mult1, bufm1, bufm11 = [signal(*m1_range) for _ in range(3)]
+    mult2, bufm2, bufm22 = [signal(*m2_range) for _ in range(3)]
+    mult3, bufm3 = [signal(*m3_range) for _ in range(2)]
+    corr = signal(*corr_range)
+    cross = signal(*cross_range)
+    adder, bufout = create_signals(2, len(p), signed=True)
+
+    @always(clk.posedge)
+    def clocked_logic():
+        if rst:
+            au_buf.next = 0
+            bu_buf.next = 0
+            al_buf.next = 0
+            bl_buf.next = 0
+            sa_buf.next = 0
+            sb_buf.next = 0
+            bufm1.next = 0
+            bufm2.next = 0
+            bufm3.next = 0
+            corr.next = 0
+            bufm11.next = 0
+            bufm22.next = 0
+            cross.next = 0
+            bufout.next = 0
+            p.next = 0
+        else:
+            au_buf.next = a_upper
+            bu_buf.next = b_upper
+            al_buf.next = a_lower
+            bl_buf.next = b_lower
+            sa_buf.next = a_upper + a_lower
+            sb_buf.next = b_upper + b_lower
+            bufm1.next = mult1
+            bufm2.next = mult2
+            bufm3.next = mult3
+            corr.next = (x_corr << 1) + y_corr
+            bufm11.next = bufm1
+            bufm22.next = bufm2
+            cross.next = (bufm3 << 2) + corr - bufm1 - bufm2
+            bufout.next = adder
+            p.next = bufout
+
+    @always_comb
+    def comb_logic():
+        a_upper.next = a[A_MAX:LOW].signed()
+        a_lower.next = a[LOW:]
+        b_upper.next = b[A_MAX:LOW].signed()
+        b_lower.next = b[LOW:]
+
+    @always_comb
+    def split_sums():
+        x_half.next = sa_buf >> 1
+        y_half.next = sb_buf >> 1
+        if sa_buf[0]:
+            x_corr.next = sb_buf >> 1
+        else:
+            x_corr.next = 0
+        if sb_buf[0]:
+            y_corr.next = sa_buf
+        else:
+            y_corr.next = 0
+
+    @always_comb
+    def adders():
+        adder.next = (bufm11 << (2 * LOW)) + (cross << LOW) + bufm22
+
+    @always_comb
+    def multipliers():
+        mult1.next = au_buf * bu_buf
+        mult2.next = al_buf * bl_buf
+        mult3.next = x_half * y_half
+
+    return clocked_logic, comb_logic, split_sums, adders, multipliers
+
+
+@block
+def AddressableMultiplier35Bit(clk, ce, rst, a, b, p, address_in, address_out,
+                               karatsuba=False):
+    """
+    :param karatsuba:   Use the KaratsubaMultiplier35Bit (3 instead of 4 DSPs)
+    """
     assert address_in.min == address_out.min and \
         address_in.max == address_out.max
 
-    #: Shift register with 4 clock cycles delay (multiplier pipeline)
-    address_shift = ShiftRegister(address_in, ce, address_out, clk, rst, 5)
-    multiplier = Multiplier35Bit(a, b, p, clk, rst)
+    #: Shift register with 5 clock cycles delay (multiplier pipeline)
+    address_shift = ShiftRegister(clk, ce, address_in, address_out, rst,
+                                  length=5)
+    if karatsuba:
+        multiplier = KaratsubaMultiplier35Bit(clk, rst, a, b, p)
+    else:
+        multiplier = Multiplier35Bit(clk, rst, a, b, p)
 
     return address_shift, multiplier
 
 
 @block
-def SharedMultiplier(clk, ce, rst, a_signals, b_signals, load, p_signals, p_rdys):
+def SharedMultiplier(clk, ce, rst, a_signals, b_signals, load, p_signals, p_rdys,
+                     karatsuba=False):
     assert len(a_signals) == len(b_signals) == len(p_signals)
     assert load.max >= len(a_signals) + 1, "Make sure all signals can be loaded and one extra space for the empty load"
     assert len(a_signals[0]) == 35
@@ -139,8 +272,9 @@ def SharedMultiplier(clk, ce, rst, a_signals, b_signals, load, p_signals, p_rdys
     output_buffers = create_signals(len(p_signals), 2 * 35, signed=True)
     ready_buffers = create_signals(len(p_signals))
 
-    mult_inst = AddressableMultiplier35Bit(mult_a, mult_b, mult_out, addr_in,
-                                           addr_out, ce, clk, rst)
+    mult_inst = AddressableMultiplier35Bit(clk, ce, rst, mult_a, mult_b,
+                                           mult_out, addr_in, addr_out,
+                                           karatsuba)
 
     @always(clk.posedge)
     def load_data():
@@ -173,7 +307,8 @@ def SharedMultiplier(clk, ce, rst, a_signals, b_signals, load, p_signals, p_rdys
 
 @block
 def ThreePortMultiplier35Bit(a, b, c, d, e, f, load, clk_ena, clk, rst,
-                             ab, ab_rdy, cd, cd_rdy, ef, ef_rdy):
+                             ab, ab_rdy, cd, cd_rdy, ef, ef_rdy,
+                             karatsuba=False):
     assert a._nrbits == b._nrbits == c._nrbits == d._nrbits == e._nrbits \
         == f._nrbits == 35
     assert len(load) > 1
@@ -185,8 +320,9 @@ def ThreePortMultiplier35Bit(a, b, c, d, e, f, load, clk_ena, clk, rst,
     p_ab, p_cd, p_ef = create_signals(3, 2 * 35, signed=True)
     ab_rdy_dly, cd_rdy_dly, ef_rdy_dly = create_signals(3)
 
-    mult_inst = AddressableMultiplier35Bit(mult_a, mult_b, mult_out, addr_in,
-                                           addr_out, clk_ena, clk, rst)
+    mult_inst = AddressableMultiplier35Bit(clk, clk_ena, rst, mult_a, mult_b,
+                                           mult_out, addr_in, addr_out,
+                                           karatsuba)
 
     @always(clk.posedge)
     def load_data():
@@ -242,3 +378,342 @@ def ThreePortMultiplier35Bit(a, b, c, d, e, f, load, clk_ena, clk, rst,
 
     return mult_inst, load_data, clock_output, set_output_ab, set_output_cd, \
         set_output_ef
+
+
+#: DSP primitive shapes (a port bits, b port bits), both ports are signed
+DSP_18X18 = (18, 18)    # Spartan-3A DSP/Spartan-6 DSP48A(1)
+DSP_25X18 = (25, 18)    # Virtex-5 up to 7-series DSP48E(1)
+DSP_27X18 = (27, 18)    # UltraScale DSP48E2
+#: Clock cycles through a DSP tile: input (A/B), multiplier (M) and P register
+DSP_LATENCY = 3
+
+
+def _operand_slices(bits, signed, port):
+    """Split an operand in (low, high, signed) slices for a signed DSP port.
+
+    Only the top slice of a signed operand is signed, the others need a zero
+    sign bit and so take one bit less.
+    """
+    slices = []
+    low = 0
+    while bits - low > (port if signed else port - 1):
+        slices.append((low, low + port - 1, False))
+        low += port - 1
+    slices.append((low, bits, signed))
+    return slices
+
+
+def _multiplier_tiles(a, b, dsp):
+    """Slices of a and b, putting the operands on the DSP ports that need the
+    least tiles."""
+    a_signed, b_signed = a.min < 0, b.min < 0
+    straight = (_operand_slices(len(a), a_signed, dsp[0]),
+                _operand_slices(len(b), b_signed, dsp[1]))
+    swapped = (_operand_slices(len(a), a_signed, dsp[1]),
+               _operand_slices(len(b), b_signed, dsp[0]))
+    if len(swapped[0]) * len(swapped[1]) < len(straight[0]) * len(straight[1]):
+        return swapped
+    return straight
+
+
+def _slice_range(low, high, signed):
+    if signed:
+        return -2 ** (high - low - 1), 2 ** (high - low - 1) - 1
+    return 0, 2 ** (high - low) - 1
+
+
+def _product_range(x, y):
+    corners = [i * j for i in x for j in y]
+    return min(corners), max(corners)
+
+
+def _adder_levels(partials):
+    levels = 0
+    while partials > 1:
+        partials = (partials + 1) // 2
+        levels += 1
+    return levels
+
+
+def multiplier_latency(a, b, dsp=DSP_25X18, latency=None):
+    """Clock cycles from a and b to p of a PipelinedMultiplier.
+
+    :param a:       Operand signal a
+    :param b:       Operand signal b
+    :param dsp:     DSP shape, DSP_18X18, DSP_25X18 or DSP_27X18
+    :param latency: Target latency, None pipelines every adder level
+    """
+    a_tiles, b_tiles = _multiplier_tiles(a, b, dsp)
+    levels = _adder_levels(len(a_tiles) * len(b_tiles))
+    if latency is None:
+        return DSP_LATENCY + levels
+
+    minimum = DSP_LATENCY + (1 if levels else 0)
+    assert latency >= minimum, \
+        "A {}x{} multiplier needs a latency of at least {}".format(
+            len(a), len(b), minimum)
+    return latency
+
+
+@block
+def MultiplierTile(clk, rst, a, b, p, A_LOW, A_HIGH, A_SIGNED, B_LOW, B_HIGH,
+                    B_SIGNED):
+    """One DSP: registered slices of a and b, multiplier and P register."""
+    a_min, a_max = _slice_range(A_LOW, A_HIGH, A_SIGNED)
+    b_min, b_max = _slice_range(B_LOW, B_HIGH, B_SIGNED)
+    a_slice, a_reg = [Signal(intbv(0, min=a_min, max=a_max + 1)) for _ in range(2)]
+    b_slice, b_reg = [Signal(intbv(0, min=b_min, max=b_max + 1)) for _ in range(2)]
+    m = Signal(intbv(0, min=p.min, max=p.max))
+
+    if A_SIGNED:
+        @always_comb
+        def slice_a():
+            a_slice.next = a[A_HIGH:A_LOW].signed()
+    else:
+        @always_comb
+        def slice_a():
+            a_slice.next = a[A_HIGH:A_LOW]
+
+    if B_SIGNED:
+        @always_comb
+        def slice_b():
+            b_slice.next = b[B_HIGH:B_LOW].signed()
+    else:
+        @always_comb
+        def slice_b():
+            b_slice.next = b[B_HIGH:B_LOW]
+
+    @always(clk.posedge)
+    def registers():
+        if rst:
+            a_reg.next = 0
+            b_reg.next = 0
+            m.next = 0
+            p.next = 0
+        else:
+            a_reg.next = a_slice
+            b_reg.next = b_slice
+            m.next = a_reg * b_reg
+            p.next = m
+
+    return slice_a, slice_b, registers
+
+
+@block
+def AdderNode(clk, rst, x, y, s, X_SHIFT, Y_SHIFT, REGISTERED):
+    if REGISTERED:
+        @always(clk.posedge)
+        def add():
+            if rst:
+                s.next = 0
+            else:
+                s.next = (x << X_SHIFT) + (y << Y_SHIFT)
+    else:
+        @always_comb
+        def add():
+            s.next = (x << X_SHIFT) + (y << Y_SHIFT)
+
+    return add
+
+
+@block
+def PipeNode(clk, rst, x, s, REGISTERED):
+    if REGISTERED:
+        @always(clk.posedge)
+        def pipe():
+            if rst:
+                s.next = 0
+            else:
+                s.next = x
+    else:
+        @always_comb
+        def pipe():
+            s.next = x
+
+    return pipe
+
+
+@block
+def PipelinedMultiplier(clk, rst, a, b, p, dsp=DSP_25X18, latency=None):
+    """
+    p = a * b for any operand width and signedness (taken from the signals).
+
+    The operands are cut into slices that fit the DSP primitive, every pair
+    of slices is multiplied in its own fully registered DSP tile and the
+    partial products are summed by a balanced adder tree. With latency None
+    every adder level gets a register (highest fmax), a lower target latency
+    merges adder levels, a higher one adds output registers. See
+    multiplier_latency() to size the pipelines running along.
+
+    :param clk:
+    :param rst:     Synchronous reset
+    :param a:
+    :param b:
+    :param p:       Product, wide enough for any a * b
+    :param dsp:     DSP shape, DSP_18X18, DSP_25X18 or DSP_27X18
+    :param latency: Target latency in clock cycles
+    :return:
+    """
+    a_tiles, b_tiles = _multiplier_tiles(a, b, dsp)
+    LATENCY = multiplier_latency(a, b, dsp, latency)
+    p_min, p_max = _product_range((a.min, a.max - 1), (b.min, b.max - 1))
+    assert p.min <= p_min and p.max > p_max, "p is too small for a * b"
+
+    # Spread the adder levels over the register stages after the tiles
+    levels = _adder_levels(len(a_tiles) * len(b_tiles))
+    stages = LATENCY - DSP_LATENCY
+    per_stage = -(-levels // min(stages, levels)) if levels else 0
+    registered = [(i + 1) % per_stage == 0 or i == levels - 1
+                  for i in range(levels)]
+    output_registers = stages - sum(registered)
+
+    tiles = []
+    partials = []       # (signal, shift, min, max)
+    for a_low, a_high, a_signed in a_tiles:
+        for b_low, b_high, b_signed in b_tiles:
+            low, high = _product_range(_slice_range(a_low, a_high, a_signed),
+                                       _slice_range(b_low, b_high, b_signed))
+            product = Signal(intbv(0, min=low, max=high + 1))
+            tiles.append(MultiplierTile(clk, rst, a, b, product,
+                                         a_low, a_high, a_signed,
+                                         b_low, b_high, b_signed))
+            partials.append((product, a_low + b_low, low, high))
+
+    nodes = []
+    for level in range(levels):
+        summed = []
+        for (x, x_shift, x_min, x_max), (y, y_shift, y_min, y_max) in \
+                zip(partials[0::2], partials[1::2]):
+            shift = min(x_shift, y_shift)
+            X_SHIFT, Y_SHIFT = x_shift - shift, y_shift - shift
+            low = (x_min << X_SHIFT) + (y_min << Y_SHIFT)
+            high = (x_max << X_SHIFT) + (y_max << Y_SHIFT)
+            s = Signal(intbv(0, min=low, max=high + 1))
+            nodes.append(AdderNode(clk, rst, x, y, s, X_SHIFT, Y_SHIFT,
+                                    registered[level]))
+            summed.append((s, shift, low, high))
+        if len(partials) % 2:
+            x, x_shift, x_min, x_max = partials[-1]
+            s = Signal(intbv(0, min=x_min, max=x_max + 1))
+            nodes.append(PipeNode(clk, rst, x, s, registered[level]))
+            summed.append((s, x_shift, x_min, x_max))
+        partials = summed
+
+    # The tile of both lowest slices has no shift, so neither has the sum
+    result = partials[0][0]
+    for i in range(output_registers - 1):
+        delayed = Signal(intbv(0, min=result.min, max=result.max))
+        nodes.append(PipeNode(clk, rst, result, delayed, True))
+        result = delayed
+    nodes.append(PipeNode(clk, rst, result, p, output_registers > 0))
+
+    return tiles, nodes
+
+
+@block
+def AddressableMultiplier(clk, ce, rst, a, b, p, address_in, address_out,
+                          dsp=DSP_25X18, latency=None):
+    """PipelinedMultiplier with the address delayed along."""
+    assert address_in.min == address_out.min and \
+        address_in.max == address_out.max
+
+    address_shift = ShiftRegister(clk, ce, address_in, address_out, rst,
+                                  length=multiplier_latency(a, b, dsp, latency))
+    multiplier = PipelinedMultiplier(clk, rst, a, b, p, dsp, latency)
+
+    return address_shift, multiplier
+
+
+@block
+def ArbitratedMultiplier(clk, rst, requests, grants, a_signals, b_signals,
+                         p, p_tag, p_rdys, round_robin=True, dsp=DSP_25X18,
+                         latency=None):
+    """
+    One PipelinedMultiplier shared by N clients, issuing one product per
+    clock.
+
+    Every clock the arbiter takes the operands of one requesting client,
+    round robin (starting after the last granted client) or by priority
+    (lowest client first), and strobes its bit in grants. The product comes
+    back multiplier_latency() + 2 clocks later on p, with the client number
+    on p_tag and its bit set in p_rdys.
+
+    :param requests:    N bit vector, bit i set when client i has operands
+    :param grants:      N bit vector, bit i set when the operands of client i
+                        were taken at the last clock edge
+    :param a_signals:   List of N operand a signals
+    :param b_signals:   List of N operand b signals
+    :param p:           Product of the client in p_tag
+    :param p_tag:       Client number of p, intbv(max=N) or wider
+    :param p_rdys:      N bit vector, bit i set when p is for client i
+    :param round_robin: False gives the lowest requesting client priority
+    """
+    N = len(a_signals)
+    assert len(b_signals) == N == len(requests) == len(grants) == len(p_rdys)
+    assert p_tag.max >= N
+
+    mult_a, mult_b = create_same_signals(1, a_signals[0]), \
+        create_same_signals(1, b_signals[0])
+    mult_out = Signal(intbv(0, min=p.min, max=p.max))
+    # Tag 0 is an empty slot in the pipeline, client i is i + 1
+    tag_in, tag_out = [Signal(intbv(0, min=0, max=N + 1)) for _ in range(2)]
+    last = Signal(intbv(N - 1, min=0, max=N))
+
+    LATENCY = multiplier_latency(mult_a, mult_b, dsp, latency)
+    tag_shift = ShiftRegister(clk, True, tag_in, tag_out, rst, length=LATENCY)
+    multiplier = PipelinedMultiplier(clk, rst, mult_a, mult_b, mult_out, dsp,
+                                     latency)
+
+    # Round robin starts searching after the last granted client
+    if round_robin:
+        first = Signal(intbv(0, min=0, max=N))
+
+        @always_comb
+        def search():
+            first.next = (last + 1) % N
+    else:
+        first = 0
+        search = []
+
+    @always(clk.posedge)
+    def issue():
+        if rst:
+            mult_a.next = 0
+            mult_b.next = 0
+            tag_in.next = 0
+            grants.next = 0
+            last.next = N - 1
+        else:
+            found = False
+            selected = 0
+            for i in range(N):
+                client = (first + i) % N
+                if not found and requests[client]:
+                    found = True
+                    selected = client
+
+            grants.next = 0
+            if found:
+                mult_a.next = a_signals[selected]
+                mult_b.next = b_signals[selected]
+                tag_in.next = selected + 1
+                grants.next[selected] = 1
+                last.next = selected
+            else:
+                mult_a.next = 0
+                mult_b.next = 0
+                tag_in.next = 0
+
+    @always(clk.posedge)
+    def results():
+        p_rdys.next = 0
+        if rst:
+            p.next = 0
+            p_tag.next = 0
+        else:
+            p.next = mult_out
+            if tag_out != 0:
+                p_tag.next = tag_out - 1
+                p_rdys.next[tag_out - 1] = 1
+
+    return tag_shift, multiplier, search, issue, results
@@ -1,74 +1,496 @@
 #!/usr/bin/env python
 
-from myhdl import block, Signal, always, intbv, always_comb, always_seq, ResetSignal
+from collections import deque
 
-from fpga.utils import create_signals, create_same_signals
+import numpy as np
+from myhdl import block, Signal, always, instance, intbv, always_seq, \
+    ResetSignal, bin
+
+from fpga.utils import create_signals
 
 __author__ = 'michiel'
 
 # For xilinx no async! (better performance)
 
+def _word_range(example):
+    """(min, max) of a word like the example signal, a bool is a 1 bit
+    word."""
+    if isinstance(example.val, bool):
+        return 0, 2
+    return example.min, example.max
+
+
+def _vhdl_word(example):
+    """VHDL type of a word like the example signal and its zero."""
+    if isinstance(example.val, bool):
+        return 'std_logic', "'0'"
+    return '{}({} - 1 downto 0)'.format(
+        'signed' if example.min < 0 else 'unsigned', len(example)), \
+        "(others => '0')"
+
+
+def ram_init(init_vals, length, example):
+    """Initial RAM contents as numpy array of length words.
+
+    :param init_vals:   None (all zeros), a sequence or numpy array of values,
+                        a .npy file or a text file with one hexadecimal word
+                        per line (like $readmemh), shorter contents are padded
+                        with zeros
+    :param length:      Number of words in the RAM
+    :param example:     Signal with the width and signedness of a word
+    """
+    bits = len(example)
+    low, high = _word_range(example)
+    dtype = np.int64 if bits < 64 else object
+    contents = np.zeros(length, dtype=dtype)
+    if init_vals is None:
+        return contents
+
+    if isinstance(init_vals, str):
+        if init_vals.endswith('.npy'):
+            values = np.load(init_vals, mmap_mode='r')
+        else:
+            with open(init_vals) as f:
+                values = np.array([int(line.split('//')[0], 16) for line in f
+                                   if line.split('//')[0].strip()],
+                                  dtype=dtype)
+            if low < 0:
+                # Two's complement words
+                values[values >= 2 ** (bits - 1)] -= 2 ** bits
+    else:
+        values = init_vals
+
+    assert len(values) <= length, "More initial values than RAM words"
+    contents[:len(values)] = values
+    assert contents.min() >= low and contents.max() < high, \
+        "Initial values don't fit in the RAM words"
+    return contents
+
+
+class _VhdlRamInit(object):
+    """VHDL aggregate of the RAM contents, only build when converting."""
+
+    def __init__(self, contents, example):
+        self.contents = contents
+        self.bits = len(example)
+        self.bit = isinstance(example.val, bool)
+
+    def __str__(self):
+        if not self.contents.any():
+            return "(others => {})".format(
+                "'0'" if self.bit else "(others => '0')")
+        if self.bit:
+            words = ("'{}'".format(int(value)) for value in self.contents)
+        else:
+            words = ('"{}"'.format(bin(int(value), self.bits))
+                     for value in self.contents)
+        return "(\n        {})".format(",\n        ".join(words))
+
+
 @block
 def OnePortRam(clk, we, addr, din, dout, reset=None, reset_active=1, init_vals=None, async_read=False):
+    """Single port RAM (read first), converts to an inferred block RAM or,
+    with async_read, distributed RAM.
+
+    The simulation keeps the contents in a numpy array, not a Signal per
+    word. Like the hardware, a reset only clears the output register, not
+    the contents.
 
+    :param init_vals:   Initial contents, see ram_init()
+    :param async_read:  dout follows addr without a clock
+    """
     ADDR_WIDTH = len(addr)
     RAM_LENGTH = 2 ** ADDR_WIDTH
 
-    if init_vals is None:
-        init_vals = [0 for _ in range(RAM_LENGTH)]
-        ram = create_same_signals(RAM_LENGTH, dout)
+    mem = ram_init(init_vals, RAM_LENGTH, dout)
+    word_type, zero = _vhdl_word(dout)
+    ram_init_vhdl = _VhdlRamInit(mem, dout)
+
+    if reset is None:
+        read_vhdl = "$dout <= ram(to_integer($addr));"
     else:
-        todo = RAM_LENGTH - len(init_vals)
-        for i in range(todo):
-            init_vals.append(0)
-        ram = [Signal(intbv(value, dout.min, dout.max)) for value in init_vals]
+        assert not getattr(reset, 'isasync', False), \
+            "Block RAM output registers only have a synchronous reset"
+        read_vhdl = """if $reset = '{}' then
+                $dout <= {};
+            else
+                $dout <= ram(to_integer($addr));
+            end if;""".format(int(getattr(reset, 'active', reset_active)), zero)
+
+    for signal in (clk, we, addr, din):
+        signal.read = True
+    if reset is not None:
+        reset.read = True
 
     if async_read:
-        if reset is None or isinstance(reset, ResetSignal):
-            @always_seq(clk.posedge, reset=reset)
-            def write():
-                if we == 1:
-                    # TODO(michiel): Is this still necessary??????? (upgrade to myhdl 1.0)
-                    # Note how we use the val attribute of the din signal, as we don't want to store
-                    # the signal object itself, but its current value. Similarly, we use the val
-                    # attribute of the addr signal as the dictionary key.
-                    ram[int(addr)].next = din
-        else:
-            @always(clk.posedge)
-            def write():
-                if reset == reset_active:
-                    for i, r in enumerate(ram):
-                        r.next = init_vals[i]
-                else:
-                    ram[int(addr)].next = din
+        @always(clk.posedge)
+        def write():
+            if we:
+                mem[int(addr)] = int(din)
+                # The write shows on the (asynchronous) output
+                dout.next = din
 
-        @always_comb
+        @instance
         def read():
-            dout.next = ram[int(addr)]
-
+            # From the start, like the initialised RAM in the hardware
+            while True:
+                dout.next = int(mem[int(addr)])
+                yield addr
+
+        dout.driven = 'wire'
+        OnePortRam.vhdl_code = """
+${dout}_ram: block
+    type t_ram is array(0 to $RAM_LENGTH - 1) of $word_type;
+    signal ram: t_ram := $ram_init_vhdl;
+begin
+    process ($clk) is
+    begin
+        if rising_edge($clk) then
+            if $we = '1' then
+                ram(to_integer($addr)) <= $din;
+            end if;
+        end if;
+    end process;
+
+    $dout <= ram(to_integer($addr));
+end block ${dout}_ram;
+"""
         return write, read
 
     else:
         if reset is None or isinstance(reset, ResetSignal):
             @always_seq(clk.posedge, reset=reset)
             def read_write():
-                dout.next = ram[int(addr)]
+                dout.next = int(mem[int(addr)])
                 if we:
-                    ram[int(addr)].next = din
+                    mem[int(addr)] = int(din)
         else:
-            @always_seq(clk.posedge, reset=reset)
+            @always(clk.posedge)
             def read_write():
                 if reset == reset_active:
-                    for i, r in enumerate(ram):
-                        r.next = init_vals[i]
                     dout.next = 0
                 else:
-                    dout.next = ram[int(addr)]
-                    if we:
-                        ram[int(addr)].next = din
+                    dout.next = int(mem[int(addr)])
+                if we:
+                    mem[int(addr)] = int(din)
+
+        dout.driven = 'reg'
+        OnePortRam.vhdl_code = """
+${dout}_ram: block
+    type t_ram is array(0 to $RAM_LENGTH - 1) of $word_type;
+    signal ram: t_ram := $ram_init_vhdl;
+begin
+    process ($clk) is
+    begin
+        if rising_edge($clk) then
+            """ + read_vhdl + """
+            if $we = '1' then
+                ram(to_integer($addr)) <= $din;
+            end if;
+        end if;
+    end process;
+end block ${dout}_ram;
+"""
+        return read_write
+
+
+#: Write modes: what a port reads in the clock it writes
+READ_FIRST = 'read_first'
+WRITE_FIRST = 'write_first'
+NO_CHANGE = 'no_change'
+RAM_MODES = (READ_FIRST, WRITE_FIRST, NO_CHANGE)
+
+
+def _ram_writer(mem, example, we):
+    """Write function for the simulation of mem, with a byte enable per
+    bit of we when we is wider than 1 bit.
+
+    The function returns the word as written."""
+    bits = len(example)
+    nr_bytes = len(we)
+    if nr_bytes == 1:
+        def write(addr, din, enables):
+            mem[addr] = din
+            return din
+        return write
+
+    assert bits % nr_bytes == 0, "The byte enables must split the word evenly"
+    byte_bits = bits // nr_bytes
+    masks = [((1 << byte_bits) - 1) << (i * byte_bits) for i in range(nr_bytes)]
+    word_mask = (1 << bits) - 1
+    signed = _word_range(example)[0] < 0
+
+    def write(addr, din, enables):
+        word = int(mem[addr]) & word_mask
+        for i in range(nr_bytes):
+            if enables >> i & 1:
+                word = word & ~masks[i] | din & masks[i]
+        if signed and word >> (bits - 1):
+            word -= 1 << bits
+        mem[addr] = word
+        return word
+
+    return write
+
+
+def _vhdl_ram_write(we, addr, din, nr_bytes, bits, assign='<='):
+    """VHDL lines writing $din to ram($addr), per byte when nr_bytes > 1."""
+    if nr_bytes == 1:
+        return ["if ${} = '1' then".format(we),
+                "    ram(to_integer(${})) {} ${};".format(addr, assign, din),
+                "end if;"]
+
+    byte_bits = bits // nr_bytes
+    byte = "((i + 1) * {0} - 1 downto i * {0})".format(byte_bits)
+    return ["for i in 0 to {} - 1 loop".format(nr_bytes),
+            "    if ${}(i) = '1' then".format(we),
+            "        ram(to_integer(${})){} {} ${}{};".format(addr, byte, assign,
+                                                         din, byte),
+            "    end if;",
+            "end loop;"]
+
+
+def _vhdl_ram_read(addr, dout, reset, reset_active, enable=None,
+                   zero="(others => '0')"):
+    """VHDL lines reading ram($addr) into $dout, with the output register
+    reset (to zero) and enable ($enable)."""
+    read = "${} <= ram(to_integer(${}));".format(dout, addr)
+    if reset is None:
+        if enable is None:
+            return [read]
+        return ["if ${} = '1' then".format(enable), "    " + read, "end if;"]
+
+    assert not getattr(reset, 'isasync', False), \
+        "Block RAM output registers only have a synchronous reset"
+    return ["if $reset = '{}' then".format(int(getattr(reset, 'active',
+                                                       reset_active))),
+            "    ${} <= {};".format(dout, zero),
+            "else" if enable is None else "elsif ${} = '1' then".format(enable),
+            "    " + read,
+            "end if;"]
+
+
+def _vhdl_ram_port(we, addr, din, dout, nr_bytes, bits, reset, reset_active,
+                   mode, assign=':=', zero="(others => '0')"):
+    """VHDL lines of a read/write port in the given write mode."""
+    assert mode in RAM_MODES, "Unknown write mode {!r}".format(mode)
+    write = _vhdl_ram_write(we, addr, din, nr_bytes, bits, assign)
+    read = _vhdl_ram_read(addr, dout, reset, reset_active, zero=zero)
+    if mode == READ_FIRST:
+        return read + write
+    elif mode == WRITE_FIRST:
+        return write + read
+
+    idle = "${} = '0'".format(we) if nr_bytes == 1 else "${} = 0".format(we)
+    return write + ["if {} then".format(idle)] + \
+        ["    " + line for line in read] + ["end if;"]
+
+
+def _vhdl_process(clk, lines):
+    return """
+    process (${0}) is
+    begin
+        if rising_edge(${0}) then
+            {1}
+        end if;
+    end process;
+""".format(clk, "\n            ".join(lines))
+
+
+def _mark_ports(inputs, outputs, reset):
+    for signal in inputs:
+        signal.read = True
+    if reset is not None:
+        reset.read = True
+    for signal in outputs:
+        signal.driven = 'reg'
+
+
+@block
+def SimpleTwoPortRam(wclk, we, waddr, din, rclk, raddr, dout, reset=None,
+                     reset_active=1, init_vals=None, mode=READ_FIRST, re=True):
+    """Simple dual port RAM: one write and one read port, converts to an
+    inferred block RAM.
+
+    The ports can have their own clock. A we of more than 1 bit is a byte
+    enable: bit i writes the i-th slice of len(din) // len(we) bits. The
+    reset only clears dout, synchronous to rclk.
+
+    :param init_vals:   Initial contents, see ram_init()
+    :param mode:        What dout shows when raddr is written in the same
+                        clock: the old word (READ_FIRST) or the new one
+                        (WRITE_FIRST, only with wclk is rclk). NO_CHANGE is
+                        a mode of ports that read and write, see
+                        TrueTwoPortRam
+    :param re:          Read enable, dout only loads when re (the reset
+                        goes first), True for always reading
+    """
+    ADDR_WIDTH = len(waddr)
+    RAM_LENGTH = 2 ** ADDR_WIDTH
+    DATA_WIDTH = len(dout)
+    NR_BYTES = len(we)
+
+    assert len(raddr) == ADDR_WIDTH and len(din) == DATA_WIDTH
+    assert mode in (READ_FIRST, WRITE_FIRST), \
+        "A simple dual port RAM is read first or write first"
+    assert mode == READ_FIRST or wclk is rclk, \
+        "Write first needs a single clock"
+
+    mem = ram_init(init_vals, RAM_LENGTH, dout)
+    write = _ram_writer(mem, dout, we)
+    word_type, zero = _vhdl_word(dout)
+    ram_init_vhdl = _VhdlRamInit(mem, dout)
+    active = int(getattr(reset, 'active', reset_active))
+    _mark_ports((wclk, we, waddr, din, rclk, raddr), (dout, ), reset)
+    if not isinstance(re, bool):
+        re.read = True
+    else:
+        assert re, "Read enable never True cannot be allowed!"
+
+    write_vhdl = _vhdl_ram_write('we', 'waddr', 'din', NR_BYTES, DATA_WIDTH,
+                                 '<=' if mode == READ_FIRST else ':=')
+    read_vhdl = _vhdl_ram_read('raddr', 'dout', reset, reset_active,
+                               None if isinstance(re, bool) else 're', zero)
+    if mode == READ_FIRST:
+        # A signal holds the old word until after the clock
+        ram_vhdl = "signal ram: t_ram := $ram_init_vhdl;"
+        processes_vhdl = _vhdl_process('wclk', write_vhdl) + \
+            _vhdl_process('rclk', read_vhdl)
+    else:
+        ram_vhdl = "shared variable ram: t_ram := $ram_init_vhdl;"
+        processes_vhdl = _vhdl_process('wclk', write_vhdl + read_vhdl)
+
+    SimpleTwoPortRam.vhdl_code = """
+${dout}_ram: block
+    type t_ram is array(0 to $RAM_LENGTH - 1) of $word_type;
+    """ + ram_vhdl + """
+begin""" + processes_vhdl + """end block ${dout}_ram;
+"""
+
+    if wclk is rclk:
+        # One process, so the order of reading and writing is defined
+        @always(wclk.posedge)
+        def read_write():
+            if mode == READ_FIRST:
+                word = int(mem[int(raddr)])
+            if we:
+                write(int(waddr), int(din), int(we))
+            if mode == WRITE_FIRST:
+                word = int(mem[int(raddr)])
+            if reset is not None and reset == active:
+                dout.next = 0
+            elif re:
+                dout.next = word
 
         return read_write
 
+    @always(wclk.posedge)
+    def write_port():
+        if we:
+            write(int(waddr), int(din), int(we))
+
+    @always(rclk.posedge)
+    def read_port():
+        if reset is not None and reset == active:
+            dout.next = 0
+        elif re:
+            dout.next = int(mem[int(raddr)])
+
+    return write_port, read_port
+
+
+@block
+def TrueTwoPortRam(clka, wea, addra, dina, douta, clkb, web, addrb, dinb,
+                   doutb, reset=None, reset_active=1, init_vals=None,
+                   mode=READ_FIRST):
+    """True dual port RAM: two read/write ports with their own clock,
+    converts to an inferred block RAM.
+
+    A we of more than 1 bit is a byte enable: bit i writes the i-th slice of
+    len(din) // len(we) bits. The reset clears both outputs, synchronous to
+    the clock of the port. Like the hardware, writing one address from both
+    ports in the same clock gives undefined results. Reading an address
+    while the other port writes it gives the old word when both ports have
+    one clock (clka is clkb) and the writing port is READ_FIRST, otherwise
+    it is undefined too.
+
+    :param init_vals:   Initial contents, see ram_init()
+    :param mode:        What a port reads in the clock it writes: the old word
+                        (READ_FIRST), the new one (WRITE_FIRST) or dout keeps
+                        its value (NO_CHANGE). A tuple sets the modes of
+                        port a and b separately.
+    """
+    ADDR_WIDTH = len(addra)
+    RAM_LENGTH = 2 ** ADDR_WIDTH
+    DATA_WIDTH = len(douta)
+
+    assert len(addrb) == ADDR_WIDTH
+    assert DATA_WIDTH == len(dina) == len(dinb) == len(doutb)
+    mode_a, mode_b = (mode, mode) if isinstance(mode, str) else mode
+
+    mem = ram_init(init_vals, RAM_LENGTH, douta)
+    word_type, zero = _vhdl_word(douta)
+    ram_init_vhdl = _VhdlRamInit(mem, douta)
+    active = int(getattr(reset, 'active', reset_active))
+    _mark_ports((clka, wea, addra, dina, clkb, web, addrb, dinb),
+                (douta, doutb), reset)
+
+    TrueTwoPortRam.vhdl_code = """
+${douta}_ram: block
+    type t_ram is array(0 to $RAM_LENGTH - 1) of $word_type;
+    shared variable ram: t_ram := $ram_init_vhdl;
+begin""" + _vhdl_process('clka', _vhdl_ram_port(
+        'wea', 'addra', 'dina', 'douta', len(wea), DATA_WIDTH, reset,
+        reset_active, mode_a, zero=zero)) + _vhdl_process(
+        'clkb', _vhdl_ram_port(
+            'web', 'addrb', 'dinb', 'doutb', len(web), DATA_WIDTH, reset,
+            reset_active, mode_b, zero=zero)) + """end block ${douta}_ram;
+"""
+
+    write_a = _ram_writer(mem, douta, wea)
+    write_b = _ram_writer(mem, doutb, web)
+
+    def output(dout, mode, we, word, written):
+        if mode == WRITE_FIRST and we:
+            word = written
+        if mode == NO_CHANGE and we:
+            pass
+        elif reset is not None and reset == active:
+            dout.next = 0
+        else:
+            dout.next = word
+
+    if clka is clkb:
+        # Both ports read before either writes, so a port reading the
+        # address the other writes gets the old word
+        @always(clka.posedge)
+        def ports():
+            word_a = int(mem[int(addra)])
+            word_b = int(mem[int(addrb)])
+            written_a = written_b = None
+            if wea:
+                written_a = write_a(int(addra), int(dina), int(wea))
+            if web:
+                written_b = write_b(int(addrb), int(dinb), int(web))
+            output(douta, mode_a, wea, word_a, written_a)
+            output(doutb, mode_b, web, word_b, written_b)
+
+        return ports
+
+    @always(clka.posedge)
+    def port_a():
+        word = int(mem[int(addra)])
+        written = write_a(int(addra), int(dina), int(wea)) if wea else None
+        output(douta, mode_a, wea, word, written)
+
+    @always(clkb.posedge)
+    def port_b():
+        word = int(mem[int(addrb)])
+        written = write_b(int(addrb), int(dinb), int(web)) if web else None
+        output(doutb, mode_b, web, word, written)
+
+    return port_a, port_b
+
 
 @block
 def OnePortRomSyncRead(clk, addr, dout, ROM_DATA, reset=None, reset_active=1):
@@ -103,65 +525,167 @@ def OnePortRomSyncRead(clk, addr, dout, ROM_DATA, reset=None, reset_active=1):
     return read
 
 
-@block
-def ShiftRegister(clk, ce, din, dout, reset=None, reset_active=1, length=8):
+#: Longest shift register mapped to SRL primitives, longer ones use block RAM
+SRL_MAX_LENGTH = 128
+#: Ways to build a shift register
+SHIFT_STYLES = ('registers', 'srl', 'bram')
 
-    ram = create_same_signals(length, dout)
 
+def shift_register_style(length, reset=None):
+    """The style ShiftRegister picks: registers when the contents must
+    reset, SRLs up to SRL_MAX_LENGTH and a block RAM ring buffer beyond."""
+    if reset is not None:
+        return 'registers'
+    elif length <= SRL_MAX_LENGTH:
+        return 'srl'
+    return 'bram'
 
-    if reset is None or isinstance(reset, ResetSignal):
-        if isinstance(ce, bool):
-            assert enable, "Enable never True cannot be allowed!"
 
-            @always_seq(clk.posedge, reset=reset)
-            def shift():
-                for i in range(length):
-                    if i == 0:
-                        ram[i].next = din
-                    else:
-                        ram[i].next = ram[i - 1]
-        else:
-            @always_seq(clk.posedge, reset=reset)
-            def shift():
-                if ce:
-                    for i in range(length):
-                        if i == 0:
-                            ram[i].next = din
-                        else:
-                            ram[i].next = ram[i - 1]
+@block
+def ShiftRegister(clk, ce, din, dout, reset=None, reset_active=1, length=8,
+                  style=None):
+    """Delays din length (enabled) clocks: dout is din as it was length clocks
+    with ce ago.
+
+    The simulation keeps the words in a deque, so a clock costs the same for
+    every length (a reset clears the whole deque).
+
+    :param ce:      Clock enable, True for always shifting
+    :param style:   'registers' (flip-flops, the only style with a reset),
+                    'srl' (inferred shift register LUTs), 'bram' (ring buffer
+                    in an inferred block RAM, from length 2) or None for
+                    shift_register_style()
+    """
+    if isinstance(ce, bool):
+        assert ce, "Enable never True cannot be allowed!"
+    if style is None:
+        style = shift_register_style(length, reset)
+    assert style in SHIFT_STYLES, "Unknown style {!r}".format(style)
+    assert reset is None or style == 'registers', \
+        "Only registers can be reset"
+    assert length >= 1 and (length >= 2 or style != 'bram')
+
+    line = deque([0] * length, maxlen=length)
+    active = int(getattr(reset, 'active', reset_active))
+    isasync = getattr(reset, 'isasync', False)
+
+    DATA_WIDTH = len(dout)
+    word_type, zero = _vhdl_word(dout)
+    enable = "" if isinstance(ce, bool) else "$ce = '1'"
+
+    for signal in (clk, din):
+        signal.read = True
+    if not isinstance(ce, bool):
+        ce.read = True
+    if reset is not None:
+        reset.read = True
+
+    if style == 'bram':
+        # Written at the pointer, read (first) length - 1 words behind it
+        ADDR_WIDTH = max(1, (length - 2).bit_length())
+        OFFSET = 2 ** ADDR_WIDTH - (length - 1)
+        dout.driven = 'reg'
+        body = ["$dout <= ram(to_integer(ptr + $OFFSET));",
+                "ram(to_integer(ptr)) <= $din;",
+                "ptr <= ptr + 1;"]
+        ShiftRegister.vhdl_code = """
+${dout}_shift: block
+    type t_ram is array(0 to 2 ** $ADDR_WIDTH - 1) of $word_type;
+    signal ram: t_ram := (others => $zero);
+    signal ptr: unsigned($ADDR_WIDTH - 1 downto 0) := (others => '0');
+begin
+    process ($clk) is
+    begin
+        if rising_edge($clk) then
+            """ + _vhdl_enabled(enable, body, 12) + """
+        end if;
+    end process;
+end block ${dout}_shift;
+"""
     else:
-        if isinstance(ce, bool):
-            assert enable, "Enable never True cannot be allowed!"
-
-            @always(clk.posedge)
-            def shift():
-                if reset == reset_active:
-                    for i in range(length):
-                        ram[i].next = 0
-                else:
-                    for i in range(length):
-                        if i == 0:
-                            ram[i].next = din
-                        else:
-                            ram[i].next = ram[i - 1]
-        else:
-            @always(clk.posedge)
-            def shift():
-                if reset == reset_active:
-                    for i in range(length):
-                        ram[i].next = 0
-                elif ce:
-                    for i in range(length):
-                        if i == 0:
-                            ram[i].next = din
-                        else:
-                            ram[i].next = ram[i - 1]
-
-    @always_comb
-    def logic():
-        dout.next = ram[length - 1]
-
-    return shift, logic
+        ShiftRegister.vhdl_code = _vhdl_shift_register(enable, reset, isasync,
+                                                       style)
+        dout.driven = 'wire'
+
+    if isasync:
+        @always(clk.posedge, reset.posedge if active else reset.negedge)
+        def shift():
+            if reset == active:
+                line.extend([0] * length)
+                dout.next = 0
+            elif ce:
+                line.append(int(din))
+                dout.next = line[0]
+    else:
+        @always(clk.posedge)
+        def shift():
+            if reset is not None and reset == active:
+                line.extend([0] * length)
+                dout.next = 0
+            elif ce:
+                line.append(int(din))
+                dout.next = line[0]
+
+    return shift
+
+
+def _vhdl_shift_register(enable, reset, isasync, style):
+    """VHDL template of the register and SRL styles of ShiftRegister."""
+    shreg_extract = 'yes' if style == 'srl' else 'no'
+    body = ["for i in $length - 1 downto 1 loop",
+            "    shift(i) <= shift(i - 1);",
+            "end loop;",
+            "shift(0) <= $din;"]
+    if reset is None:
+        process = """
+    process ($clk) is
+    begin
+        if rising_edge($clk) then
+            """ + _vhdl_enabled(enable, body, 12) + """
+        end if;
+    end process;"""
+    elif isasync:
+        process = """
+    process ($clk, $reset) is
+    begin
+        if $reset = '$active' then
+            shift <= (others => $zero);
+        elsif rising_edge($clk) then
+            """ + _vhdl_enabled(enable, body, 12) + """
+        end if;
+    end process;"""
+    else:
+        process = """
+    process ($clk) is
+    begin
+        if rising_edge($clk) then
+            if $reset = '$active' then
+                shift <= (others => $zero);
+            else
+                """ + _vhdl_enabled(enable, body, 16) + """
+            end if;
+        end if;
+    end process;"""
+
+    return """
+${dout}_shift: block
+    type t_shift is array(0 to $length - 1) of $word_type;
+    signal shift: t_shift := (others => $zero);
+    attribute shreg_extract: string;
+    attribute shreg_extract of shift: signal is \"""" + shreg_extract + """\";
+begin""" + process + """
+
+    $dout <= shift($length - 1);
+end block ${dout}_shift;
+"""
+
+
+def _vhdl_enabled(enable, lines, indent):
+    """VHDL lines, only executed when the enable condition holds."""
+    if enable:
+        lines = ["if {} then".format(enable)] + \
+            ["    " + line for line in lines] + ["end if;"]
+    return ("\n" + " " * indent).join(lines)
 
 
 def convert():
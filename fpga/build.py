@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+__author__ = 'michiel'
+
+import os
+import ast
+import sys
+import time
+import argparse
+import traceback
+import multiprocessing
+import importlib.util
+from collections import namedtuple
+
+__all__ = [
+    'find_targets',
+    'build',
+    'main',
+]
+
+BuildTarget = namedtuple('BuildTarget', ['name', 'script', 'function',
+                                         'directory'])
+BuildResult = namedtuple('BuildResult', ['target', 'seconds', 'error'])
+
+
+def find_targets(builds='builds', output='vhdl'):
+    """Find all convert_* functions of the scripts in builds.
+
+    The scripts are parsed, not imported, so nothing is converted while
+    looking for targets. Every target gets its own output directory:
+    output/<script path>/<function>.
+    """
+    targets = []
+    for root, dirs, files in os.walk(builds):
+        dirs.sort()
+        for filename in sorted(files):
+            if not filename.endswith('.py'):
+                continue
+            script = os.path.join(root, filename)
+            with open(script) as f:
+                tree = ast.parse(f.read(), script)
+
+            relative = os.path.relpath(script, builds)[:-len('.py')]
+            for node in tree.body:
+                if isinstance(node, ast.FunctionDef) and \
+                        node.name.startswith('convert_'):
+                    targets.append(BuildTarget(
+                        '{}::{}'.format(relative, node.name),
+                        os.path.abspath(script), node.name,
+                        os.path.abspath(os.path.join(output, relative,
+                                                     node.name))))
+    return targets
+
+
+def _build_target(target):
+    start = time.time()
+    error = None
+    try:
+        if not os.path.isdir(target.directory):
+            os.makedirs(target.directory)
+        # The scripts write into the cwd, the worker process is ours alone
+        os.chdir(target.directory)
+        name = '_fpga_build_' + os.path.basename(target.script)[:-len('.py')]
+        spec = importlib.util.spec_from_file_location(name, target.script)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        getattr(module, target.function)()
+    except Exception:
+        error = traceback.format_exc()
+
+    return BuildResult(target, time.time() - start, error)
+
+
+def build(targets, processes=None):
+    """Run the targets over a pool of processes, one process per target.
+
+    :return: BuildResult per target, in the order of targets
+    """
+    pool = multiprocessing.Pool(processes, maxtasksperchild=1)
+    try:
+        return pool.map(_build_target, targets, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='fpga-build',
+        description='Run the convert_* functions of the build scripts in '
+                    'parallel, every target in its own output directory.')
+    parser.add_argument('builds', nargs='?', default='builds',
+                        help='Directory with the build scripts '
+                             '(default: %(default)s)')
+    parser.add_argument('-o', '--output', default='vhdl',
+                        help='Output directory (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of processes (default: number of cores)')
+    parser.add_argument('-k', '--filter', default='',
+                        help='Only build targets containing this text')
+    parser.add_argument('-l', '--list', action='store_true',
+                        help='Only list the targets')
+    args = parser.parse_args(argv)
+
+    targets = [t for t in find_targets(args.builds, args.output)
+               if args.filter in t.name]
+    if args.list:
+        for target in targets:
+            print(target.name)
+        return 0
+
+    start = time.time()
+    results = build(targets, args.jobs)
+    wall = time.time() - start
+
+    width = max([len(t.name) for t in targets] + [6])
+    print("{:<{w}}  {:>8}  {}".format('target', 'time', 'result', w=width))
+    for result in sorted(results, key=lambda r: -r.seconds):
+        print("{:<{w}}  {:>6.2f} s  {}".format(
+            result.target.name, result.seconds,
+            'ok' if result.error is None else 'FAILED', w=width))
+
+    failed = [r for r in results if r.error is not None]
+    for result in failed:
+        print('\n{} failed:\n{}'.format(result.target.name, result.error),
+              file=sys.stderr)
+
+    print("{} targets, {} failed in {:.2f} s ({:.2f} s of work)".format(
+        len(results), len(failed), wall, sum(r.seconds for r in results)))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 
 from myhdl import Signal, intbv, always, always_comb, concat
-from ball_bitmap import encoding
+from fpga.examples.ball_bitmap import encoding
 
 __author__ = 'michiel'
 
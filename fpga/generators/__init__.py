@@ -2,4 +2,4 @@
 
 __author__ = 'michiel'
 
-print("NOT UPDATED YET")
+# NOTE(michiel): NOT UPDATED YET
@@ -1,4 +1,5 @@
-from .transmitter import AES3_TX
-from .receiver import AES3_RX
+from .transmitter import AES3_TX, AES3_TX_Multi
+from .receiver import AES3_RX, AES3_RX_Bank, AES_Block_Capture
 
-__all__ = ['AES3_RX', 'AES3_TX']
+__all__ = ['AES3_RX', 'AES3_RX_Bank', 'AES3_TX', 'AES3_TX_Multi',
+           'AES_Block_Capture']
@@ -1,23 +1,294 @@
 from __future__ import print_function
 
 import myhdl
+import numpy as np
 
-from fpga.tests.test_utils import clocker, clockdiv, run_sim  # , int_to_bit_list
 from fpga.utils import create_signals
 
 
+#: AES3 channel status CRC, x^8 + x^4 + x^3 + x^2 + 1 preset to ones
+AES_CRC_POLY = 0x1D
+AES_CRC_PRESET = 0xFF
+AES_CRC_WIDTH = 8
+#: Channel status bits per block, the CRC is in the last byte
+AES_CRC_BLOCK = 192
+
+
+def crc_serial(state, bits, poly=AES_CRC_POLY, width=AES_CRC_WIDTH):
+    """CRC register after shifting in bits (first bit first), a MSB first
+    LFSR with the poly without its x^width term."""
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    for bit in bits:
+        feedback = bool(state & top) ^ bool(bit)
+        state = (state << 1) & mask
+        if feedback:
+            state ^= poly
+    return state
+
+
+def crc_matrix(bits, poly=AES_CRC_POLY, width=AES_CRC_WIDTH):
+    """XOR matrix of shifting bits bits into a CRC register at once.
+
+    :return: (state_taps, data_taps), per bit of the next register the bits
+             of the register and of the data (bit 0 first in time) it is the
+             XOR of
+    """
+    state_columns = [crc_serial(1 << j, [0] * bits, poly, width)
+                     for j in range(width)]
+    data_columns = [crc_serial(0, [i == k for k in range(bits)], poly, width)
+                    for i in range(bits)]
+    state_taps = [[j for j in range(width) if state_columns[j] >> o & 1]
+                  for o in range(width)]
+    data_taps = [[i for i in range(bits) if data_columns[i] >> o & 1]
+                 for o in range(width)]
+    return state_taps, data_taps
+
+
+def reflect_bits(value, width):
+    """value with its lowest width bits in reverse order."""
+    return int('{:0{}b}'.format(value, width)[::-1], 2)
+
+
+class CRC(object):
+    """Table driven CRC model, the AES3 CRC (CRC-8/EBU) by default.
+
+    Processes bytes with 256 entry tables, 8 bytes at a time with slices=8
+    (slice-by-8), for any number of blocks at once on NumPy arrays.
+
+    :param poly:        Polynomial without its x^width term
+    :param width:       Bits of the CRC (1 - 64)
+    :param preset:      Register before the first byte, MSB first as
+                        catalogued, also for reflected CRCs
+    :param reflect_in:  Bytes go in LSB first, otherwise MSB first
+    :param reflect_out: The register is reversed at the end
+    :param xor_out:     XORed with the result
+    :param slices:      Tables per byte of the input processed at once, 1
+                        or 8
+    """
+    def __init__(self, poly=AES_CRC_POLY, width=AES_CRC_WIDTH,
+                 preset=AES_CRC_PRESET, reflect_in=True, reflect_out=True,
+                 xor_out=0, slices=8):
+        if not 1 <= width <= 64:
+            raise ValueError("Width {} is not in 1 - 64".format(width))
+        if slices not in (1, 8):
+            raise ValueError("Slices should be 1 or 8, not {}".format(slices))
+        self.poly = poly
+        self.width = width
+        self.preset = preset
+        self.reflect_in = reflect_in
+        self.reflect_out = reflect_out
+        self.xor_out = xor_out
+        self.slices = slices
+
+        # MSB first the register is at least a byte, the CRC at the top
+        self._bits = width if reflect_in else max(width, 8)
+        self._shift = self._bits - width
+        self._mask = (1 << self._bits) - 1
+        self.tables = self._make_tables()
+
+    def _make_tables(self):
+        tables = np.zeros((self.slices, 256), dtype=np.uint64)
+        if self.reflect_in:
+            poly = reflect_bits(self.poly, self.width)
+            for i in range(256):
+                r = i
+                for _ in range(8):
+                    r = (r >> 1) ^ poly if r & 1 else r >> 1
+                tables[0, i] = r
+            for k in range(1, self.slices):
+                previous = tables[k - 1]
+                tables[k] = (previous >> np.uint64(8)) ^ \
+                    tables[0, previous & np.uint64(0xFF)]
+        else:
+            poly = self.poly << self._shift
+            top = 1 << (self._bits - 1)
+            for i in range(256):
+                r = i << (self._bits - 8)
+                for _ in range(8):
+                    r = ((r << 1) ^ poly if r & top else r << 1) & self._mask
+                tables[0, i] = r
+            for k in range(1, self.slices):
+                previous = tables[k - 1]
+                tables[k] = ((previous << np.uint64(8)) &
+                             np.uint64(self._mask)) ^ tables[0, (
+                                 previous >> np.uint64(self._bits - 8)) &
+                                 np.uint64(0xFF)]
+        return tables
+
+    def blocks(self, blocks):
+        """CRC of every row of a 2D uint8 array (blocks of bytes)."""
+        blocks = np.asarray(blocks, dtype=np.uint8)
+        if blocks.ndim != 2:
+            raise ValueError("Blocks should be a 2D array of bytes")
+        length = blocks.shape[1]
+        u64 = np.uint64
+        tables = self.tables
+        if self.reflect_in:
+            preset = reflect_bits(self.preset & self._mask, self.width)
+            r = np.full(blocks.shape[0], preset, dtype=u64)
+        else:
+            r = np.full(blocks.shape[0], self.preset, dtype=u64)
+            r = (r << u64(self._shift)) & u64(self._mask)
+
+        # Slice-by-8 while there are 8 bytes and the register fits in them
+        i = 0
+        if self.slices == 8:
+            words = blocks[:, :length // 8 * 8].reshape(
+                blocks.shape[0], -1, 8).astype(u64)
+            if self.reflect_in:
+                words = (words << (u64(8) * np.arange(8, dtype=u64))).sum(
+                    axis=2, dtype=u64)
+            else:
+                words = (words << (u64(8) * np.arange(7, -1, -1, dtype=u64))
+                         ).sum(axis=2, dtype=u64)
+            for word in words.T:
+                if self.reflect_in:
+                    x = r ^ word
+                    r = tables[7, x & u64(0xFF)]
+                    for k in range(1, 8):
+                        r ^= tables[7 - k, (x >> u64(8 * k)) & u64(0xFF)]
+                else:
+                    x = (r << u64(64 - self._bits)) ^ word
+                    r = tables[7, x >> u64(56)]
+                    for k in range(1, 8):
+                        r ^= tables[7 - k, (x >> u64(56 - 8 * k)) &
+                                    u64(0xFF)]
+            i = words.shape[1] * 8
+
+        for byte in blocks[:, i:].T.astype(u64):
+            if self.reflect_in:
+                r = tables[0, (r ^ byte) & u64(0xFF)] ^ (r >> u64(8))
+            else:
+                index = ((r >> u64(self._bits - 8)) ^ byte) & u64(0xFF)
+                r = tables[0, index] ^ ((r << u64(8)) & u64(self._mask))
+
+        r = r >> u64(self._shift)
+        if self.reflect_out != self.reflect_in:
+            # Reverse all 64 bits a byte at a time, the CRC ends up on top
+            reversed_bytes = np.array([reflect_bits(i, 8) for i in range(256)],
+                                      dtype=u64)
+            r = sum(reversed_bytes[(r >> u64(8 * k)) & u64(0xFF)] <<
+                    u64(56 - 8 * k) for k in range(8))
+            r = r >> u64(64 - self.width)
+        return r ^ u64(self.xor_out)
+
+    def __call__(self, data):
+        """CRC of bytes."""
+        return int(self.blocks(np.frombuffer(bytes(data),
+                                             dtype=np.uint8)[None])[0])
+
+    def check_blocks(self, blocks, crc_bytes=1):
+        """Per row of a 2D uint8 array, whether its last crc_bytes bytes are
+        the CRC of the bytes before them (LSB first with reflect_out, as in
+        the AES3 channel status byte 23).
+        """
+        blocks = np.asarray(blocks, dtype=np.uint8)
+        received = blocks[:, -crc_bytes:].astype(np.uint64)
+        order = np.arange(crc_bytes, dtype=np.uint64)
+        if not self.reflect_out:
+            order = order[::-1]
+        received = (received << (np.uint64(8) * order)).sum(
+            axis=1, dtype=np.uint64)
+        return self.blocks(blocks[:, :-crc_bytes]) == received
+
+
+@myhdl.block
+def XorReduce(din, dout):
+    """dout is the XOR of all bits of din."""
+    if isinstance(din.val, bool):
+        @myhdl.always_comb
+        def logic():
+            dout.next = din
+    else:
+        @myhdl.always_comb
+        def logic():
+            p = False
+            for i in range(len(din)):
+                p = p ^ din[i]
+            dout.next = p
+
+    return logic
+
+
+@myhdl.block
+def CRC_Update(state, din, dout, POLY=AES_CRC_POLY):
+    """dout is the CRC register state after shifting in all bits of din,
+    din[0] first. The XOR matrix is worked out at elaboration, so this is
+    one level of XORs for any len(din).
+
+    :param state:   CRC register
+    :param din:     Data bits
+    :param dout:    Next CRC register
+    :param POLY:    Polynomial without its x^len(state) term
+    """
+    WIDTH = len(state)
+    BITS = 1 if isinstance(din.val, bool) else len(din)
+    state_taps, data_taps = crc_matrix(BITS, POLY, WIDTH)
+
+    def bit(signal, i):
+        return signal if isinstance(signal.val, bool) else signal(i)
+
+    next_bits = [myhdl.Signal(False) for _ in range(WIDTH)]
+    xors = []
+    for o in range(WIDTH):
+        taps = [bit(state, j) for j in state_taps[o]] + \
+            [bit(din, i) for i in data_taps[o]]
+        if len(taps) == 1:
+            xors.append(XorReduce(taps[0], next_bits[o]))
+        else:
+            xors.append(XorReduce(myhdl.ConcatSignal(*taps), next_bits[o]))
+    next_state = myhdl.ConcatSignal(*reversed(next_bits))
+
+    @myhdl.always_comb
+    def output():
+        dout.next = next_state
+
+    return xors, output
+
+
+@myhdl.block
 def AES_CRC_Checker(din, frames, ce, clk, crc_err):
     """AES CRC Checker
 
-    :param din:     input, Serial input data
-    :param frames:  input, Frame counter (0 - 192)
-    :param ce:      input, Clock enable @ Fs, word clock
+    Checks the channel status CRC (x^8+x^4+x^3+x^2+1, preset to 1) of every
+    block, 1, 8 or 32 bits at a time. The bits go in in the order they are
+    sent (din[0] first). crc_err is updated with the last word of every
+    block and holds until the next.
+
+    :param din:     input, Channel status bits, 1, 8 or 32
+    :param frames:  input, Word counter (0 - 192 / len(din)), the frame
+                    counter for serial data
+    :param ce:      input, Clock enable, a word of din
     :param clk:     input, Clock
     :param crc_err: output, CRC Error flag
     """
-    pass
+    BITS = 1 if isinstance(din.val, bool) else len(din)
+    assert AES_CRC_BLOCK % BITS == 0, "A block is not a whole number of words"
+    LAST = AES_CRC_BLOCK // BITS - 1
 
+    state, start, next_state = [myhdl.Signal(myhdl.intbv(0)[AES_CRC_WIDTH:])
+                                for _ in range(3)]
+    update = CRC_Update(start, din, next_state)
 
+    @myhdl.always_comb
+    def preset():
+        if frames == 0:
+            start.next = AES_CRC_PRESET
+        else:
+            start.next = state
+
+    @myhdl.always(clk.posedge)
+    def check():
+        if ce:
+            state.next = next_state
+            if frames == LAST:
+                crc_err.next = next_state != 0
+
+    return update, preset, check
+
+
+@myhdl.block
 def AES_CRC_Generator(din, frames, ce, clk, dout):
     """AES CRC Generator
 
@@ -25,13 +296,66 @@ def AES_CRC_Generator(din, frames, ce, clk, dout):
     byte 23, the calculated CRC bits are output on dout.
     (Generator polynomial is x^8+x^4+x^3+x^2+1, preset to 1.)
 
-    :param din:     input, Serial input data
-    :param frames:  input, Frame counter (0 - 192)
-    :param ce:      input, Clock enable @ Fs, word clock
+    Takes 1, 8 or 32 bits at a time, in the order they are sent (din[0]
+    first). dout follows din one word later.
+
+    :param din:     input, Channel status bits, 1, 8 or 32
+    :param frames:  input, Word counter (0 - 192 / len(din)), the frame
+                    counter for serial data
+    :param ce:      input, Clock enable, a word of din
     :param clk:     input, Clock
-    :param crc_err: output, CRC Error flag
+    :param dout:    output, din with the CRC in byte 23
     """
-    pass
+    BITS = 1 if isinstance(din.val, bool) else len(din)
+    assert AES_CRC_BLOCK % BITS == 0, "A block is not a whole number of words"
+    # The word with the first bit of the CRC and the data bits before it
+    CRC_WORD = (AES_CRC_BLOCK - AES_CRC_WIDTH) // BITS
+    TAIL = (AES_CRC_BLOCK - AES_CRC_WIDTH) % BITS
+
+    state, start, next_state, crc = [
+        myhdl.Signal(myhdl.intbv(0)[AES_CRC_WIDTH:]) for _ in range(4)]
+    update = CRC_Update(start, din, next_state)
+    if TAIL:
+        tail = CRC_Update(start, din(TAIL, 0), crc)
+    else:
+        @myhdl.always_comb
+        def tail():
+            crc.next = start
+
+    @myhdl.always_comb
+    def preset():
+        if frames == 0:
+            start.next = AES_CRC_PRESET
+        else:
+            start.next = state
+
+    if BITS == 1:
+        # The CRC goes out MSB first, shifting it through the register
+        @myhdl.always(clk.posedge)
+        def generate():
+            if ce:
+                if frames < CRC_WORD:
+                    dout.next = din
+                    state.next = next_state
+                else:
+                    dout.next = crc[AES_CRC_WIDTH - 1]
+                    state.next = myhdl.concat(crc[AES_CRC_WIDTH - 1:], False)
+    else:
+        # The CRC byte is sent LSB first, the register MSB first
+        @myhdl.always(clk.posedge)
+        def generate():
+            if ce:
+                state.next = next_state
+                if frames == CRC_WORD:
+                    word = myhdl.intbv(0)[BITS:]
+                    word[:] = din
+                    for i in range(AES_CRC_WIDTH):
+                        word[TAIL + i] = crc[AES_CRC_WIDTH - 1 - i]
+                    dout.next = word
+                else:
+                    dout.next = din
+
+    return update, tail, preset, generate
 
 
 def check_crc_stream2(serin, serout, clk, crc_poly, frame_counter,
@@ -145,6 +469,7 @@ def test_check_crc():
 
 
 if __name__ == '__main__':
+    from fpga.tests.test_utils import clocker, run_sim
 
     def bench():
         serin, serout, clk = create_signals(3)
@@ -176,7 +501,7 @@ if __name__ == '__main__':
         def print_out():
             if frame_counter == 0:
                 print("ZERO")
-            print("|{:^6}|{:^6}|{:^6}|".format(int(serin), myhdl.bin(dout, dout._nrbits), serout))
+            print("|{:^6}|{:^6}|{:^6}|".format(int(serin), myhdl.bin(dout, dout._nrbits), int(serout)))
 
         frame_counter = create_signals(1, (0, 16), mod=True)
 
@@ -2,14 +2,26 @@
 
 # http://www.xilinx.com/support/documentation/application_notes/xapp514.pdf
 
-from myhdl import intbv, always, always_comb, concat
+from myhdl import block, Signal, ConcatSignal, intbv, modbv, always, \
+    always_comb, concat, downrange
+from fpga.basics.ram import SimpleTwoPortRam, ShiftRegister
+from fpga.interfaces.aes3.crc import AES_CRC_BLOCK, AES_CRC_Checker
 from fpga.utils import create_signals
 
 __author__ = 'michiel'
 
 
+@block
 def AES3_RX(din, audio1, valid1, user1, cs1, out_en, audio2, valid2, user2, cs2,
-            parity_error, frames, frame0, locked, clk, rst):
+            parity_error, frames, frame0, locked, clk, rst, block_ready=None,
+            crc_error=None, block_addr=None, block_data=None):
+    """
+    AES3 receiver of one input.
+
+    With block_ready, crc_error, block_addr and block_data the channel
+    status and user data blocks are captured for a host to read, see
+    AES_Block_Capture.
+    """
     LCK_BITS = 13
     LCK_MAX = 2 ** LCK_BITS - 1
 
@@ -19,7 +31,7 @@ def AES3_RX(din, audio1, valid1, user1, cs1, out_en, audio2, valid2, user2, cs2,
     x_preamble, y_preamble, z_preamble = create_signals(3)
     channel1, channel2, valid, user_data, cs = create_signals(5)
     audio, audio1_hold = create_signals(2, 24)
-    locked_timeout = create_signals(1, LCK_BITS)
+    locked_timeout = create_signals(1, LCK_BITS, mod=True)
     valid1_hold, user1_hold, cs1_hold = create_signals(3)
     parity_error_int = create_signals(1)
     frames_int = create_signals(1, 8)
@@ -33,6 +45,12 @@ def AES3_RX(din, audio1, valid1, user1, cs1, out_en, audio2, valid2, user2, cs2,
                                         channel2, audio, valid,
                                         parity_error_int, user_data, cs,
                                         frames_int, clk, rst)
+    if block_ready is None:
+        block_capture = []
+    else:
+        block_capture = AES_Block_Capture(channel1, channel2, user_data, cs,
+                                          frames_int, block_ready, crc_error,
+                                          block_addr, block_data, clk, rst)
 
     @always(clk.posedge)
     def lock_timeout_logic():
@@ -86,11 +104,12 @@ def AES3_RX(din, audio1, valid1, user1, cs1, out_en, audio2, valid2, user2, cs2,
         if channel1 or channel2:
             parity_error.next = parity_error_int
 
-    return (aes_dru, aes_framer, aes_rx_formatter, lock_timeout_logic,
-            lock_logic, demux_registers, output_regs, output_enable_logic,
-            parity_error_pass)
+    return (aes_dru, aes_framer, aes_rx_formatter, block_capture,
+            lock_timeout_logic, lock_logic, demux_registers, output_regs,
+            output_enable_logic, parity_error_pass)
 
 
+@block
 def AES_Dru(din, dout, dout_valid, clk, rst):
     """
     This is the multirate data recovery unit for the AES3 receiver. The DRU uses
@@ -234,6 +253,418 @@ def AES_Dru(din, dout, dout_valid, clk, rst):
             sample_it_now, output_data, output_valid)
 
 
+@block
+def ScanLevel(clk, din, dout, N, BITS, DIST, OP, REVERSE=False):
+    """
+    One registered level of a Kogge-Stone scan over the N fields of BITS
+    bits packed in din: field i of dout is field i of din combined (OP
+    'add' or 'min') with field i - DIST, or i + DIST with REVERSE. Levels
+    with DIST 1, 2, 4, ... give the inclusive prefix (suffix) sums or
+    minima in log2(N) clocks.
+    """
+    assert OP in ('add', 'min')
+    assert len(din) == len(dout) == N * BITS
+    LOW, HIGH = (0, N - DIST) if REVERSE else (DIST, N)
+    STEP = DIST if REVERSE else -DIST
+
+    if OP == 'add':
+        @always(clk.posedge)
+        def level():
+            fields = intbv(0)[N * BITS:]
+            fields[:] = din
+            for i in range(LOW, HIGH):
+                fields[(i + 1) * BITS:i * BITS] = \
+                    din[(i + 1) * BITS:i * BITS] + \
+                    din[(i + STEP + 1) * BITS:(i + STEP) * BITS]
+            dout.next = fields
+    else:
+        @always(clk.posedge)
+        def level():
+            fields = intbv(0)[N * BITS:]
+            fields[:] = din
+            for i in range(LOW, HIGH):
+                if din[(i + STEP + 1) * BITS:(i + STEP) * BITS] < \
+                        din[(i + 1) * BITS:i * BITS]:
+                    fields[(i + 1) * BITS:i * BITS] = \
+                        din[(i + STEP + 1) * BITS:(i + STEP) * BITS]
+            dout.next = fields
+
+    return level
+
+
+@block
+def Scan(clk, din, dout, N, BITS, OP, REVERSE=False):
+    """Registered Kogge-Stone scan of (N - 1).bit_length() ScanLevels."""
+    LEVELS = (N - 1).bit_length()
+    levels = []
+    level_in = din
+    for k in range(LEVELS):
+        level_out = dout if k == LEVELS - 1 else Signal(intbv(0)[N * BITS:])
+        levels.append(ScanLevel(clk, level_in, level_out, N, BITS, 2 ** k,
+                                OP, REVERSE))
+        level_in = level_out
+
+    return levels
+
+
+@block
+def AES_Dru_Parallel(din, dout, dout_count, clk, rst, overflow=None):
+    """
+    Data recovery unit like AES_Dru for a word of oversampled bits per clock,
+    as from an ISERDES or a deserializer, so the clock only has to keep up
+    with the words and not with the oversampling.
+
+    The half bits are exactly those AES_Dru would find one bit per clock,
+    but no bit of the word waits for the one before it:
+
+    * the edges are the XOR of adjacent bits and the distance of every bit
+      to the last edge before it comes from its own priority encoder,
+    * the minimum symbol length is the minimum of the distances at the
+      edges, from a pipelined prefix and suffix minimum scan, so the update
+      every 1024 edges can land anywhere in the word,
+    * a bit is a sample point when its distance to the last edge (or the
+      sampler phase of the previous word) is half the symbol length plus a
+      multiple of it, against a table of those multiples,
+    * the sample points are packed by a pipelined prefix count.
+
+    Only the edge distance, the symbol length search, the update count and
+    the sampler phase carry from word to word, each with a single compare,
+    add or table lookup per clock. Within a word the logic still grows with
+    its length: the edge distances are a priority encoder per bit and the
+    sample offsets and the packing a compare per bit and table entry, so
+    O(len(din) ** 2) logic with a depth of O(len(din)) in the edge
+    detection. The latency from din to dout is
+    2 * ceil(log2(len(din))) + 6 clocks.
+
+    The recovered half bits of the word come out packed on dout, the first
+    one in bit 0, with their number on dout_count. Once the minimum symbol
+    length is found, half bits of at least 2 samples give at most
+    len(din) // 2 + 1 per word, so dout needs that many bits. Until then
+    a word can give more, those past len(dout) are lost and flagged on
+    overflow.
+
+    :param din:         Oversampled bitstream, din[0] first in time
+    :param dout:        Recovered half bits, dout[0] first in time
+    :param dout_count:  Number of valid half bits on dout (0 .. len(dout))
+    :param clk:         Word clock
+    :param rst:         Synchronous reset
+    :param overflow:    Optional, half bits past len(dout) got lost
+    """
+    W = len(din)
+    K = len(dout)
+    assert W >= 2, "A word has at least 2 bits"
+    assert K >= W // 2 + 1, \
+        "dout needs len(din) // 2 + 1 = {} bits".format(W // 2 + 1)
+    MIN_VAL_WIDTH = 10
+    MIN_VAL_MAX = 2 ** MIN_VAL_WIDTH - 1
+    UPDATE_CNTR_WIDTH = 10
+    UPDATE_CNTR_MAX = 2 ** UPDATE_CNTR_WIDTH - 1
+    SCAN_LEVELS = (W - 1).bit_length()
+    # Distances within a word, counts of bits and offsets from the last
+    # edge or a whole word of the sampler phase
+    DIST_WIDTH = W.bit_length()
+    COUNT_WIDTH = W.bit_length()
+    OFFSET_WIDTH = (MIN_VAL_MAX + W).bit_length()
+    # Half a symbol length plus up to W symbol lengths
+    TABLE_WIDTH = (MIN_VAL_MAX // 2 + W * (MIN_VAL_MAX + 1)).bit_length()
+
+    din_reg = Signal(intbv(0)[W:])
+    last = Signal(False)
+    # The words in the pipeline, not the registers it starts with
+    valid, scan_valid, update_valid, table_valid = create_signals(4)
+    min_cntr, min_capture, min_hold, sample_cntr = \
+        [Signal(modbv(0)[MIN_VAL_WIDTH:]) for _ in range(4)]
+    update_cntr = Signal(modbv(0)[UPDATE_CNTR_WIDTH:])
+
+    # Edges and distances, 1 clock
+    edges, prev_bits, first = [Signal(intbv(0)[W:]) for _ in range(3)]
+    dists = Signal(intbv(0)[W * DIST_WIDTH:])
+    lengths = Signal(intbv(0)[W * MIN_VAL_WIDTH:])
+    edge_ones = Signal(intbv(0)[W * COUNT_WIDTH:])
+    end_dist = Signal(intbv(0)[DIST_WIDTH:])
+    end_edge = Signal(False)
+    # Scans, SCAN_LEVELS clocks
+    prefix_min, suffix_min = [Signal(intbv(0)[W * MIN_VAL_WIDTH:])
+                              for _ in range(2)]
+    prefix_count = Signal(intbv(0)[W * COUNT_WIDTH:])
+    scan_edges = Signal(intbv(0)[W:])
+    # Symbol lengths before and after an update in the word, 1 clock
+    hold_before, hold_after = [Signal(intbv(0)[MIN_VAL_WIDTH:])
+                               for _ in range(2)]
+    after_update = Signal(intbv(0)[W:])
+    # Tables of sample offsets and symbol lengths, 1 clock
+    samples_before, samples_after, periods = \
+        [Signal(intbv(0)[(W + 1) * TABLE_WIDTH:]) for _ in range(3)]
+    after_table = Signal(intbv(0)[W:])
+    # Sample points, 1 clock
+    sample_points, sample_bits = [Signal(intbv(0)[W:]) for _ in range(2)]
+    delayed_bits, delayed_first = [Signal(intbv(0)[W:]) for _ in range(2)]
+    delayed_dists = Signal(intbv(0)[W * DIST_WIDTH:])
+    delayed_end_dist = Signal(intbv(0)[DIST_WIDTH:])
+    delayed_end_edge = Signal(False)
+    # Packing, SCAN_LEVELS + 1 clocks
+    sample_counts, sample_ones = [Signal(intbv(0)[W * COUNT_WIDTH:])
+                                  for _ in range(2)]
+    packed_points, packed_bits = [Signal(intbv(0)[W:]) for _ in range(2)]
+
+    min_scan = Scan(clk, lengths, prefix_min, W, MIN_VAL_WIDTH, 'min')
+    suffix_scan = Scan(clk, lengths, suffix_min, W, MIN_VAL_WIDTH, 'min',
+                       REVERSE=True)
+    count_scan = Scan(clk, edge_ones, prefix_count, W, COUNT_WIDTH, 'add')
+    sample_scan = Scan(clk, sample_ones, sample_counts, W, COUNT_WIDTH, 'add')
+    edge_delay = ShiftRegister(clk, True, edges, scan_edges,
+                               length=SCAN_LEVELS)
+    valid_delay = ShiftRegister(clk, True, valid, scan_valid,
+                                length=SCAN_LEVELS)
+    # To the sampler: the scans, the symbol lengths and the tables
+    bits_delay = ShiftRegister(clk, True, prev_bits, delayed_bits,
+                               length=SCAN_LEVELS + 2)
+    first_delay = ShiftRegister(clk, True, first, delayed_first,
+                                length=SCAN_LEVELS + 2)
+    dists_delay = ShiftRegister(clk, True, dists, delayed_dists,
+                                length=SCAN_LEVELS + 2)
+    end_dist_delay = ShiftRegister(clk, True, end_dist, delayed_end_dist,
+                                   length=SCAN_LEVELS + 2)
+    end_edge_delay = ShiftRegister(clk, True, end_edge, delayed_end_edge,
+                                   length=SCAN_LEVELS + 2)
+    points_delay = ShiftRegister(clk, True, sample_points, packed_points,
+                                 length=SCAN_LEVELS)
+    sample_bits_delay = ShiftRegister(clk, True, sample_bits, packed_bits,
+                                      length=SCAN_LEVELS)
+
+    @always(clk.posedge)
+    def input_reg():
+        din_reg.next = din
+
+    @always(clk.posedge)
+    def edge_detect():
+        """The edges, the bit before every bit and for every bit (and the end
+        of the word) the distance to the last edge before it. first marks
+        the bits without an edge before them in the word, at the edges
+        their distance continues the one of the previous word."""
+        if rst:
+            valid.next = False
+            last.next = False
+            min_cntr.next = 0
+        else:
+            valid.next = True
+            found = intbv(0)[W:]
+            prev = intbv(0)[W:]
+            prev[0] = last
+            prev[W:1] = din_reg[W - 1:]
+            found[:] = din_reg ^ prev
+            ones = intbv(0)[W * COUNT_WIDTH:]
+            firsts = intbv(0)[W:]
+            distances = intbv(0)[W * DIST_WIDTH:]
+            symbols = intbv(0)[W * MIN_VAL_WIDTH:]
+            for i in range(W):
+                ones[i * COUNT_WIDTH] = found[i]
+                distance = intbv(0)[DIST_WIDTH:]
+                firsts[i] = 1
+                for j in range(i):
+                    if found[j]:
+                        distance[:] = i - j - 1
+                        firsts[i] = 0
+                distances[(i + 1) * DIST_WIDTH:i * DIST_WIDTH] = distance
+                if not found[i]:
+                    symbols[(i + 1) * MIN_VAL_WIDTH:i * MIN_VAL_WIDTH] = \
+                        MIN_VAL_MAX
+                elif firsts[i]:
+                    symbols[(i + 1) * MIN_VAL_WIDTH:i * MIN_VAL_WIDTH] = \
+                        (min_cntr + i) % (MIN_VAL_MAX + 1)
+                else:
+                    symbols[(i + 1) * MIN_VAL_WIDTH:i * MIN_VAL_WIDTH] = \
+                        distance
+            distance = intbv(0)[DIST_WIDTH:]
+            any_edge = False
+            for j in range(W):
+                if found[j]:
+                    distance[:] = W - j - 1
+                    any_edge = True
+            edges.next = found
+            prev_bits.next = prev
+            first.next = firsts
+            dists.next = distances
+            lengths.next = symbols
+            edge_ones.next = ones
+            end_dist.next = distance
+            end_edge.next = any_edge
+            last.next = din_reg[W - 1]
+            if any_edge:
+                min_cntr.next = distance
+            else:
+                min_cntr.next = min_cntr + W
+
+    @always(clk.posedge)
+    def minimum():
+        """The minimum symbol length, from the scans: the update edge is the
+        one where the edge count reaches the update count."""
+        update_valid.next = scan_valid
+        if rst:
+            min_capture.next = 0
+            min_hold.next = 0
+            update_cntr.next = 0
+        elif scan_valid:
+            remaining = intbv(0)[UPDATE_CNTR_WIDTH:]
+            remaining[:] = UPDATE_CNTR_MAX - update_cntr
+            before = intbv(0)[MIN_VAL_WIDTH:]
+            after = intbv(0)[MIN_VAL_WIDTH:]
+            later = intbv(0)[W:]
+            update = False
+            for i in range(W):
+                count = intbv(0)[COUNT_WIDTH:]
+                below = intbv(MIN_VAL_MAX)[MIN_VAL_WIDTH:]
+                above = intbv(MIN_VAL_MAX)[MIN_VAL_WIDTH:]
+                if i > 0:
+                    count[:] = prefix_count[i * COUNT_WIDTH:
+                                            (i - 1) * COUNT_WIDTH]
+                    below[:] = prefix_min[i * MIN_VAL_WIDTH:
+                                          (i - 1) * MIN_VAL_WIDTH]
+                if i < W - 1:
+                    above[:] = suffix_min[(i + 2) * MIN_VAL_WIDTH:
+                                          (i + 1) * MIN_VAL_WIDTH]
+                if scan_edges[i] and count == remaining:
+                    update = True
+                    before[:] = before | below
+                    after[:] = after | above
+                if count > remaining:
+                    later[i] = 1
+            total = intbv(0)[MIN_VAL_WIDTH:]
+            total[:] = prefix_min[W * MIN_VAL_WIDTH:(W - 1) * MIN_VAL_WIDTH]
+
+            hold_before.next = min_hold
+            after_update.next = later
+            if update:
+                if before < min_capture:
+                    min_hold.next = before
+                    hold_after.next = before
+                else:
+                    min_hold.next = min_capture
+                    hold_after.next = min_capture
+                min_capture.next = after
+            else:
+                hold_after.next = min_hold
+                if total < min_capture:
+                    min_capture.next = total
+            update_cntr.next = update_cntr + \
+                prefix_count[W * COUNT_WIDTH:(W - 1) * COUNT_WIDTH]
+
+    @always(clk.posedge)
+    def tables():
+        """half + m * (hold + 1) before and after the update and
+        m * (hold + 1) after it, for m = 0 .. W."""
+        offsets_before = intbv(0)[(W + 1) * TABLE_WIDTH:]
+        offsets_after = intbv(0)[(W + 1) * TABLE_WIDTH:]
+        multiples = intbv(0)[(W + 1) * TABLE_WIDTH:]
+        for m in range(W + 1):
+            offsets_before[(m + 1) * TABLE_WIDTH:m * TABLE_WIDTH] = \
+                hold_before[MIN_VAL_WIDTH:1] + m * (hold_before + 1)
+            offsets_after[(m + 1) * TABLE_WIDTH:m * TABLE_WIDTH] = \
+                hold_after[MIN_VAL_WIDTH:1] + m * (hold_after + 1)
+            multiples[(m + 1) * TABLE_WIDTH:m * TABLE_WIDTH] = \
+                m * (hold_after + 1)
+        samples_before.next = offsets_before
+        samples_after.next = offsets_after
+        periods.next = multiples
+        after_table.next = after_update
+        table_valid.next = update_valid
+
+    @always(clk.posedge)
+    def sampler():
+        """The sample points: an offset from the last edge (or the sampler
+        phase) in the table. The phase of the next word is the offset of the
+        end of the word modulo the symbol length."""
+        if rst:
+            sample_cntr.next = 0
+            sample_points.next = 0
+            sample_ones.next = 0
+        elif table_valid:
+            points = intbv(0)[W:]
+            for i in range(W):
+                offset = intbv(0)[OFFSET_WIDTH:]
+                if delayed_first[i]:
+                    offset[:] = sample_cntr + i
+                else:
+                    offset[:] = delayed_dists[(i + 1) * DIST_WIDTH:
+                                              i * DIST_WIDTH]
+                for m in range(W + 1):
+                    if after_table[i]:
+                        if offset == samples_after[(m + 1) * TABLE_WIDTH:
+                                                   m * TABLE_WIDTH]:
+                            points[i] = 1
+                    else:
+                        if offset == samples_before[(m + 1) * TABLE_WIDTH:
+                                                    m * TABLE_WIDTH]:
+                            points[i] = 1
+            end = intbv(0)[OFFSET_WIDTH:]
+            if delayed_end_edge:
+                end[:] = delayed_end_dist
+            else:
+                end[:] = sample_cntr + W
+            phase = intbv(0)[MIN_VAL_WIDTH:]
+            for m in range(W + 1):
+                if periods[(m + 1) * TABLE_WIDTH:m * TABLE_WIDTH] <= end:
+                    if m == W or \
+                            periods[(m + 2) * TABLE_WIDTH:
+                                    (m + 1) * TABLE_WIDTH] > end:
+                        phase[:] = phase | \
+                            (end - periods[(m + 1) * TABLE_WIDTH:
+                                           m * TABLE_WIDTH])
+            ones = intbv(0)[W * COUNT_WIDTH:]
+            for i in range(W):
+                ones[i * COUNT_WIDTH] = points[i]
+            sample_points.next = points
+            sample_bits.next = delayed_bits
+            sample_ones.next = ones
+            sample_cntr.next = phase
+        else:
+            sample_points.next = 0
+            sample_ones.next = 0
+
+    @always(clk.posedge)
+    def output_reg():
+        """Half bit k of dout is the sample point with k sample points before
+        it."""
+        if rst:
+            dout_count.next = 0
+        else:
+            bits = intbv(0)[K:]
+            for k in range(K):
+                for i in range(W):
+                    count = intbv(0)[COUNT_WIDTH:]
+                    if i > 0:
+                        count[:] = sample_counts[i * COUNT_WIDTH:
+                                                 (i - 1) * COUNT_WIDTH]
+                    if packed_points[i] and packed_bits[i] and count == k:
+                        bits[k] = 1
+            dout.next = bits
+            total = intbv(0)[COUNT_WIDTH:]
+            total[:] = sample_counts[W * COUNT_WIDTH:(W - 1) * COUNT_WIDTH]
+            if total > K:
+                dout_count.next = K
+            else:
+                dout_count.next = total
+
+    instances = [min_scan, suffix_scan, count_scan, sample_scan, edge_delay,
+                 bits_delay, first_delay, dists_delay, end_dist_delay,
+                 end_edge_delay, valid_delay, points_delay, sample_bits_delay,
+                 input_reg, edge_detect, minimum, tables, sampler, output_reg]
+
+    if overflow is not None:
+        @always(clk.posedge)
+        def overflow_reg():
+            if rst:
+                overflow.next = False
+            else:
+                overflow.next = \
+                    sample_counts[W * COUNT_WIDTH:(W - 1) * COUNT_WIDTH] > K
+
+        instances.append(overflow_reg)
+
+    return instances
+
+
+@block
 def AES_Framer(din, din_valid, dout, dout_valid, x_preamble, y_preamble,
                z_preamble, clk, rst):
     """
@@ -365,6 +796,7 @@ def AES_Framer(din, din_valid, dout, dout_valid, x_preamble, y_preamble,
             delay_preambles, dout_valid_gen)
 
 
+@block
 def AES_RX_Formatter(din, din_valid, x_preamble, y_preamble, z_preamble,
                      channel1, channel2, audio, valid, parity_error, user,
                      cs, frames, clk, rst):
@@ -468,3 +900,346 @@ def AES_RX_Formatter(din, din_valid, x_preamble, y_preamble, z_preamble,
             frame_counter, frame_comb, output_clk, audio_output,
             channel_indicator, valid_data, user_data, channel_status,
             parity_error_detection, output_clk_enable)
+
+
+@block
+def AES_Block_Capture(channel1, channel2, user, cs, frames, block_ready,
+                      crc_error, raddr, dout, clk, rst, rclk=None):
+    """
+    Captures the 192 bit channel status and user data blocks of both
+    channels for a host to read.
+
+    The bits of every subframe (channel1 or channel2 high for a clock with
+    its user and cs bits, frames counting from the Z preamble) are packed
+    into bytes, bit 0 of a block in bit 0 of byte 0, and written to one half
+    of a double buffered RAM. After the last subframe of a block that
+    started with a Z preamble the halves swap and block_ready is high for a
+    clock: the host then has a block time (4 ms at 48 kHz) to read the 24
+    bytes of each block while the next one comes in. Blocks without a start
+    (before the first Z preamble or after losing it) are not handed out,
+    frames wrapping around to 0 without a Z preamble included. frames has to
+    count past the last frame of a block for that.
+
+    crc_error holds the channel status CRC result of the last block, bit 0
+    for channel 1 and bit 1 for channel 2, and is valid with block_ready.
+
+    :param raddr:   input, Byte to read: bits 4 - 0 byte 0 - 23, bit 5 the
+                    channel (0 is channel 1), bit 6 the block (0 is channel
+                    status, 1 user data)
+    :param dout:    output, The byte at raddr, one rclk after raddr
+    :param rclk:    input, Clock of the read port, None for clk. The halves
+                    swap on clk, so a read of the last byte should be done
+                    well within a block time of block_ready
+    """
+    assert len(raddr) == 7 and len(dout) == 8, \
+        "The read port has 7 address bits and 8 data bits"
+    LAST = AES_CRC_BLOCK - 1
+    FRAMES_MAX = frames.max - 1
+    assert FRAMES_MAX > LAST, "frames counts past the last frame of a block"
+
+    cs_shift, user_shift = create_signals(2, 16)
+    cs_byte, user_byte = create_signals(2, 8)
+    waddr, ram_raddr = create_signals(2, 7)
+    cs_out, user_out = create_signals(2, 8)
+    we, bank, started, ready, wrapped = create_signals(5)
+    user_read = create_signals(1)
+    crc_err1, crc_err2 = create_signals(2)
+
+    read_clk = clk if rclk is None else rclk
+    cs_ram = SimpleTwoPortRam(clk, we, waddr, cs_byte, read_clk, ram_raddr,
+                              cs_out)
+    user_ram = SimpleTwoPortRam(clk, we, waddr, user_byte, read_clk,
+                                ram_raddr, user_out)
+    crc1 = AES_CRC_Checker(cs, frames, channel1, clk, crc_err1)
+    crc2 = AES_CRC_Checker(cs, frames, channel2, clk, crc_err2)
+
+    @always(clk.posedge)
+    def assemble():
+        # Channel 1 in the low byte of the shift registers, channel 2 high
+        we.next = False
+        if channel1:
+            cs_shift.next[8:] = concat(cs, cs_shift[8:1])
+            user_shift.next[8:] = concat(user, user_shift[8:1])
+            cs_byte.next = concat(cs, cs_shift[8:1])
+            user_byte.next = concat(user, user_shift[8:1])
+        elif channel2:
+            cs_shift.next[16:8] = concat(cs, cs_shift[16:9])
+            user_shift.next[16:8] = concat(user, user_shift[16:9])
+            cs_byte.next = concat(cs, cs_shift[16:9])
+            user_byte.next = concat(user, user_shift[16:9])
+        if channel1 or channel2:
+            waddr.next = concat(bank, channel2, frames[8:3])
+            we.next = frames[3:] == 7
+
+    @always(clk.posedge)
+    def swap():
+        if rst:
+            bank.next = False
+            started.next = False
+            ready.next = False
+            wrapped.next = False
+            block_ready.next = False
+        else:
+            ready.next = False
+            block_ready.next = ready
+            if channel1:
+                # 0 after the highest count is the counter wrapping around
+                wrapped.next = frames == FRAMES_MAX
+                if frames == 0 and not wrapped:
+                    started.next = True
+            elif channel2 and frames == LAST:
+                started.next = False
+                if started:
+                    bank.next = not bank
+                    ready.next = True
+
+    @always_comb
+    def read_address():
+        ram_raddr.next = concat(not bank, raddr[6:])
+
+    @always(read_clk.posedge)
+    def read_select():
+        user_read.next = raddr[6]
+
+    @always_comb
+    def read_data():
+        if user_read:
+            dout.next = user_out
+        else:
+            dout.next = cs_out
+
+    @always_comb
+    def crc_flags():
+        crc_error.next = concat(crc_err2, crc_err1)
+
+    return (cs_ram, user_ram, crc1, crc2, assemble, swap, read_address,
+            read_select, read_data, crc_flags)
+
+
+#: Preamble kinds in the state of an AES3_RX_Bank channel
+KIND_NONE, KIND_X, KIND_Y, KIND_Z = range(4)
+
+
+@block
+def AES3_RX_Bank(din, audio, valid, user, cs, parity_error, frame, channel,
+                 subframe, out_en, locked, overflow, clk, rst, SYMBOLS=2):
+    """
+    Receiver for len(din) AES3 inputs with one shared framer and formatter.
+
+    Every input keeps its own AES_Dru and a buffer of up to SYMBOLS
+    recovered half bits. A round robin arbiter hands a channel with buffered
+    half bits to the shared back end, which reads the framer and formatter
+    state of that channel from a state RAM (distributed RAM, indexed by
+    channel), runs the buffered half bits through it and writes the state
+    back, all in one clock. The back end does what AES_Framer and
+    AES_RX_Formatter do per half bit instead of per byte: find the
+    preambles, biphase decode the time slots and assemble the subframe.
+
+    Every subframe comes out on its own: out_en is high for a clock with
+    the samples, the input it came from on channel and subframe 0 for
+    channel A (X and Z preambles) or 1 for channel B (Y preambles). frame
+    counts the frames since the last Z preamble.
+
+    The back end serves every channel at least once every len(din) clocks,
+    so no half bits get lost as long as len(din) is less than SYMBOLS times
+    the clocks per half bit. overflow flags the inputs that lost one anyway,
+    which the clock recovery does until it has settled.
+
+    :param din:         Serial bitstreams, one per bit
+    :param audio:       Audio (24 bits, signed) of the subframe
+    :param frame:       Frame number within the audio block (8 bits)
+    :param channel:     Input of the subframe
+    :param subframe:    Channel B, otherwise channel A
+    :param out_en:      Subframe valid
+    :param locked:      Per input, preambles are found
+    :param overflow:    Per input, a half bit got lost
+    :param clk:         Oversampling clock
+    :param rst:         Synchronous reset, the state RAM keeps its contents
+    :param SYMBOLS:     Half bits per input per back end clock
+    """
+    N = len(din)
+    # Half bits without a preamble before the lock is lost, two subframes
+    T_MAX = 128
+
+    dru_bits = [Signal(False) for _ in range(N)]
+    dru_valids = [Signal(False) for _ in range(N)]
+    drus = [AES_Dru(din(i), dru_bits[i], dru_valids[i], clk, rst)
+            for i in range(N)]
+    symbol_in = ConcatSignal(*reversed(dru_bits))
+    symbol_valid = ConcatSignal(*reversed(dru_valids))
+
+    # Per input buffer, oldest half bit at the bottom
+    buffers = [Signal(intbv(0)[SYMBOLS:]) for _ in range(N)]
+    fills = [Signal(intbv(0, min=0, max=SYMBOLS + 1)) for _ in range(N)]
+    pending = Signal(intbv(0)[N:])
+    pick = Signal(intbv(0, min=0, max=N))
+    last = Signal(intbv(0, min=0, max=N))
+    hit = Signal(False)
+
+    # Back end input
+    go = Signal(False)
+    ch = Signal(intbv(0, min=0, max=N))
+    take_bits = Signal(intbv(0)[SYMBOLS:])
+    take_count = Signal(intbv(0, min=0, max=SYMBOLS + 1))
+
+    # State RAM
+    shift_regs = [Signal(intbv(0)[9:]) for _ in range(N)]
+    counts = [Signal(intbv(0, min=0, max=T_MAX + 1)) for _ in range(N)]
+    slots = [Signal(intbv(0)[28:]) for _ in range(N)]
+    kinds = [Signal(intbv(0)[2:]) for _ in range(N)]
+    frames = [Signal(modbv(0)[8:]) for _ in range(N)]
+    locks = [Signal(False) for _ in range(N)]
+
+    @always_comb
+    def pending_channels():
+        for i in range(N):
+            pending.next[i] = fills[i] != 0
+
+    @always_comb
+    def arbiter():
+        # The first pending channel after the last one served, wrapping
+        first = 0
+        after = 0
+        found = False
+        found_after = False
+        for i in downrange(N):
+            if pending[i]:
+                first = i
+                found = True
+                if i > last:
+                    after = i
+                    found_after = True
+        if found_after:
+            pick.next = after
+        else:
+            pick.next = first
+        hit.next = found
+
+    @always(clk.posedge)
+    def collect():
+        if rst:
+            go.next = False
+            overflow.next = 0
+            for i in range(N):
+                fills[i].next = 0
+        else:
+            go.next = hit
+            if hit:
+                ch.next = pick
+                last.next = pick
+                take_bits.next = buffers[pick]
+                take_count.next = fills[pick]
+
+            lost = intbv(0)[N:]
+            for i in range(N):
+                fill = intbv(0, min=0, max=SYMBOLS + 1)
+                bits = intbv(0)[SYMBOLS:]
+                fill[:] = fills[i]
+                bits[:] = buffers[i]
+                if hit and pick == i:
+                    fill[:] = 0
+                if symbol_valid[i]:
+                    if fill < SYMBOLS:
+                        bits[fill] = symbol_in[i]
+                        fill += 1
+                    else:
+                        lost[i] = 1
+                fills[i].next = fill
+                buffers[i].next = bits
+            overflow.next = lost
+
+    @always(clk.posedge)
+    def back_end():
+        if rst:
+            out_en.next = False
+            locked.next = 0
+        else:
+            out_en.next = False
+            if go:
+                sr = intbv(0)[9:]
+                predet = intbv(0)[8:]
+                t = intbv(0, min=0, max=T_MAX + 1)
+                data = intbv(0)[28:]
+                kind = intbv(0)[2:]
+                count = modbv(0)[8:]
+                out_data = intbv(0)[28:]
+                out_kind = intbv(0)[2:]
+                out_count = modbv(0)[8:]
+                sr[:] = shift_regs[ch]
+                t[:] = counts[ch]
+                data[:] = slots[ch]
+                kind[:] = kinds[ch]
+                count[:] = frames[ch]
+                lock = False
+                if locks[ch]:
+                    lock = True
+                emit = False
+
+                for k in range(SYMBOLS):
+                    if k < take_count:
+                        # Preamble detection as in AES_Framer, relative to
+                        # the level before the preamble
+                        if sr[0]:
+                            predet[:] = ~sr[9:1]
+                        else:
+                            predet[:] = sr[9:1]
+                        fixed = predet[0] and predet[1] and predet[2] and \
+                            not predet[3] and not predet[7]
+                        if fixed and predet[7:4] == 0b100:
+                            kind[:] = KIND_X
+                            count += 1
+                            t[:] = 1
+                            lock = True
+                        elif fixed and predet[7:4] == 0b010:
+                            kind[:] = KIND_Y
+                            t[:] = 1
+                            lock = True
+                        elif fixed and predet[7:4] == 0b001:
+                            kind[:] = KIND_Z
+                            count[:] = 0
+                            t[:] = 1
+                            lock = True
+                        else:
+                            # Time slot t / 2 is complete, 4 - 31 are kept
+                            if t[0] == 0 and t >= 2 and t <= 62:
+                                data[:] = concat(sr[1] ^ sr[2], data[28:1])
+                                if t == 62 and kind != KIND_NONE:
+                                    emit = True
+                                    out_data[:] = data
+                                    out_kind[:] = kind
+                                    out_count[:] = count
+                                    kind[:] = KIND_NONE
+                            if t < T_MAX:
+                                t += 1
+                            if t == T_MAX:
+                                lock = False
+                        symbol = take_bits[k]
+                        sr[:] = concat(symbol, sr[9:1])
+
+                shift_regs[ch].next = sr
+                counts[ch].next = t
+                slots[ch].next = data
+                kinds[ch].next = kind
+                frames[ch].next = count
+                locks[ch].next = lock
+
+                lk = intbv(0)[N:]
+                lk[:] = locked
+                lk[ch] = lock
+                locked.next = lk
+
+                if emit:
+                    p = False
+                    for i in range(28):
+                        p = p ^ out_data[i]
+                    out_en.next = True
+                    audio.next = out_data[24:].signed()
+                    valid.next = out_data[24]
+                    user.next = out_data[25]
+                    cs.next = out_data[26]
+                    parity_error.next = p
+                    frame.next = out_count
+                    channel.next = ch
+                    subframe.next = out_kind == KIND_Y
+
+    return drus, pending_channels, arbiter, collect, back_end
@@ -2,14 +2,25 @@
 
 # http://www.xilinx.com/support/documentation/application_notes/xapp514.pdf
 
-from myhdl import always, always_comb, concat
+from myhdl import block, Signal, intbv, always, always_comb, concat
+from fpga.basics.counter import FractionalClockEnable
 from fpga.utils import create_signals
 
 __author__ = 'michiel'
 
+#: Sample rates of the transmitter as a multiple of the base rate Fs
+#: (32, 44.1 or 48 kHz), log2 of the multiple as for the rate input
+AES_TX_RATE_1FS, AES_TX_RATE_2FS, AES_TX_RATE_4FS = range(3)
 
+PRE_X = 0b01000111
+PRE_Y = 0b00100111
+PRE_Z = 0b00010111
+
+
+@block
 def AES3_TX(audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2, user2,
-            frame0, ce_word, ce_bit, ce_bp, sdata, clk, rst, auto_clk=True):
+            frame0, ce_word, ce_bit, ce_bp, sdata, clk, rst, auto_clk=True,
+            rate=AES_TX_RATE_1FS, increment=None, remainder=0, DENOMINATOR=1):
     """
     :param audio_ch1: 24 bit input signal (:mod:`myhdl`.Signal)
     :param cs1: AES channel data bit
@@ -24,28 +35,84 @@ def AES3_TX(audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2, user2,
     :param ce_bit: Bit clock enable         @  64Fs             | Output if auto_clk = True
     :param ce_bp: Biphase clock enable      @ 128Fs (2x ce_bit) | Output if auto_clk = True
     :param sdata: Serial AES data
-    :param clk: Master clock                @ 512Fs
+    :param clk: Master clock                @ 512Fs, any rate with increment
+    :param rate: With auto_clk, the sample rate (and the enables) as a
+                 multiple of Fs: AES_TX_RATE_1FS, _2FS or _4FS, or a signal
+                 with one of them to switch at run-time
+    :param increment: With auto_clk, the enables come from any master clock
+                      instead of 512Fs: the phase increment (and remainder
+                      and DENOMINATOR) of a FractionalClockEnable for the
+                      128Fs biphase enable, see AES_TX_ClockDivider
     """
-    frame0_reg, last_state = create_signals(2)
-    inreg1, inreg2 = create_signals(2, 27)
-    sr = create_signals(1, 28)
-    parity1, parity2 = create_signals(2)
-    out_xz, out_y, out_ch1, out_ch2 = create_signals(4)
-    set_out_xz, set_out_y, set_out_ch1, set_out_ch2 = create_signals(4)
-    seq = create_signals(1, 37)
-    pre_sr = create_signals(1, 8)
+    load1, load2, out_pre, out_data, state, pre_bit = create_signals(6)
+
+    sequencer = AES_TX_Sequencer(frame0, ce_word, ce_bit, ce_bp, load1, load2,
+                                 out_pre, out_data, state, pre_bit, clk, rst)
+    serializer = AES_TX_Serializer(audio_ch1, cs1, valid1, user1, audio_ch2,
+                                   cs2, valid2, user2, ce_word, ce_bit, ce_bp,
+                                   load1, load2, out_pre, out_data, state,
+                                   pre_bit, sdata, clk)
+
+    if auto_clk:
+        clkenable_gens = AES_TX_ClockDivider(clk, ce_bp, ce_bit, ce_word,
+                                             rate, increment, remainder,
+                                             DENOMINATOR, rst)
+        return sequencer, serializer, clkenable_gens
 
-    dout, b0, b1, txd, state = create_signals(5)
+    return sequencer, serializer
+
+
+@block
+def AES3_TX_Multi(audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2, user2,
+                  frame0, ce_word, ce_bit, ce_bp, sdata, clk, rst,
+                  auto_clk=True, rate=AES_TX_RATE_1FS, increment=None,
+                  remainder=0, DENOMINATOR=1):
+    """
+    AES3_TX for len(sdata) outputs in sync: the audio and channel bits are
+    lists with a signal per output, the rest is as AES3_TX.
+
+    The outputs share the clock enables, the frame sequencing and the
+    preamble shift register, every output only keeps its own data shift
+    register, parity and biphase mark encoder.
+    """
+    N = len(sdata)
+    for signals in (audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2,
+                    user2):
+        assert len(signals) == N, "Every output needs its own inputs"
+    load1, load2, out_pre, out_data, state, pre_bit = create_signals(6)
+
+    sequencer = AES_TX_Sequencer(frame0, ce_word, ce_bit, ce_bp, load1, load2,
+                                 out_pre, out_data, state, pre_bit, clk, rst)
+    serializers = [AES_TX_Serializer(audio_ch1[i], cs1[i], valid1[i], user1[i],
+                                     audio_ch2[i], cs2[i], valid2[i], user2[i],
+                                     ce_word, ce_bit, ce_bp, load1, load2,
+                                     out_pre, out_data, state, pre_bit,
+                                     sdata[i], clk)
+                   for i in range(N)]
 
     if auto_clk:
-        clkenable_gens = AES_TX_ClockDivider(clk, ce_bp, ce_bit, ce_word)
+        clkenable_gens = AES_TX_ClockDivider(clk, ce_bp, ce_bit, ce_word,
+                                             rate, increment, remainder,
+                                             DENOMINATOR, rst)
+        return sequencer, serializers, clkenable_gens
+
+    return sequencer, serializers
 
-    PRE_X = 0b01000111
-    PRE_Y = 0b00100111
-    PRE_Z = 0b00010111
-    PRE_X_INV = 0b10111000
-    PRE_Y_INV = 0b11011000
-    PRE_Z_INV = 0b11101000
+
+@block
+def AES_TX_Sequencer(frame0, ce_word, ce_bit, ce_bp, load1, load2, out_pre,
+                     out_data, state, pre_bit, clk, rst):
+    """
+    The timing of the AES3 frames, shared by the AES_TX_Serializers of the
+    outputs: load1 and load2 load a subframe (with ce_bit), out_pre and
+    out_data select the preamble (pre_bit, before the biphase mark
+    encoding) or the data, state is the half of the bit.
+    """
+    frame0_reg = create_signals(1)
+    out_xz, out_y, out_ch1, out_ch2 = create_signals(4)
+    set_out_xz, set_out_y, set_out_ch1, set_out_ch2 = create_signals(4)
+    seq = create_signals(1, 37)
+    pre_sr = create_signals(1, 8)
 
     @always(clk.posedge)
     def state_logic():
@@ -55,37 +122,20 @@ def AES3_TX(audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2, user2,
             state.next = ce_bit
 
     @always(clk.posedge)
-    def input_reg():
+    def frame0_logic():
         if ce_word:
-            inreg1.next = concat(cs1, user1, valid1, audio_ch1)
-            inreg2.next = concat(cs2, user2, valid2, audio_ch2)
             frame0_reg.next = frame0
 
-    @always(clk.posedge)
-    def audio_shift_reg():
-        if ce_bit:
-            if seq[1]:
-                sr.next = concat(parity1, inreg1)
-            elif seq[33]:
-                sr.next = concat(parity2, inreg2)
-            elif out_ch1 or out_ch2:
-                sr.next = concat(False, sr[28:1])
-
-    @always_comb
-    def parity_gen():
-        p1 = inreg1[0]
-        p2 = inreg2[0]
-        for i in range(len(inreg1) - 1):
-            p1 ^= inreg1[i + 1]
-            p2 ^= inreg2[i + 1]
-        parity1.next = p1
-        parity2.next = p2
-
     @always(clk.posedge)
     def sequencer():
         if ce_bit:
             seq.next = concat(seq[36:], ce_word)
 
+    @always_comb
+    def loads():
+        load1.next = seq[1]
+        load2.next = seq[33]
+
     @always(clk.posedge)
     def output_setter():
         if ce_bit:
@@ -147,40 +197,93 @@ def AES3_TX(audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2, user2,
                 elif set_out_xz:
                     out_ch2.next = False
 
+    @always_comb
+    def output_select():
+        out_pre.next = out_xz or out_y
+        out_data.next = out_ch1 or out_ch2
+
+    # The preambles as sent after a low level, every output inverts them
+    # after a high level
     @always(clk.posedge)
     def preamble_logic():
         if ce_bp:
             if seq[1] and ce_bit:
                 if frame0_reg:
-                    if b1:
-                        pre_sr.next = PRE_Z_INV
-                    else:
-                        pre_sr.next = PRE_Z
+                    pre_sr.next = PRE_Z
                 else:
-                    if b1:
-                        pre_sr.next = PRE_X_INV
-                    else:
-                        pre_sr.next = PRE_X
+                    pre_sr.next = PRE_X
             elif seq[33] and ce_bit:
-                if b1:
-                    pre_sr.next = PRE_Y_INV
-                else:
-                    pre_sr.next = PRE_Y
+                pre_sr.next = PRE_Y
             else:
                 pre_sr.next = concat(False, pre_sr[8:1])
 
+    @always_comb
+    def preamble_bit():
+        pre_bit.next = pre_sr[0]
+
+    return (state_logic, frame0_logic, sequencer, loads, output_setter,
+            output_xz, output_ch1, output_y, output_ch2, output_select,
+            preamble_logic, preamble_bit)
+
+
+@block
+def AES_TX_Serializer(audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2,
+                      user2, ce_word, ce_bit, ce_bp, load1, load2, out_pre,
+                      out_data, state, pre_bit, sdata, clk):
+    """
+    The data, parity and biphase mark encoding of one AES3 output, timed by
+    an AES_TX_Sequencer.
+    """
+    inreg1, inreg2 = create_signals(2, 27)
+    sr = create_signals(1, 28)
+    parity1, parity2 = create_signals(2)
+    pre_inv = create_signals(1)
+
+    dout, b0, b1, txd, last_state = create_signals(5)
+
+    @always(clk.posedge)
+    def input_reg():
+        if ce_word:
+            inreg1.next = concat(cs1, user1, valid1, audio_ch1)
+            inreg2.next = concat(cs2, user2, valid2, audio_ch2)
+
+    @always(clk.posedge)
+    def audio_shift_reg():
+        if ce_bit:
+            if load1:
+                sr.next = concat(parity1, inreg1)
+            elif load2:
+                sr.next = concat(parity2, inreg2)
+            elif out_data:
+                sr.next = concat(False, sr[28:1])
+
+    @always_comb
+    def parity_gen():
+        p1 = inreg1[0]
+        p2 = inreg2[0]
+        for i in range(len(inreg1) - 1):
+            p1 ^= inreg1[i + 1]
+            p2 ^= inreg2[i + 1]
+        parity1.next = p1
+        parity2.next = p2
+
+    @always(clk.posedge)
+    def preamble_logic():
+        if ce_bp and ce_bit and (load1 or load2):
+            pre_inv.next = b1
+
     @always_comb
     def output_mux():
-        dout.next = pre_sr[0] if out_xz or out_y else sr[0]
+        dout.next = pre_bit ^ pre_inv if out_pre else sr[0]
         txd.next = b0 if state else b1
 
     @always_comb
     def biphase_comb_logic_0():
-        b0.next = dout if out_xz or out_y else not last_state
+        b0.next = dout if out_pre else not last_state
 
     @always_comb
     def biphase_comb_logic_1():
-        b1.next = dout if out_xz or out_y else b0 ^ dout
+        b1.next = dout if out_pre else b0 ^ dout
 
     @always(clk.posedge)
     def last_state_logic():
@@ -192,43 +295,114 @@ def AES3_TX(audio_ch1, cs1, valid1, user1, audio_ch2, cs2, valid2, user2,
         if ce_bp:
             sdata.next = txd
 
-    functions = [state_logic, input_reg, audio_shift_reg, parity_gen, sequencer,
-                 output_setter, output_ch1, output_ch2, output_xz, output_y,
-                 preamble_logic, output_mux, biphase_comb_logic_0,
-                 biphase_comb_logic_1, last_state_logic, sdata_logic]
+    return (input_reg, audio_shift_reg, parity_gen, preamble_logic,
+            output_mux, biphase_comb_logic_0, biphase_comb_logic_1,
+            last_state_logic, sdata_logic)
 
-    if auto_clk:
-        functions.append(clkenable_gens)
 
-    return tuple(functions)
+@block
+def AES_TX_ClockDivider(clk, biphase_enable, bit_enable, word_enable,
+                        rate=AES_TX_RATE_1FS, increment=None, remainder=0,
+                        DENOMINATOR=1, rst=None):
+    """
+    The clock enables of an AES3_TX from a 512Fs master clock: the biphase
+    enable at 128, 256 or 512Fs, the bit enable at half of it and the word
+    enable every 64 bits. All are decoded from one counter. A run-time
+    change of rate takes effect when the counter wraps, which ends a frame
+    at every rate, so no frame is cut short.
+
+    With an increment the master clock can be any clock above 128Fs, like
+    44.1 kHz from 100 MHz: a FractionalClockEnable makes the biphase enable
+    at an exact long-term rate, a count of them divides it by 2 for the bit
+    enable and by 128 for the word enable. The rate then only follows from
+    the increment (and remainder), see fractional_increment().
+
+    :param rate:        AES_TX_RATE_1FS, _2FS or _4FS, or a signal with one
+                        of them
+    :param increment:   Phase increment signal of the biphase enable, see
+                        FractionalClockEnable
+    :param remainder:   Signal or constant, see FractionalClockEnable
+    :param rst:         Synchronous reset, needed with an increment
+    """
+    if increment is not None:
+        assert rst is not None, "A fractional clock enable needs a reset"
+        bp_count = create_signals(1, 7, mod=True)
+
+        biphase_gen = FractionalClockEnable(clk, rst, increment,
+                                            biphase_enable, remainder,
+                                            DENOMINATOR)
+
+        @always(clk.posedge)
+        def counting():
+            if rst:
+                bp_count.next = 0
+            elif biphase_enable:
+                bp_count.next = bp_count + 1
+
+        @always_comb
+        def bit_clocker():
+            bit_enable.next = biphase_enable and not bp_count[0]
 
+        @always_comb
+        def word_clocker():
+            word_enable.next = biphase_enable and bp_count == 0
+
+        return biphase_gen, counting, bit_clocker, word_clocker
 
-def AES_TX_ClockDivider(clk, biphase_enable, bit_enable, word_enable):
     clken_count = create_signals(1, 9, mod=True)
 
+    if isinstance(rate, int):
+        assert rate in (AES_TX_RATE_1FS, AES_TX_RATE_2FS, AES_TX_RATE_4FS), \
+            "Rate should be 1, 2 or 4 Fs"
+        bp_mask = 3 >> rate
+        bit_mask = 7 >> rate
+        word_mask = 511 >> rate
+        masks = []
+    else:
+        bp_mask = Signal(intbv(3)[2:])
+        bit_mask = Signal(intbv(7)[3:])
+        word_mask = Signal(intbv(511)[9:])
+
+        # A new rate starts with the count, on a word at every rate
+        @always(clk.posedge)
+        def masks():
+            if clken_count == 511:
+                if rate == AES_TX_RATE_4FS:
+                    bp_mask.next = 0
+                    bit_mask.next = 1
+                    word_mask.next = 127
+                elif rate == AES_TX_RATE_2FS:
+                    bp_mask.next = 1
+                    bit_mask.next = 3
+                    word_mask.next = 255
+                else:
+                    bp_mask.next = 3
+                    bit_mask.next = 7
+                    word_mask.next = 511
+
     @always(clk.posedge)
     def counting():
         clken_count.next = clken_count + 1
 
     @always_comb
     def biphase_clocker():
-        if clken_count[1:0] == 0:
+        if (clken_count & bp_mask) == 0:
             biphase_enable.next = 1
         else:
             biphase_enable.next = 0
 
     @always_comb
     def bit_clocker():
-        if clken_count[2:0] == 0:
+        if (clken_count & bit_mask) == 0:
             bit_enable.next = 1
         else:
             bit_enable.next = 0
 
     @always_comb
     def word_clocker():
-        if clken_count == 0:
+        if (clken_count & word_mask) == 0:
             word_enable.next = 1
         else:
             word_enable.next = 0
 
-    return counting, biphase_clocker, bit_clocker, word_clocker
+    return counting, masks, biphase_clocker, bit_clocker, word_clocker
@@ -2,8 +2,6 @@
 
 __author__ = 'michiel'
 
-import fpga.basics.flipflops as ff
-
 from myhdl import intbv, always, always_comb, concat
 from fpga.utils import create_signals
 
@@ -88,38 +86,48 @@ def DataBuffer(parallel_in, load, wait, output_enable, dout, sclk, reset):
 
 
 def Serial2Parallel(sdata, start, dout, sclk):
-
+    """
+    Serial to parallel converter, MSB first. start loads the MSB and clears
+    the other bits, a one hot enable then walks down to load the rest. The
+    word received before start comes out on dout.
+
+    :param sdata:   Serial data input
+    :param start:   First bit of a word
+    :param dout:    Parallel data output
+    :param sclk:    Clock input
+    :return:
+    """
     M = len(dout)
     assert M > 2
-    buf = create_signals(M)
-    en = create_signals(M - 1)
-
-    shift_msb = ff.dff_set(en[M - 2], False, start, sclk)
-    buf_msb = ff.dffe(buf[M - 1], sdata, start, sclk)
+    buf = create_signals(1, M)
+    en = create_signals(1, M - 1)
 
-    shifts = [ff.dff_reset(en[M - 3 - i], en[M - 2 - i], sclk, start)
-              for i in range(M - 2)]
-    bufs = [ff.dffe_rst(buf[M - 2 - i], sdata, en[M - 2 - i], sclk, start)
-            for i in range(M - 1)]
+    @always(sclk.posedge)
+    def shifter():
+        if start:
+            en.next = 1 << (M - 2)
+            buf.next = concat(sdata, intbv(0)[M - 1:])
+        else:
+            en.next = en >> 1
+            t = intbv(0)[M:]
+            t[:] = buf
+            for i in range(M - 1):
+                if en[i]:
+                    t[i] = sdata
+            buf.next = t
 
     if dout.min < 0:
         @always(sclk.posedge)
         def logic():
             if start:
-                t = intbv(0, _nrbits=M)
-                for i in range(M):
-                    t[i] = buf[i]
-                dout.next = t.signed()
+                dout.next = buf.signed()
     else:
         @always(sclk.posedge)
         def logic():
             if start:
-                t = intbv(0, _nrbits=M)
-                for i in range(M):
-                    t[i] = buf[i]
-                dout.next = t
+                dout.next = buf
 
-    return shift_msb, shifts, buf_msb, bufs, logic
+    return shifter, logic
 
 
 def I2S_Transmitter(left, right, load_left, load_right, sdata, ws, sclk, reset):
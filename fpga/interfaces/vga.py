@@ -3,8 +3,6 @@
 from __future__ import print_function
 from myhdl import Signal, intbv, always, always_comb
 from math import log, ceil
-from colorama import init, deinit, reinit, Fore
-init()
 from fpga.examples.pong import PongPixelGenerator
 from fpga import toVHDL
 
@@ -30,8 +28,14 @@ It has a pixel per line count of {ppl}
 And a line per screen count of {lps}.
 With a display refresh rate of {sps} Hz."""
 CLOCK = PIXEL_PER_LINE * LINES_PER_SCREEN * SCREENS_PER_SECOND        # Clockspeed in Hz (25MHz)
-print(Fore.RED + "The display clock should be at least: {clock} MHz".format(clock=CLOCK/1e6) + Fore.RESET)
-print(Fore.BLUE + infotext.format(width=WIDTH, height=HEIGTH, ppl=PIXEL_PER_LINE, lps=LINES_PER_SCREEN, sps=SCREENS_PER_SECOND))
+
+
+def print_info():
+    from colorama import init, deinit, Fore
+    init()
+    print(Fore.RED + "The display clock should be at least: {clock} MHz".format(clock=CLOCK/1e6) + Fore.RESET)
+    print(Fore.BLUE + infotext.format(width=WIDTH, height=HEIGTH, ppl=PIXEL_PER_LINE, lps=LINES_PER_SCREEN, sps=SCREENS_PER_SECOND))
+    deinit()
 
 
 def color_create(i):
@@ -135,7 +139,6 @@ def PixelGenerator(data, pixel_x, pixel_y, video_on, r, g, b, clk, rst):
 
     return logic, logic_comb, pixel_gen
 
-deinit()
 
 def convert():
     data = Signal(intbv(0)[3:])
@@ -144,6 +147,7 @@ def convert():
 
     toVHDL(VGA_Controller, data, h_sync, v_sync, r, g, b, clk, rst)
 
-convert()
-# reinit()
-# deinit()
\ No newline at end of file
+
+if __name__ == '__main__':
+    print_info()
+    convert()
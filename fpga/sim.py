@@ -0,0 +1,545 @@
+#!/usr/bin/env python
+"""Simulation runner: run_sim with profiling and selective tracing, and
+run_sim_parallel to run a bench over many seeds.
+
+The profiler and the tracer hook into the simulation through MyHDL
+internals, which are only known for the versions in MYHDL_VERSIONS.
+"""
+
+__author__ = 'michiel'
+
+import sys
+import gzip
+import json
+import fnmatch
+import random
+import time
+import traceback
+import warnings
+import multiprocessing
+from types import GeneratorType
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import myhdl
+from myhdl import delay, now, Simulation, traceSignals, bin, EnumItemType
+
+#: MyHDL versions of which the internals below are known
+MYHDL_VERSIONS = ('0.10', '0.11')
+
+if not myhdl.__version__.startswith(MYHDL_VERSIONS):
+    warnings.warn("fpga.sim is made for MyHDL {}, not {}".format(
+        ' or '.join(MYHDL_VERSIONS), myhdl.__version__))
+
+try:
+    from myhdl._block import block_decorator, _Block
+    from myhdl._instance import _Instantiator
+    from myhdl._Signal import _Signal
+    from myhdl._Waiter import _Waiter, _inferWaiter
+except ImportError as e:
+    raise ImportError("fpga.sim needs the internals of MyHDL {}, they "
+                      "changed in MyHDL {}: {}".format(
+                          ' or '.join(MYHDL_VERSIONS), myhdl.__version__, e))
+
+__all__ = [
+    'SimProfile',
+    'SignalTrace',
+    'SimResult',
+    'run_sim',
+    'run_sim_parallel',
+]
+
+
+class SimProfile(object):
+    """Activations and wall time per simulated process, see run_sim.
+
+    Processes are named by their instance path in the bench hierarchy, like
+    bench/dut/framer/logic.
+    """
+
+    def __init__(self):
+        #: path -> [activations, seconds]
+        self.processes = OrderedDict()
+        self.seconds = 0.
+        self.sim_time = 0
+
+    def add(self, path):
+        """Add a process, returns the mutable [activations, seconds] of it."""
+        unique, n = path, 1
+        while unique in self.processes:
+            unique = '{}[{}]'.format(path, n)
+            n += 1
+        self.processes[unique] = [0, 0.]
+        return self.processes[unique]
+
+    def sorted(self):
+        """[(path, activations, seconds)] with the most expensive first."""
+        return sorted(((path, a, t) for path, (a, t) in self.processes.items()),
+                      key=lambda p: (-p[2], p[0]))
+
+    def report(self, limit=None):
+        processes = self.sorted()
+        total = sum(t for _, _, t in processes) or 1.
+        width = max([len(p[0]) for p in processes] + [7])
+        lines = ["{:<{w}}  {:>11}  {:>10}  {:>11}  {:>6}".format(
+            'process', 'activations', 'total ms', 'us/activate', '%',
+            w=width)]
+        for path, activations, seconds in processes[:limit]:
+            lines.append("{:<{w}}  {:>11}  {:>10.3f}  {:>11.3f}  {:>6.2f}".format(
+                path, activations, seconds * 1e3,
+                seconds * 1e6 / max(activations, 1), 100. * seconds / total,
+                w=width))
+        lines.append("{} processes, {:.3f} s in processes of {:.3f} s "
+                     "simulating {} time steps".format(
+                         len(processes), sum(t for _, _, t in processes),
+                         self.seconds, self.sim_time))
+        return "\n".join(lines)
+
+    def to_json(self, filename=None):
+        """The profile as JSON string, also written to filename if given."""
+        data = json.dumps({
+            'seconds': self.seconds,
+            'sim_time': self.sim_time,
+            'processes': [{'path': path, 'activations': activations,
+                           'seconds': seconds}
+                          for path, activations, seconds in self.sorted()],
+        }, indent=2)
+        if filename is not None:
+            with open(filename, 'w') as f:
+                f.write(data)
+        return data
+
+
+def _profiled(generator, stats):
+    """Pass through the generator, counting and timing every resume."""
+    timer = time.perf_counter
+    while True:
+        start = timer()
+        try:
+            clause = next(generator)
+        except StopIteration:
+            return
+        finally:
+            stats[0] += 1
+            stats[1] += timer() - start
+        yield clause
+
+
+def _block_locals(inst):
+    """The locals of a block function, as seen while creating its subs."""
+    symdict = OrderedDict()
+    for sub in inst.subs:
+        callinfo = getattr(sub, 'callinfo', None)
+        if callinfo is not None:
+            symdict.update(callinfo.symdict)
+    return symdict
+
+
+def _profile_waiters(inst, path, profile, waiters):
+    if isinstance(inst, _Block):
+        names = dict((id(v), n) for n, v in _block_locals(inst).items())
+        for sub in inst.subs:
+            # Name the instance as the parent does, fall back to the unique name
+            name = names.get(id(sub), sub.name)
+            _profile_waiters(sub, path + '/' + name, profile, waiters)
+    elif isinstance(inst, (list, tuple, set)):
+        for sub in inst:
+            _profile_waiters(sub, path + '/' + getattr(sub, 'name', sub.__name__),
+                             profile, waiters)
+    elif isinstance(inst, (_Instantiator, GeneratorType)):
+        # Infer the waiter from the original generator, then wrap its generator
+        waiter = inst.waiter if isinstance(inst, _Instantiator) else \
+            _inferWaiter(inst)
+        waiter.generator = _profiled(waiter.generator, profile.add(path))
+        waiters.append(waiter)
+    else:
+        waiters.append(inst)
+
+
+def _hierarchy_signals(inst, path, found):
+    """Collect path -> signal of every signal in the hierarchy, a signal
+    appears once for every name it has (port names in the sub blocks)."""
+    if isinstance(inst, _Block):
+        symdict = _block_locals(inst)
+        names = dict((id(v), n) for n, v in symdict.items())
+    elif isinstance(inst, (list, tuple, set)):
+        # Deprecated non block bench, only the locals of its generators
+        symdict = OrderedDict()
+        for sub in inst:
+            if isinstance(sub, _Instantiator):
+                symdict.update(sub.callinfo.symdict)
+        names, inst = {}, None
+    else:
+        return
+
+    for name, value in symdict.items():
+        if isinstance(value, _Signal):
+            found.append((path + '/' + name, value))
+        elif isinstance(value, (list, tuple)) and value and \
+                all(isinstance(v, _Signal) for v in value):
+            found.extend(('{}/{}[{}]'.format(path, name, i), v)
+                         for i, v in enumerate(value))
+
+    for sub in inst.subs if inst is not None else ():
+        if isinstance(sub, _Block):
+            _hierarchy_signals(sub, path + '/' + names.get(id(sub), sub.name),
+                               found)
+
+
+class SignalTrace(object):
+    """Trace a selection of signals to a VCD file, see run_sim.
+
+    Only the selected signals are watched, by a single process, so the
+    simulation doesn't slow down like with traceSignals. The VCD is
+    streamed through a buffer of buffer_size bytes, a filename ending on .gz
+    is gzip compressed, on .zst zstd compressed (needs zstandard).
+
+    :param filename:    VCD file (.vcd, .vcd.gz or .vcd.zst)
+    :param signals:     Signal paths or glob patterns, like 'bench/dut/*'.
+                        Ports match on their name in the parent and in the
+                        sub block.
+    :param windows:     List of (start, end) simulation times to record,
+                        None records everything
+    :param trigger:     Signal or function without arguments, nothing is
+                        recorded before it is True. Evaluated when one of
+                        the traced signals (or the trigger signal) changes.
+    :param buffer_size: Bytes buffered before writing to the file
+    :param timescale:   VCD time unit of a simulation time step
+    """
+
+    def __init__(self, filename, signals=('*', ), windows=None, trigger=None,
+                 buffer_size=1 << 16, timescale='1ns'):
+        if isinstance(signals, str):
+            signals = (signals, )
+        self.filename = filename
+        self.patterns = tuple(signals)
+        self.windows = sorted(windows) if windows is not None else None
+        self.trigger = trigger
+        self.buffer_size = buffer_size
+        self.timescale = timescale
+        self.signals = OrderedDict()
+        self._file = None
+        self._raw = None
+        self._buffer = []
+        self._buffered = 0
+
+    def select(self, benches):
+        """Select the signals of [(name, instance)] matching the patterns.
+
+        :return: OrderedDict of path -> signal
+        """
+        found = []
+        for name, inst in benches:
+            _hierarchy_signals(inst, name, found)
+
+        selected = set()
+        for path, signal in found:
+            if any(fnmatch.fnmatchcase(path, p) for p in self.patterns):
+                selected.add(id(signal))
+
+        self.signals = OrderedDict()
+        named = set()
+        for path, signal in found:
+            # Named after the first (highest in the hierarchy) name
+            if id(signal) in selected and id(signal) not in named:
+                named.add(id(signal))
+                self.signals[path] = signal
+        return self.signals
+
+    def recorder(self, benches):
+        """Open the file, write the header and return the recording process
+        for the signals of [(name, instance)]."""
+        self.select(benches)
+        self._open()
+        self._header()
+        return _Waiter(self._record())
+
+    def _open(self):
+        if self.filename.endswith('.gz'):
+            self._file = gzip.open(self.filename, 'wb')
+        elif self.filename.endswith('.zst'):
+            import zstandard
+            self._raw = open(self.filename, 'wb')
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw)
+        else:
+            self._file = open(self.filename, 'wb')
+
+    def _write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer).encode())
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            if self._raw is not None:
+                self._raw.close()
+        self._file = self._raw = None
+
+    @staticmethod
+    def _code(index):
+        code = ''
+        while True:
+            code += chr(33 + index % 94)
+            index //= 94
+            if not index:
+                return code
+
+    def _header(self):
+        self._write("$date {} $end\n".format(time.asctime()))
+        self._write("$version MyHDL fpga SignalTrace $end\n")
+        self._write("$timescale {} $end\n".format(self.timescale))
+        scope = []
+        for index, (path, signal) in enumerate(self.signals.items()):
+            modules, name = path.split('/')[:-1], path.split('/')[-1]
+            common = 0
+            while common < min(len(scope), len(modules)) and \
+                    scope[common] == modules[common]:
+                common += 1
+            for _ in scope[common:]:
+                self._write("$upscope $end\n")
+            for module in modules[common:]:
+                self._write("$scope module {} $end\n".format(module))
+            scope = modules
+
+            if isinstance(signal._val, EnumItemType):
+                kind, width = 'string', 1
+            else:
+                kind, width = 'reg', signal._nrbits or 32
+            self._write("$var {} {} {} {} $end\n".format(
+                kind, width, self._code(index), name.replace('[', '(')
+                                                    .replace(']', ')')))
+        for _ in scope:
+            self._write("$upscope $end\n")
+        self._write("$enddefinitions $end\n")
+
+    def _value(self, signal, code):
+        val = signal._val
+        if isinstance(val, EnumItemType):
+            return "s{} {}\n".format(val, code)
+        elif signal._nrbits == 1 or isinstance(val, bool):
+            return "{}{}\n".format(int(val), code)
+        return "b{} {}\n".format(bin(int(val), signal._nrbits), code)
+
+    def _active(self, t):
+        if self.windows is not None and \
+                not any(start <= t < end for start, end in self.windows):
+            return False
+        if self.trigger is not None and not self._triggered:
+            trigger = self.trigger
+            self._triggered = bool(trigger() if callable(trigger) and
+                                   not isinstance(trigger, _Signal)
+                                   else trigger)
+            return self._triggered
+        return True
+
+    def _next_boundary(self, t):
+        if self.windows is None:
+            return None
+        for start, end in self.windows:
+            for boundary in (start, end):
+                if boundary > t:
+                    return boundary - t
+        return None
+
+    def _record(self):
+        signals = list(self.signals.values())
+        codes = [self._code(i) for i in range(len(signals))]
+        watch = tuple(signals)
+        if isinstance(self.trigger, _Signal):
+            watch += (self.trigger, )
+        last = [None] * len(signals)
+        self._triggered = False
+        last_time = None
+
+        while True:
+            t = now()
+            if self._active(t):
+                for i, signal in enumerate(signals):
+                    val = signal._val
+                    if last[i] is None or val != last[i]:
+                        if t != last_time:
+                            self._write("#{}\n".format(t))
+                            last_time = t
+                        self._write(self._value(signal, codes[i]))
+                        last[i] = int(val) if not isinstance(
+                            val, EnumItemType) else val
+            else:
+                # Dump everything again when recording restarts
+                last = [None] * len(signals)
+
+            boundary = self._next_boundary(t)
+            if boundary is None:
+                yield watch
+            else:
+                yield watch + (delay(boundary), )
+
+
+def run_sim(bench, time_steps=None, trace=False, seed=None, profile=False,
+            **kwargs):
+    """Simulate a bench (or a tuple of benches) until StopSimulation or
+    time_steps.
+
+    :param bench:       Bench function, plain or @block, or tuple of them
+    :param time_steps:  Simulation duration, None runs until there is no more
+                        to simulate
+    :param trace:       Dump all signals to a VCD file, or a SignalTrace
+                        to trace a selection of them
+    :param seed:        Seed for random and numpy.random, to replay a run
+    :param profile:     Count activations and wall time of every process and
+                        print the most expensive ones. A filename also saves
+                        the profile as JSON.
+    :param kwargs:      Passed on to the bench functions
+    :return:            SimProfile when profiling
+    """
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+    try:
+        benches = tuple(bench)
+    except TypeError:
+        benches = (bench, )
+
+    signal_trace = trace if isinstance(trace, SignalTrace) else None
+    trace_all = trace and signal_trace is None
+
+    b = []
+    for bench in benches:
+        if trace_all and not isinstance(bench, block_decorator):
+            # Deprecated non block benches are elaborated by traceSignals
+            profiler = sys.getprofile()
+            try:
+                inst = traceSignals(bench, **kwargs)
+            except Exception:
+                # MyHDL leaves its hierarchy extractor behind when the bench
+                # fails, which breaks elaborating any block after it
+                sys.setprofile(profiler)
+                raise
+        else:
+            inst = bench(**kwargs)
+            if trace_all:
+                inst = traceSignals(inst)
+        b.append((bench.__name__, inst))
+
+    extra = []
+    if signal_trace is not None:
+        extra.append(signal_trace.recorder(b))
+
+    sim_profile = None
+    if profile:
+        sim_profile = SimProfile()
+        waiters = []
+        for name, inst in b:
+            _profile_waiters(inst, name, sim_profile, waiters)
+        sim = Simulation(*(waiters + extra))
+    else:
+        sim = Simulation(*([inst for _, inst in b] + extra))
+
+    start = time.time()
+    try:
+        sim.run(time_steps)
+    finally:
+        if sim_profile is not None:
+            sim_profile.seconds = time.time() - start
+            sim_profile.sim_time = now()
+        if signal_trace is not None:
+            signal_trace.close()
+        # Also after a failing bench, so the next simulation can start
+        sim.quit()
+
+    if sim_profile is not None:
+        print(sim_profile.report(limit=20))
+        if isinstance(profile, str):
+            sim_profile.to_json(profile)
+    return sim_profile
+
+
+SimResult = namedtuple('SimResult', ['seed', 'passed', 'seconds', 'sim_time',
+                                     'error'])
+
+_parallel_bench = None
+
+
+def _run_seed(job):
+    seed, time_steps, coverage, kwargs = job
+    cov = None
+    if coverage:
+        import coverage as coverage_module
+        cov = coverage_module.Coverage(data_suffix=True)
+        cov.start()
+
+    start = time.time()
+    error = None
+    try:
+        run_sim(_parallel_bench, time_steps, seed=seed, **kwargs)
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        if cov is not None:
+            cov.stop()
+            cov.save()
+
+    return SimResult(seed, error is None, time.time() - start, now(), error)
+
+
+def run_sim_parallel(bench, seeds=8, time_steps=None, processes=None,
+                     coverage=False, **kwargs):
+    """Run a bench once per seed, every seed in its own worker process.
+
+    The benches don't need any changes, every run gets random and
+    numpy.random seeded with its own seed. A failing seed can be replayed
+    on its own with run_sim(bench, time_steps, seed=seed).
+
+    :param bench:       Bench function(s) as accepted by run_sim
+    :param seeds:       Number of seeds (0 .. seeds - 1) or a list of seeds
+    :param time_steps:  Simulation duration per seed
+    :param processes:   Worker processes, defaults to the number of cores
+    :param coverage:    Measure line coverage per seed with the coverage
+                        package and combine it into one .coverage file
+    :param kwargs:      Passed on to the bench functions
+    :return:            List of SimResult per seed, raises an AssertionError
+                        when a seed failed
+    """
+    global _parallel_bench
+
+    if isinstance(seeds, int):
+        seeds = range(seeds)
+    jobs = [(seed, time_steps, coverage, kwargs) for seed in seeds]
+
+    start = time.time()
+    # Fork, so the benches (usually closures in a test) don't need pickling
+    _parallel_bench = bench
+    try:
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes, maxtasksperchild=1) as pool:
+            results = pool.map(_run_seed, jobs, chunksize=1)
+    finally:
+        _parallel_bench = None
+
+    if coverage:
+        import coverage as coverage_module
+        cov = coverage_module.Coverage()
+        cov.combine()
+        cov.save()
+
+    failed = [r for r in results if not r.passed]
+    print("{} of {} seeds passed in {:.2f} s ({:.2f} s simulating)".format(
+        len(results) - len(failed), len(results), time.time() - start,
+        sum(r.seconds for r in results)))
+
+    if failed:
+        raise AssertionError(
+            "Failing seeds {}, replay with run_sim(bench, seed=...)\n"
+            "First failure (seed {}):\n{}".format(
+                [r.seed for r in failed], failed[0].seed, failed[0].error))
+
+    return results
@@ -1,2 +1,2 @@
 
-print("NOT UPDATED YET")
+# NOTE(michiel): NOT UPDATED YET
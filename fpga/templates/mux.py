@@ -1,8 +1,12 @@
+import warnings
+
 from fpga.utils import create_signals
 from fpga.templates.template import Templating
 
 
 class MuxTemplate(Templating):
+    """Deprecated, a flat if/elif chain written to a file. Use
+    fpga.basics.multiplexers.MuxTree instead."""
     multimux = """
 def mux({mux_inputs}, sel, dout):
 
@@ -15,6 +19,9 @@ def mux({mux_inputs}, sel, dout):
 """.format
 
     def __init__(self, input_signals):
+        warnings.warn("MuxTemplate is deprecated, use "
+                      "fpga.basics.multiplexers.MuxTree", DeprecationWarning,
+                      stacklevel=2)
         super().__init__()
         self.header.append("from myhdl import always_comb")
         in_sig = self.transform_signals(input_signals, 'in')
@@ -27,6 +34,11 @@ def mux({mux_inputs}, sel, dout):
                                     for i, name in names))
 
 
-inputs = create_signals(6, 21, signed=True, delay=None)
-muxer = MuxTemplate(inputs)
-muxer.write('luktdit.py')
+def write_example(filename='luktdit.py'):
+    inputs = create_signals(6, 21, signed=True, delay=None)
+    muxer = MuxTemplate(inputs)
+    muxer.write(filename)
+
+
+if __name__ == '__main__':
+    write_example()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+__author__ = 'michiel'
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from myhdl import block, instance, StopSimulation
+
+from fpga.basics.accumulator import PipelinedAccumulator, MultiplyAccumulate, \
+    accumulator_latency, mac_latency, guard_bits, TRUNCATE, ROUND_HALF_UP
+from fpga.utils import create_signals
+from fpga.tests.test_utils import generate_clock
+
+
+def accumulator_model(values, enables, clears, dout, shift=0,
+                      rounding=TRUNCATE, saturate=False):
+    """dout after the clock of every value, without the latency."""
+    bias = 2 ** (shift - 1) if shift and rounding == ROUND_HALF_UP else 0
+    bits = len(dout)
+    total, outputs = 0, []
+    for value, ce, clr in zip(values, enables, clears):
+        if clr:
+            total = 0
+        elif ce:
+            total += int(value)
+        out = (total + bias) >> shift
+        if saturate:
+            out = min(max(out, dout.min), dout.max - 1)
+        elif dout.min < 0:
+            out = (out + 2 ** (bits - 1)) % 2 ** bits - 2 ** (bits - 1)
+        else:
+            out %= 2 ** bits
+        outputs.append(out)
+    return outputs
+
+
+def accumulator_bench(vectors, din, dout, latency, stimuli, func, **kwargs):
+    """Run stimuli (tuples of input values, ce and clr) through the block
+    func(clk, rst, ce, clr, *din, dout, **kwargs), dout lined up with
+    stimuli."""
+    outputs = []
+
+    @block
+    def bench():
+        clk, rst, ce, clr = create_signals(4)
+        inst = func(clk, rst, ce, clr, *(din + [dout]), **kwargs)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors + latency):
+                values, enable, clear = stimuli[min(i, vectors - 1)]
+                for signal, value in zip(din, values):
+                    signal.next = int(value)
+                ce.next = bool(enable) and i < vectors
+                clr.next = bool(clear)
+                yield clk.posedge
+                yield clk.negedge
+                outputs.append(int(dout))
+            raise StopSimulation
+
+        return inst, clock_gen, stimulus
+
+    bench().run_sim()
+    return outputs[latency - 1:latency - 1 + vectors]
+
+
+def accumulate(vectors, din_bits, dout, terms=1024, chunk=24, signed=True,
+               shift=0, rounding=TRUNCATE, saturate=False, clear_rate=.02,
+               first_clear=True):
+    din = create_signals(1, din_bits, signed=signed)
+    low, high = (din.min, din.max)
+    values = np.random.randint(low, high, vectors)
+    # Mostly extremes, so the carries and the saturation get exercised
+    extremes = np.random.random(vectors) < .5
+    values[extremes] = np.where(values[extremes] < 0, low, high - 1)
+    enables = np.random.random(vectors) < .9
+    clears = np.random.random(vectors) < clear_rate
+    clears[0] = first_clear
+
+    latency = accumulator_latency(din, terms, chunk)
+    outputs = accumulator_bench(
+        vectors, [din], dout, latency,
+        list(zip(values.reshape(-1, 1), enables, clears)),
+        PipelinedAccumulator, terms=terms, chunk=chunk, shift=shift,
+        rounding=rounding, saturate=saturate)
+    return outputs, accumulator_model(values, enables, clears, dout, shift,
+                                      rounding, saturate)
+
+
+def test_guard_bits():
+    assert guard_bits(1) == 0
+    assert guard_bits(2) == 1
+    assert guard_bits(1024) == 10
+    assert guard_bits(1025) == 11
+
+
+def test_accumulator_latency():
+    # 48 bits + 10 guard bits in chunks of at most 24 bits
+    assert accumulator_latency(create_signals(1, 48, signed=True), 1024) == 4
+    assert accumulator_latency(create_signals(1, 14, signed=True), 1024) == 2
+    # Unsigned values need a sign bit more
+    assert accumulator_latency(create_signals(1, 14), 1024, 12) == 4
+
+
+def test_pipelined_accumulator(vectors=1000):
+    # Full width, 58 bits in 3 chunks
+    dout = create_signals(1, 58, signed=True)
+    outputs, expected = accumulate(vectors, 48, dout, clear_rate=.005)
+    assert outputs == expected
+
+    # Unsigned, narrow chunks
+    dout = create_signals(1, 30, signed=True)
+    outputs, expected = accumulate(vectors, 20, dout, chunk=7, signed=False)
+    assert outputs == expected
+
+
+def test_pipelined_accumulator_read_out(vectors=1000):
+    for rounding in (TRUNCATE, ROUND_HALF_UP):
+        for saturate in (False, True):
+            dout = create_signals(1, 16, signed=True)
+            outputs, expected = accumulate(vectors, 24, dout, terms=64,
+                                           chunk=12, shift=10,
+                                           rounding=rounding,
+                                           saturate=saturate)
+            assert outputs == expected, (rounding, saturate)
+            if saturate:
+                assert dout.max - 1 in outputs or dout.min in outputs
+
+    # Rounded from the first sum on, without a clear
+    dout = create_signals(1, 16, signed=True)
+    outputs, expected = accumulate(vectors, 24, dout, terms=64, chunk=12,
+                                   shift=10, rounding=ROUND_HALF_UP,
+                                   clear_rate=0, first_clear=False)
+    assert outputs == expected
+
+
+def test_multiply_accumulate(vectors=500):
+    a, b = create_signals(2, 25, signed=True)
+    dout = create_signals(1, 60, signed=True)
+    a_values = np.random.randint(a.min, a.max, vectors)
+    b_values = np.random.randint(b.min, b.max, vectors)
+    enables = np.random.random(vectors) < .9
+    clears = np.random.random(vectors) < .05
+
+    latency = mac_latency(a, b, 1024)
+    outputs = accumulator_bench(
+        vectors, [a, b], dout, latency,
+        list(zip(zip(a_values, b_values), enables, clears)),
+        MultiplyAccumulate, terms=1024)
+
+    products = [int(x) * int(y) for x, y in zip(a_values, b_values)]
+    assert outputs == accumulator_model(products, enables, clears, dout)
+
+
+def test_convert_multiply_accumulate():
+    clk, rst, ce, clr = create_signals(4)
+    a, b = create_signals(2, 18, signed=True)
+    dout = create_signals(1, 24, signed=True)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        MultiplyAccumulate(clk, rst, ce, clr, a, b, dout, terms=256,
+                           chunk=16, shift=20, rounding=ROUND_HALF_UP,
+                           saturate=True).convert(hdl='VHDL', path=tmp)
+        assert os.path.isfile(os.path.join(tmp, 'MultiplyAccumulate.vhd'))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+__author__ = 'michiel'
+
+import os
+import shutil
+import tempfile
+from fractions import Fraction
+
+import numpy as np
+from myhdl import block, instance, StopSimulation
+
+from fpga.basics.counter import FractionalClockEnable, fractional_increment, \
+    fractional_rate, fractional_jitter
+from fpga.utils import create_signals
+from fpga.tests.test_utils import generate_clock
+
+
+def fractional_enable_model(clocks, increment, bits, remainder=0,
+                            denominator=1):
+    """enable after every clock edge."""
+    acc, error, enables = 0, 0, []
+    for _ in range(clocks):
+        error += remainder
+        carry = error >= denominator
+        error -= denominator if carry else 0
+        acc += increment + carry
+        enables.append(acc >> bits)
+        acc %= 2 ** bits
+    return enables
+
+
+def peak_to_peak_jitter(enables, rate):
+    times = np.flatnonzero(enables)
+    errors = [t - Fraction(k) / rate for k, t in enumerate(times)]
+    return float(max(errors) - min(errors))
+
+
+def test_fractional_increment():
+    # All integer rates share the denominator of the clock
+    settings = [fractional_increment(f, 100000000) for f in
+                (44100, 64 * 44100, 128 * 44100, 48000, 128 * 96000)]
+    assert len(set(s[2] for s in settings)) == 1
+    for f, (increment, remainder, denominator) in zip(
+            (44100, 64 * 44100, 128 * 44100, 48000, 128 * 96000), settings):
+        assert fractional_rate(increment, 32, remainder, denominator) == \
+            Fraction(f, 100000000)
+
+    # Without shaping the rate is truncated
+    increment, remainder, denominator = fractional_increment(
+        44100, 100000000, shaping=False)
+    assert (remainder, denominator) == (0, 1)
+    assert fractional_rate(increment, 32) < Fraction(44100, 100000000)
+
+    # Integer divisions don't jitter
+    assert fractional_increment(1, 8, bits=8) == (32, 0, 1)
+    assert fractional_jitter(32, 8) == 0.
+
+
+def test_fractional_jitter():
+    for f_out, f_clk, bits in [(128 * 44100, 100000000, 16),
+                               (3, 7, 12), (1, 4, 10)]:
+        settings = fractional_increment(f_out, f_clk, bits)
+        enables = fractional_enable_model(20000, settings[0], bits,
+                                          *settings[1:])
+        rate = fractional_rate(settings[0], bits, *settings[1:])
+        assert sum(enables) in (int(20000 * rate), int(20000 * rate) + 1)
+        assert peak_to_peak_jitter(enables, rate) <= \
+            fractional_jitter(settings[0], bits, *settings[1:]) + 1e-9
+
+
+def test_fractional_clock_enable(clocks=4000):
+    bits = 16
+    rates = [fractional_increment(128 * 44100, 100000000, bits),
+             fractional_increment(128 * 48000, 100000000, bits),
+             fractional_increment(128 * 44100, 100000000, bits, shaping=False)]
+    denominator = rates[0][2]
+
+    for shaping in (True, False):
+        outputs = []
+
+        @block
+        def bench():
+            clk, rst, enable = create_signals(3)
+            increment = create_signals(1, bits)
+            remainder = create_signals(1, (0, denominator))
+
+            ce_gen = FractionalClockEnable(
+                clk, rst, increment, enable, remainder,
+                denominator if shaping else 1)
+            clock_gen = generate_clock(clk)
+
+            @instance
+            def stimulus():
+                # Change the rate at run-time
+                for settings in rates[:2] if shaping else rates[2:]:
+                    increment.next = settings[0]
+                    remainder.next = settings[1]
+                    rst.next = True
+                    yield clk.posedge
+                    rst.next = False
+                    for i in range(clocks):
+                        yield clk.posedge
+                        yield clk.negedge
+                        outputs.append(int(enable))
+                raise StopSimulation
+
+            return ce_gen, clock_gen, stimulus
+
+        bench().run_sim()
+        expected = []
+        for settings in rates[:2] if shaping else rates[2:]:
+            expected += fractional_enable_model(clocks, settings[0], bits,
+                                                *settings[1:])
+        assert outputs == expected, shaping
+
+
+def test_convert_fractional_clock_enable():
+    clk, rst, enable = create_signals(3)
+    increment = create_signals(1, 32)
+    remainder = create_signals(1, (0, 390625))
+
+    tmp = tempfile.mkdtemp()
+    try:
+        FractionalClockEnable(clk, rst, increment, enable, remainder,
+                              390625).convert(hdl='VHDL', path=tmp)
+        assert os.path.isfile(os.path.join(tmp, 'FractionalClockEnable.vhd'))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+__author__ = 'michiel'
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from myhdl import block, instance, StopSimulation
+
+from fpga.basics.fifo import SyncFifo, AsyncFifo
+from fpga.utils import create_signals
+from fpga.tests.test_utils import generate_clock
+
+
+def sync_fifo_model(pushes, pops, data, depth, almost_full_level,
+                    almost_empty_level):
+    """Flags (full, almost_full, empty, almost_empty) and dout as seen after
+    clock edge n of a SyncFifo without fwft."""
+    words, dout, outputs = [], 0, []
+    for push, pop, d in zip(pushes, pops, data):
+        full, empty = len(words) == depth, not words
+        if pop and not empty:
+            dout = words.pop(0)
+        if push and not full:
+            words.append(int(d))
+        outputs.append((len(words) == depth, len(words) >= almost_full_level,
+                        not words, len(words) <= almost_empty_level, dout))
+    return outputs
+
+
+def test_sync_fifo(vectors=3000, depth=16):
+    # Phases that fill and drain the FIFO
+    push_rates = np.repeat(np.random.choice([.2, .5, .9], vectors // 100), 100)
+    pushes = np.random.random(vectors) < push_rates
+    pops = np.random.random(vectors) < 1 - push_rates
+    data = np.random.randint(0, 2 ** 12, vectors)
+    outputs = []
+
+    @block
+    def bench():
+        clk, rst, we, re = create_signals(4)
+        full, almost_full, empty, almost_empty = create_signals(4)
+        din, dout = create_signals(2, 12)
+
+        fifo = SyncFifo(clk, rst, we, din, full, almost_full, re, dout, empty,
+                        almost_empty, depth=depth, almost_full_level=12,
+                        almost_empty_level=3)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors):
+                we.next = bool(pushes[i])
+                re.next = bool(pops[i])
+                din.next = int(data[i])
+                yield clk.posedge
+                yield clk.negedge
+                outputs.append((bool(full), bool(almost_full), bool(empty),
+                                bool(almost_empty), int(dout)))
+            raise StopSimulation
+
+        return fifo, clock_gen, stimulus
+
+    bench().run_sim()
+    expected = sync_fifo_model(pushes, pops, data, depth, 12, 3)
+    assert outputs == expected
+    # Both ends were reached
+    assert any(o[0] for o in outputs) and any(o[2] for o in outputs[100:])
+
+
+def fifo_transfer_bench(words, fwft, asynchronous, push_rate=.7, pop_rate=.5,
+                        depth=8):
+    """Push words through a FIFO at random, the words as read."""
+    data = list(np.random.randint(-2 ** 7, 2 ** 7, words))
+    received = []
+    flags = {'full': 0, 'empty': 0}
+
+    @block
+    def bench():
+        wclk, rclk, rst, we, re = create_signals(5)
+        full, almost_full, empty, almost_empty = create_signals(4)
+        din, dout = create_signals(2, 8, signed=True)
+
+        if asynchronous:
+            fifo = AsyncFifo(wclk, rst, we, din, full, almost_full, rclk, rst,
+                             re, dout, empty, almost_empty, depth=depth,
+                             fwft=fwft)
+            clocks = generate_clock(wclk, 10), generate_clock(rclk, 17)
+        else:
+            fifo = SyncFifo(wclk, rst, we, din, full, almost_full, re, dout,
+                            empty, almost_empty, depth=depth, fwft=fwft)
+            clocks = generate_clock(wclk), generate_clock(rclk)
+            rclk = wclk
+
+        @instance
+        def writer():
+            sent = 0
+            while True:
+                yield wclk.negedge
+                push = sent < words and np.random.random() < push_rate
+                we.next = push
+                if push:
+                    din.next = int(data[sent])
+                yield wclk.posedge
+                flags['full'] += bool(full)
+                if push and not full:
+                    sent += 1
+
+        @instance
+        def reader():
+            pending = False
+            while len(received) < words:
+                yield rclk.negedge
+                if pending:
+                    received.append(int(dout))
+                pop = np.random.random() < pop_rate
+                re.next = pop
+                yield rclk.posedge
+                flags['empty'] += bool(empty)
+                if fwft:
+                    pending = False
+                    if pop and not empty:
+                        received.append(int(dout))
+                else:
+                    pending = pop and not empty
+            raise StopSimulation
+
+        return fifo, clocks, writer, reader
+
+    bench().run_sim()
+    return data, received, flags
+
+
+def test_sync_fifo_fwft(words=1000):
+    for push_rate, pop_rate in [(.9, .3), (.3, .9)]:
+        data, received, flags = fifo_transfer_bench(words, True, False,
+                                                    push_rate, pop_rate)
+        assert received == data
+
+
+def test_async_fifo(words=1000):
+    for fwft in (False, True):
+        for push_rate, pop_rate in [(.9, .5), (.3, .9)]:
+            data, received, flags = fifo_transfer_bench(words, fwft, True,
+                                                        push_rate, pop_rate)
+            assert received == data, (fwft, push_rate)
+            if push_rate > pop_rate:
+                assert flags['full'] > 0
+            else:
+                assert flags['empty'] > 0
+
+
+def test_convert_fifos():
+    wclk, rclk, rst, we, re = create_signals(5)
+    full, almost_full, empty, almost_empty = create_signals(4)
+    din, dout = create_signals(2, 8, signed=True)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        SyncFifo(wclk, rst, we, din, full, almost_full, re, dout, empty,
+                 almost_empty, depth=32, fwft=True).convert(hdl='VHDL',
+                                                             path=tmp)
+        AsyncFifo(wclk, rst, we, din, full, almost_full, rclk, rst, re, dout,
+                  empty, almost_empty, depth=32).convert(hdl='VHDL', path=tmp)
+        with open(os.path.join(tmp, 'AsyncFifo.vhd')) as f:
+            vhdl = f.read()
+        assert os.path.isfile(os.path.join(tmp, 'SyncFifo.vhd'))
+    finally:
+        shutil.rmtree(tmp)
+
+    assert "type t_ram is array(0 to 32 - 1) of signed(8 - 1 downto 0);" in vhdl
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+__author__ = 'michiel'
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from myhdl import block, instance, StopSimulation
+
+from fpga.basics.gearbox import Gearbox
+from fpga.utils import create_signals
+from fpga.tests.test_utils import generate_clock
+
+
+def to_bits(words, bits, msb_first):
+    order = range(bits - 1, -1, -1) if msb_first else range(bits)
+    return [(int(word) >> i) & 1 for word in words for i in order]
+
+
+def gearbox_bench(in_bits, out_bits, words, msb_first=True, valid_rate=1.,
+                  ready_rate=1., signed=False):
+    """Random words through a Gearbox, the words as received and the number
+    of clocks it took."""
+    data = np.random.randint(0, 2 ** in_bits, words)
+    received = []
+    clocks = [0]
+
+    @block
+    def bench():
+        clk, rst, din_valid, din_ready, dout_valid, dout_ready = \
+            create_signals(6)
+        din = create_signals(1, in_bits)
+        dout = create_signals(1, out_bits, signed=signed)
+
+        gearbox = Gearbox(clk, rst, din, din_valid, din_ready, dout,
+                          dout_valid, dout_ready, MSB_FIRST=msb_first)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            sent = 0
+            while len(received) < words * in_bits // out_bits:
+                valid = sent < words and np.random.random() < valid_rate
+                din_valid.next = valid
+                if valid:
+                    din.next = int(data[sent])
+                ready = np.random.random() < ready_rate
+                dout_ready.next = ready
+                yield clk.posedge
+                clocks[0] += 1
+                if valid and din_ready:
+                    sent += 1
+                if ready and dout_valid:
+                    received.append(int(dout) % 2 ** out_bits)
+                yield clk.negedge
+            raise StopSimulation
+
+        return gearbox, clock_gen, stimulus
+
+    bench().run_sim()
+    return data, received, clocks[0]
+
+
+def test_gearbox(words=300):
+    for in_bits, out_bits in [(24, 8), (8, 24), (1, 32), (32, 1), (10, 16),
+                              (16, 10), (12, 12)]:
+        for msb_first in (True, False):
+            data, received, _ = gearbox_bench(in_bits, out_bits, words,
+                                              msb_first, .7, .6)
+            # The whole output words carry the input bits in stream order
+            sent_bits = to_bits(data, in_bits, msb_first)
+            received_bits = to_bits(received, out_bits, msb_first)
+            assert received_bits == sent_bits[:len(received_bits)], \
+                (in_bits, out_bits, msb_first)
+
+
+def test_gearbox_signed():
+    data, received, _ = gearbox_bench(24, 8, 100, signed=True)
+    assert to_bits(received, 8, True) == to_bits(data, 24, True)
+
+
+def test_gearbox_throughput(words=256):
+    # The narrow side moves a word every clock
+    for in_bits, out_bits in [(1, 32), (32, 1), (24, 8), (8, 24)]:
+        _, received, clocks = gearbox_bench(in_bits, out_bits, words)
+        assert clocks <= max(words, len(received)) + 2, \
+            (in_bits, out_bits, clocks)
+
+
+def test_convert_gearbox():
+    clk, rst, din_valid, din_ready, dout_valid, dout_ready = create_signals(6)
+    din = create_signals(1, 24)
+    dout = create_signals(1, 8, signed=True)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for msb_first in (True, False):
+            Gearbox(clk, rst, din, din_valid, din_ready, dout, dout_valid,
+                    dout_ready, msb_first).convert(hdl='VHDL', path=tmp)
+            assert os.path.isfile(os.path.join(tmp, 'Gearbox.vhd'))
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+__author__ = 'michiel'
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from myhdl import block, instance, StopSimulation
+
+from fpga.basics.multiplexers import MuxTree, mux2, mux3, mux_levels, \
+    mux_latency
+from fpga.utils import create_signals
+from fpga.tests.test_utils import generate_clock
+
+
+def mux_bench(selects, data, func, sel_bits, latency, clock=True, **kwargs):
+    """Run the selects and rows of data through the block
+    func([clk, ]inputs, sel, dout, **kwargs), dout lined up with selects."""
+    outputs = []
+
+    @block
+    def bench():
+        clk = create_signals(1)
+        inputs = create_signals(data.shape[1], 12, signed=True)
+        sel = create_signals(1, sel_bits)
+        dout = create_signals(1, 12, signed=True)
+
+        if clock:
+            mux = func(clk, inputs, sel, dout, **kwargs)
+        else:
+            mux = func(*(inputs + [dout, sel]), **kwargs)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(len(selects) + latency):
+                row = min(i, len(selects) - 1)
+                sel.next = int(selects[row])
+                for signal, value in zip(inputs, data[row]):
+                    signal.next = int(value)
+                yield clk.posedge
+                outputs.append(int(dout))
+            raise StopSimulation
+
+        return mux, clock_gen, stimulus
+
+    bench().run_sim()
+    return outputs[latency:latency + len(selects)]
+
+
+def test_mux_latency():
+    assert [mux_levels(n) for n in (2, 3, 4, 5, 32, 33, 64)] == \
+        [1, 2, 2, 3, 5, 6, 6]
+    assert mux_latency(64) == 0
+    assert mux_latency(64, 2) == 2
+    assert mux_latency(64, None) == 6
+
+
+def test_mux_tree(vectors=200):
+    for inputs in (2, 3, 5, 8, 32):
+        for stages in (0, 1, 2, None):
+            if stages is not None and stages > mux_levels(inputs):
+                continue
+            data = np.random.randint(-2 ** 11, 2 ** 11, (vectors, inputs))
+            selects = np.random.randint(0, inputs, vectors)
+            outputs = mux_bench(selects, data, MuxTree, mux_levels(inputs),
+                                mux_latency(inputs, stages), stages=stages)
+            assert outputs == list(data[range(vectors), selects]), \
+                (inputs, stages)
+
+
+def test_mux_tree_one_hot(vectors=200):
+    for inputs in (2, 3, 7, 16):
+        for stages in (0, 1, None):
+            data = np.random.randint(-2 ** 11, 2 ** 11, (vectors, inputs))
+            selects = np.random.randint(0, inputs, vectors)
+            # No bit set gives 0
+            selects[::10] = inputs
+            data = np.hstack([data, np.zeros((vectors, 1), int)])
+            outputs = mux_bench(2 ** selects % 2 ** inputs, data[:, :-1],
+                                MuxTree, inputs, mux_latency(inputs, stages),
+                                stages=stages, one_hot=True)
+            assert outputs == list(data[range(vectors), selects]), \
+                (inputs, stages)
+
+
+def test_mux2_mux3(vectors=100):
+    data = np.random.randint(-2 ** 11, 2 ** 11, (vectors, 3))
+    selects = np.random.randint(0, 2, vectors)
+    outputs = mux_bench(selects, data[:, :2], mux2, 1, 0, clock=False)
+    assert outputs == list(data[range(vectors), selects])
+
+    selects = np.random.randint(0, 3, vectors)
+    outputs = mux_bench(selects, data, mux3, 2, 0, clock=False)
+    assert outputs == list(data[range(vectors), selects])
+
+    selects = np.random.randint(0, 4, vectors)
+    outputs = mux_bench(selects, data, mux3, 2, 0, clock=False,
+                        zero_start=False)
+    expected = np.hstack([np.zeros((vectors, 1), int), data])
+    assert outputs == list(expected[range(vectors), selects])
+
+    # Wide selects: any non-zero value is b for mux2, past the end is c for
+    # mux3 and 0 without zero_start
+    selects = np.random.randint(0, 8, vectors)
+    outputs = mux_bench(selects, data[:, :2], mux2, 3, 0, clock=False)
+    assert outputs == list(data[range(vectors), np.minimum(selects, 1)])
+
+    outputs = mux_bench(selects, data, mux3, 3, 0, clock=False)
+    assert outputs == list(data[range(vectors), np.minimum(selects, 2)])
+
+    outputs = mux_bench(selects, data, mux3, 3, 0, clock=False,
+                        zero_start=False)
+    expected = np.hstack([np.zeros((vectors, 1), int), data])
+    assert outputs == list(expected[range(vectors),
+                                    np.where(selects <= 3, selects, 0)])
+
+
+@block
+def mux6(clk, a, b, c, d, e, f, sel, dout, stages, one_hot):
+    return MuxTree(clk, [a, b, c, d, e, f], sel, dout, stages, one_hot)
+
+
+def test_convert_mux_tree():
+    clk = create_signals(1)
+    inputs = create_signals(6, 16, signed=True)
+    dout = create_signals(1, 16, signed=True)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for sel, stages, one_hot in [(create_signals(1, 3), 2, False),
+                                     (create_signals(1, 6), None, True)]:
+            mux6(clk, *(inputs + [sel, dout, stages, one_hot])).convert(
+                hdl='VHDL', path=tmp)
+            with open(os.path.join(tmp, 'mux6.vhd')) as f:
+                vhdl = f.read()
+            # No priority chains, just 2:1 muxes
+            assert 'elsif' not in vhdl
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_convert_mux2_mux3():
+    a, b, c, dout = create_signals(4, 16, signed=True)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for mux, args in [(mux2, (a, b, dout, create_signals(1, 3))),
+                          (mux3, (a, b, c, dout, create_signals(1, 3))),
+                          (mux3, (a, b, c, dout, create_signals(1, 2),
+                                  False))]:
+            mux(*args).convert(hdl='VHDL', path=tmp)
+            with open(os.path.join(tmp, mux.__name__ + '.vhd')) as f:
+                vhdl = f.read()
+            # The select is a lookup, not a priority chain
+            assert 'elsif' not in vhdl
+    finally:
+        shutil.rmtree(tmp)
@@ -4,13 +4,17 @@ from __future__ import print_function
 
 __author__ = 'michiel'
 
+import re
 from random import randrange
 
-from myhdl import Signal, instance, intbv, bin, always
+import numpy as np
+from myhdl import Signal, block, instance, intbv, always, always_comb, StopSimulation
 
 import fpga.basics.multiplier as mult
 from fpga.utils import create_signals, create_clock_reset
-from fpga.tests.test_utils import clocker, run_sim
+from fpga.tests.test_utils import clocker, run_sim, generate_clock
+from fpga.tests.test_utils import mult35_model, pipeline_model, \
+    shared_mult35_model
 
 
 def switchable_multiplier(time_steps=20000, trace=False):
@@ -118,102 +122,380 @@ def switchable_multiplier(time_steps=20000, trace=False):
     run_sim(bench, time_steps, trace)
 
 
-def test_multiplier35bit(time_steps=20000, trace=False):
-    def bench():
-        ticks = 5
-        BITS = 35
-        MAX = 2 ** BITS // 2
-        MAXOUT = 2 ** (BITS * 2) // 2
+def test_addressable_multiplier(vectors=2000, karatsuba=False):
+    MAX = 2 ** 34
+    a_values = np.random.randint(-MAX, MAX, vectors)
+    b_values = np.random.randint(-MAX, MAX, vectors)
+    products, addresses = [], []
 
-        a, b = create_signals(2, BITS, signed=True)
-        pipeA, pipeB = [create_signals(ticks, BITS, signed=True) for _ in range(2)]
-        p = create_signals(1, 2 * BITS, signed=True)
+    @block
+    def bench():
+        a, b = create_signals(2, 35, signed=True)
+        p = create_signals(1, 2 * 35, signed=True)
+        address_in, address_out = create_signals(2, 3, mod=True)
         clk, rst = create_signals(2)
+        ce = Signal(True)
 
-        mult_inst = mult.Multiplier35Bit(a, b, p, clk, rst)
-
-        clock_gen = clocker(clk)
+        mult_inst = mult.AddressableMultiplier35Bit(clk, ce, rst, a, b, p,
+                                                    address_in, address_out,
+                                                    karatsuba)
+        clock_gen = generate_clock(clk)
 
         @instance
         def stimulus():
-            iA, iB, pA, pB = 0, 0, 1, 1
-            yield clk.negedge
-            rst.next = False
-
-            while True:
+            for i in range(vectors):
                 yield clk.negedge
-                a.next = randrange(-MAX, MAX)
-                b.next = randrange(-MAX, MAX)
-                pipeA[iA].next = a
-                pipeB[iB].next = b
-                iA = (iA + 1) % ticks
-                iB = (iB + 1) % ticks
-
-                if (p != pipeA[pA] * pipeB[pB]):
-                    f_a = float(a)
-                    f_b = float(b)
-                    f_p = float(p)
-                    f_pipeA = float(pipeA[pA])
-                    f_pipeB = float(pipeB[pB])
-                    print("{:5.4f}x{:5.4f} = {:5.4f}".format(
-                        f_a/float(MAX), f_b/float(MAX),
-                        (f_pipeA * f_pipeB)/float(MAXOUT)) +
-                        " but got {:5.4f}, error: {:5.4f}".format(
-                            f_p/float(MAXOUT),
-                            (f_pipeA * f_pipeB - f_p)/float(MAXOUT)))
-                assert p == pipeA[iA] * pipeB[iB], \
-                    "Difference: p - a * b = {}".format(
-                        bin(p - pipeA[iA] * pipeB[pB], 2 * BITS))
-
-                pA = (pA + 1) % ticks
-                pB = (pB + 1) % ticks
+                products.append(int(p))
+                addresses.append(int(address_out))
+                a.next = int(a_values[i])
+                b.next = int(b_values[i])
+                address_in.next = i % 8
+
+            raise StopSimulation
 
         return mult_inst, clock_gen, stimulus
 
-    run_sim(bench, time_steps, trace)
+    bench().run_sim()
 
+    # The address travels along with its product
+    assert products == list(pipeline_model(mult35_model(a_values, b_values)))
+    assert addresses == list(pipeline_model(np.arange(vectors) % 8))
 
-def test_addressable_multiplier(time_steps=20000, trace=False):
-    def bench():
-        BITS = 35
-        MAX = 2 ** BITS // 2
 
-        a, b = create_signals(2, BITS, signed=True)
-        p = create_signals(1, 2 * BITS, signed=True)
-        clk, rst = create_clock_reset()
-        address_in, address_out = create_signals(2, 3, mod=True)
-        pipeline = {i: (0, 0, 0, 0) for i in range(len(address_in))}  # Check pipeline
+def test_addressable_karatsuba_multiplier(vectors=2000):
+    test_addressable_multiplier(vectors, karatsuba=True)
 
-        mult_inst = mult.AddressableMultiplier35Bit(a, b, p, address_in, address_out, clk, rst)
 
-        clock_gen = clocker(clk)
+def test_multiplier35bit_model():
+    MAX = 2 ** 34
+    a = [randrange(-MAX, MAX) for _ in range(1000)] + [-MAX, -MAX, MAX - 1]
+    b = [randrange(-MAX, MAX) for _ in range(1000)] + [-MAX, MAX - 1, MAX - 1]
+
+    assert list(mult35_model(a, b)) == [x * y for x, y in zip(a, b)]
+
+
+def test_multiplier35bit(vectors=2000, multiplier=mult.Multiplier35Bit):
+    MAX = 2 ** 34
+    # Random values and the corners
+    a_values = np.append(np.random.randint(-MAX, MAX, vectors),
+                         [-MAX, -MAX, MAX - 1, MAX - 1, 0])
+    b_values = np.append(np.random.randint(-MAX, MAX, vectors),
+                         [-MAX, MAX - 1, -MAX, MAX - 1, -MAX])
+    vectors = len(a_values)
+    products = []
+
+    @block
+    def bench():
+        a, b = create_signals(2, 35, signed=True)
+        p = create_signals(1, 2 * 35, signed=True)
+        clk, rst = create_signals(2)
+
+        mult_inst = multiplier(clk, rst, a, b, p)
+        clock_gen = generate_clock(clk)
 
         @instance
         def stimulus():
-            yield clk.negedge
-            rst.next = False
+            for i in range(vectors):
+                yield clk.negedge
+                products.append(int(p))
+                a.next = int(a_values[i])
+                b.next = int(b_values[i])
 
-            while True:
+            raise StopSimulation
+
+        return mult_inst, clock_gen, stimulus
+
+    bench().run_sim()
+
+    expected = pipeline_model(mult35_model(a_values, b_values))
+    assert products == list(expected)
+
+
+def test_karatsuba_multiplier35bit(vectors=2000):
+    test_multiplier35bit(vectors, mult.KaratsubaMultiplier35Bit)
+
+
+def test_convert_karatsuba_multiplier35bit():
+    import os
+    import shutil
+    import tempfile
+
+    a, b = create_signals(2, 35, signed=True)
+    p = create_signals(1, 2 * 35, signed=True)
+    clk, rst = create_signals(2)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        mult.KaratsubaMultiplier35Bit(clk, rst, a, b, p).convert(hdl='VHDL',
+                                                                 path=tmp)
+        with open(os.path.join(tmp, 'KaratsubaMultiplier35Bit.vhd')) as f:
+            vhdl = f.read()
+    finally:
+        shutil.rmtree(tmp)
+
+    # Three signal by signal products, the docstring and shifts don't count
+    code = [l for l in vhdl.splitlines() if not l.lstrip().startswith('--')]
+    assert len(re.findall(r'[a-z_]\w* \* [a-z_]', '\n'.join(code))) == 3
+
+
+def test_shared_multiplier(vectors=2000, karatsuba=False):
+    PORTS = 3
+    MAX = 2 ** 34
+    a_values = np.random.randint(-MAX, MAX, (PORTS, vectors))
+    b_values = np.random.randint(-MAX, MAX, (PORTS, vectors))
+    load_values = np.random.randint(0, PORTS + 1, vectors)
+    products, readies = [], []
+
+    @block
+    def bench():
+        a_signals = create_signals(PORTS, 35, signed=True)
+        b_signals = create_signals(PORTS, 35, signed=True)
+        load = create_signals(1, (0, PORTS + 1))
+        p_signals = create_signals(PORTS, 2 * 35, signed=True)
+        p_rdys = create_signals(PORTS)
+        clk, rst = create_signals(2)
+        ce = Signal(True)
+
+        mult_inst = mult.SharedMultiplier(clk, ce, rst, a_signals, b_signals,
+                                          load, p_signals, p_rdys, karatsuba)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors):
                 yield clk.negedge
-                a.next = randrange(-MAX, MAX)
-                b.next = randrange(-MAX, MAX)
-                address_in.next = address_in + 1
+                products.append([int(p) for p in p_signals])
+                readies.append([bool(r) for r in p_rdys])
+                load.next = int(load_values[i])
+                for j in range(PORTS):
+                    a_signals[j].next = int(a_values[j, i])
+                    b_signals[j].next = int(b_values[j, i])
+
+            raise StopSimulation
+
+        return mult_inst, clock_gen, stimulus
+
+    bench().run_sim()
+
+    p, rdy = shared_mult35_model(a_values, b_values, load_values)
+    assert products == p.T.tolist()
+    assert readies == rdy.T.tolist()
+
+
+def test_shared_karatsuba_multiplier(vectors=2000):
+    test_shared_multiplier(vectors, karatsuba=True)
+
 
-                check_address, check_a, check_b, check_p = pipeline[int(address_out)]
 
-                # print('-' * 20)
-                # print(address_out, address_in)
-                # print('-' * 20)
-                # print(pipeline)
-                # print('-' * 20)
-                assert check_address == address_out and check_p == p
+def pipelined_multiplier_bulk(a_bits, b_bits, signed=(True, True),
+                              dsp=mult.DSP_25X18, latency=None, vectors=500):
+    def operand(bits, is_signed):
+        if is_signed:
+            return np.random.randint(-2 ** (bits - 1), 2 ** (bits - 1), vectors)
+        return np.random.randint(0, 2 ** bits, vectors)
 
-                pipeline[int(address_in)] = int(address_in), int(a), int(b), int(a * b)
+    a_values = operand(a_bits, signed[0]).astype(object)
+    b_values = operand(b_bits, signed[1]).astype(object)
+    products = []
+    a, b = create_signals(1, a_bits, signed=signed[0]), \
+        create_signals(1, b_bits, signed=signed[1])
+    LATENCY = mult.multiplier_latency(a, b, dsp, latency)
+
+    @block
+    def bench():
+        p = create_signals(1, a_bits + b_bits, signed=any(signed))
+        clk, rst = create_signals(2)
+
+        mult_inst = mult.PipelinedMultiplier(clk, rst, a, b, p, dsp, latency)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors):
+                yield clk.negedge
+                products.append(int(p))
+                a.next = int(a_values[i])
+                b.next = int(b_values[i])
+
+            raise StopSimulation
 
         return mult_inst, clock_gen, stimulus
 
-    run_sim(bench, time_steps, trace)
+    bench().run_sim()
+
+    assert products == list(pipeline_model(a_values * b_values, LATENCY))
+    return LATENCY
+
+
+def test_pipelined_multiplier():
+    # Fits a single DSP
+    assert pipelined_multiplier_bulk(24, 18) == 3
+    # 48 bits over three 18 bit ports, 25 bits on the 25 bit port
+    assert pipelined_multiplier_bulk(48, 25) == 5
+    assert pipelined_multiplier_bulk(25, 48) == 5
+    # Same tiling and latency as Multiplier35Bit
+    assert pipelined_multiplier_bulk(35, 35, dsp=mult.DSP_18X18) == 5
+    assert pipelined_multiplier_bulk(17, 18, (False, True),
+                                     dsp=mult.DSP_18X18) == 3
+    # 34 bits over two 18 bit ports beats 20 bits over two 18 bit ports
+    assert pipelined_multiplier_bulk(34, 20, (False, False),
+                                     dsp=mult.DSP_27X18) == 4
+    assert pipelined_multiplier_bulk(27, 18, dsp=mult.DSP_27X18) == 3
+
+
+def test_pipelined_multiplier_latency():
+    # Merged adder levels and extra output registers
+    assert pipelined_multiplier_bulk(48, 48, latency=4) == 4
+    assert pipelined_multiplier_bulk(48, 48, latency=5) == 5
+    assert pipelined_multiplier_bulk(48, 48, latency=9) == 9
+    assert pipelined_multiplier_bulk(24, 18, latency=4) == 4
+
+    a, b = create_signals(2, 48, signed=True)
+    assert mult.multiplier_latency(a, b) == 6
+    try:
+        mult.multiplier_latency(a, b, latency=3)
+    except AssertionError:
+        pass
+    else:
+        assert False, "The adder tree needs at least one clock"
+
+
+def test_convert_pipelined_multiplier():
+    import os
+    import shutil
+    import tempfile
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for a_bits, b_bits in [(24, 18), (48, 25)]:
+            a = create_signals(1, a_bits, signed=True)
+            b = create_signals(1, b_bits, signed=True)
+            p = create_signals(1, a_bits + b_bits, signed=True)
+            clk, rst = create_signals(2)
+            name = 'mult{}x{}'.format(a_bits, b_bits)
+            mult.PipelinedMultiplier(clk, rst, a, b, p).convert(
+                hdl='VHDL', path=tmp, name=name)
+            assert os.path.isfile(os.path.join(tmp, name + '.vhd'))
+    finally:
+        shutil.rmtree(tmp)
+
+
+def arbitrated_multiplier_bench(clients, vectors, round_robin=True,
+                                load=0.7):
+    """Every client multiplies its own list of operands, requesting with
+    probability load whenever it has operands left."""
+    MAX = 2 ** 23
+    a_values = np.random.randint(-MAX, MAX, (clients, vectors)).astype(object)
+    b_values = np.random.randint(-2 ** 17, 2 ** 17, (clients, vectors)).astype(object)
+    want = np.random.random((clients, 2 * clients * vectors)) < load
+    issued, results = [], []
+    a_sigs = create_signals(clients, 24, signed=True)
+    b_sigs = create_signals(clients, 18, signed=True)
+    LATENCY = mult.multiplier_latency(a_sigs[0], b_sigs[0]) + 2
+
+    @block
+    def bench():
+        requests, grants, p_rdys = create_signals(3, clients)
+        p = create_signals(1, 42, signed=True)
+        p_tag = create_signals(1, (0, clients))
+        clk, rst = create_signals(2)
+
+        mult_inst = mult.ArbitratedMultiplier(clk, rst, requests, grants,
+                                              a_sigs, b_sigs, p, p_tag,
+                                              p_rdys, round_robin)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            index = [0] * clients
+            clock = 0
+            while len(results) < clients * vectors:
+                yield clk.negedge
+                for i in range(clients):
+                    if grants[i]:
+                        issued.append((clock - 1, i))
+                        index[i] += 1
+                for i in range(clients):
+                    if int(p_rdys) & (1 << i):
+                        assert int(p_rdys) == 1 << int(p_tag)
+                        results.append((clock, i, int(p)))
+
+                request = 0
+                for i in range(clients):
+                    if index[i] < vectors and want[i, clock]:
+                        a_sigs[i].next = int(a_values[i, index[i]])
+                        b_sigs[i].next = int(b_values[i, index[i]])
+                        request |= 1 << i
+                requests.next = request
+                clock += 1
+
+            raise StopSimulation
+
+        return mult_inst, clock_gen, stimulus
 
+    bench().run_sim()
+
+    # Results in issue order, every product LATENCY clocks after its grant
+    assert [(c + LATENCY, i) for c, i in issued] == \
+        [(c, i) for c, i, _ in results]
+    for i in range(clients):
+        assert [p for _, client, p in results if client == i] == \
+            list(a_values[i] * b_values[i])
+    return [i for _, i in issued]
+
+
+def test_arbitrated_multiplier():
+    # Full rate: one product per clock when all clients keep requesting
+    order = arbitrated_multiplier_bench(3, 100, load=1.)
+    assert order[:9] == [0, 1, 2] * 3
+    assert arbitrated_multiplier_bench(5, 200)[:1] != []
+    # More clients than a 3 bit tag can address
+    arbitrated_multiplier_bench(12, 40, load=0.3)
+
+    order = arbitrated_multiplier_bench(3, 50, round_robin=False, load=1.)
+    assert order[:50] == [0] * 50
+
+
+def test_convert_arbitrated_multiplier():
+    import os
+    import shutil
+    import tempfile
+
+    @block
+    def ArbitratedMultiplier3(clk, rst, requests, grants, a0, a1, a2, b0, b1,
+                              b2, p, p_tag, p_rdys):
+        # Top level ports can't be in a list
+        a_signals = create_signals(3, 24, signed=True)
+        b_signals = create_signals(3, 18, signed=True)
+
+        @always_comb
+        def operands():
+            a_signals[0].next = a0
+            a_signals[1].next = a1
+            a_signals[2].next = a2
+            b_signals[0].next = b0
+            b_signals[1].next = b1
+            b_signals[2].next = b2
+
+        arbiter = mult.ArbitratedMultiplier(clk, rst, requests, grants,
+                                            a_signals, b_signals, p, p_tag,
+                                            p_rdys)
+        return operands, arbiter
+
+    a = create_signals(3, 24, signed=True)
+    b = create_signals(3, 18, signed=True)
+    requests, grants, p_rdys = create_signals(3, 3)
+    p = create_signals(1, 42, signed=True)
+    p_tag = create_signals(1, (0, 3))
+    clk, rst = create_signals(2)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        ArbitratedMultiplier3(clk, rst, requests, grants, *(a + b + [
+            p, p_tag, p_rdys])).convert(hdl='VHDL', path=tmp)
+        assert os.path.isfile(os.path.join(tmp, 'ArbitratedMultiplier3.vhd'))
+    finally:
+        shutil.rmtree(tmp)
 
 if __name__ == '__main__':
     # test_multiplier35bit()
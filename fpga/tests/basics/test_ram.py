@@ -0,0 +1,587 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+__author__ = 'michiel'
+
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from myhdl import block, instance, delay, StopSimulation
+
+from fpga.basics.ram import OnePortRam, SimpleTwoPortRam, TrueTwoPortRam, \
+    ShiftRegister, ram_init, shift_register_style, READ_FIRST, WRITE_FIRST, \
+    NO_CHANGE
+from fpga.utils import create_signals
+from fpga.tests.test_utils import generate_clock
+
+
+def ram_model(addresses, writes, data, contents):
+    """Read first single port RAM, dout[n] as seen after clock edge n."""
+    contents = np.array(contents, dtype=object)
+    dout = []
+    for a, w, d in zip(addresses, writes, data):
+        dout.append(int(contents[a]))
+        if w:
+            contents[a] = d
+    return dout
+
+
+def write_model(old, new, enables, bits=16, nr_bytes=2):
+    """Word after writing the enabled bytes of new over old."""
+    mask = 2 ** bits - 1
+    word = old & mask
+    for i in range(nr_bytes):
+        if enables >> i & 1:
+            byte = (2 ** (bits // nr_bytes) - 1) << (i * bits // nr_bytes)
+            word = word & ~byte | new & byte
+    return word - 2 ** bits if word >> (bits - 1) else word
+
+
+def two_port_ram_model(ports, contents, modes):
+    """Single clock model of the two port RAMs, dout[n] as seen after clock
+    edge n. Every port is a tuple of (addresses, enables, data, resets), the
+    ports write in order. A port reads the word from before the clock, in
+    WRITE_FIRST mode the word after the writes of the clock."""
+    contents = list(contents)
+    outputs = [[0] * len(ports[0][0]) for _ in ports]
+    for n in range(len(ports[0][0])):
+        old = list(contents)
+        for port in ports:
+            addr, enables, data, rst = [int(values[n]) for values in port]
+            if enables:
+                contents[addr] = write_model(contents[addr], data, enables)
+        for port, mode, dout in zip(ports, modes, outputs):
+            addr, enables, data, rst = [int(values[n]) for values in port]
+            word = contents[addr] if mode == WRITE_FIRST else old[addr]
+            if mode == NO_CHANGE and enables:
+                dout[n] = dout[n - 1] if n else 0
+            else:
+                dout[n] = 0 if rst else word
+    return outputs
+
+
+def ram_bench(vectors, addr_bits=6, bits=8, signed=True, init_vals=None,
+              async_read=False, rst_values=None):
+    low, high = (-2 ** (bits - 1), 2 ** (bits - 1)) if signed else (0, 2 ** bits)
+    addresses = np.random.randint(0, 2 ** addr_bits, vectors)
+    writes = np.random.randint(0, 2, vectors)
+    data = np.random.randint(low, high, vectors)
+    rst_values = np.zeros(vectors, dtype=int) if rst_values is None else rst_values
+    outputs = []
+
+    @block
+    def bench():
+        clk, we, rst = create_signals(3)
+        addr = create_signals(1, addr_bits)
+        din, dout = create_signals(2, bits, signed=signed)
+
+        ram = OnePortRam(clk, we, addr, din, dout, reset=rst,
+                         init_vals=init_vals, async_read=async_read)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors):
+                addr.next = int(addresses[i])
+                we.next = bool(writes[i])
+                din.next = int(data[i])
+                rst.next = bool(rst_values[i])
+                yield clk.posedge
+                yield clk.negedge
+                outputs.append(int(dout))
+
+            raise StopSimulation
+
+        return ram, clock_gen, stimulus
+
+    bench().run_sim()
+    return addresses, writes, data, outputs
+
+
+def test_one_port_ram(vectors=2000):
+    addresses, writes, data, outputs = ram_bench(vectors)
+    assert outputs == ram_model(addresses, writes, data,
+                                np.zeros(2 ** 6, dtype=int))
+
+
+def test_one_port_ram_reset(vectors=2000):
+    rst_values = np.random.randint(0, 2, vectors)
+    addresses, writes, data, outputs = ram_bench(vectors, signed=False,
+                                                 rst_values=rst_values)
+    expected = ram_model(addresses, writes, data, np.zeros(2 ** 6, dtype=int))
+    # Only the output register resets, the contents stay
+    assert outputs == [0 if r else e for r, e in zip(rst_values, expected)]
+
+
+def test_one_port_ram_async_read(vectors=2000):
+    init = np.random.randint(-128, 128, 2 ** 6)
+    addresses, writes, data, outputs = ram_bench(vectors, init_vals=init,
+                                                 async_read=True)
+    # The output shows the word after the write
+    expected = ram_model(addresses, writes, data, init)
+    assert outputs == [d if w else e for w, d, e in
+                       zip(writes, data, expected)]
+
+
+def test_one_port_ram_async_read_init():
+    # The initial word shows before the address or a clock changes
+    init = np.random.randint(-128, 128, 2 ** 4)
+    outputs = []
+
+    @block
+    def bench():
+        clk, we = create_signals(2)
+        addr = create_signals(1, 4)
+        din, dout = create_signals(2, 8, signed=True)
+        ram = OnePortRam(clk, we, addr, din, dout, init_vals=init,
+                         async_read=True)
+
+        @instance
+        def stimulus():
+            # Past the delay of the signals
+            yield delay(3)
+            outputs.append(int(dout))
+            raise StopSimulation
+
+        return ram, stimulus
+
+    bench().run_sim()
+    assert outputs == [init[0]]
+
+
+def test_one_port_ram_bit(vectors=1000):
+    init = np.random.randint(0, 2, 2 ** 6)
+    rst_values = np.random.randint(0, 2, vectors)
+    addresses, writes, data, outputs = ram_bench(vectors, bits=1,
+                                                 signed=False, init_vals=init,
+                                                 rst_values=rst_values)
+    expected = ram_model(addresses, writes, data, init)
+    assert outputs == [0 if r else e for r, e in zip(rst_values, expected)]
+
+
+def test_ram_init():
+    example = create_signals(1, 8, signed=True)
+    tmp = tempfile.mkdtemp()
+    try:
+        hex_file = os.path.join(tmp, 'init.hex')
+        with open(hex_file, 'w') as f:
+            f.write("01\n7f // maximum\n\nff\n80\n")
+        assert list(ram_init(hex_file, 8, example)) == \
+            [1, 127, -1, -128, 0, 0, 0, 0]
+
+        npy_file = os.path.join(tmp, 'init.npy')
+        np.save(npy_file, np.arange(-4, 4))
+        assert list(ram_init(npy_file, 8, example)) == list(range(-4, 4))
+    finally:
+        shutil.rmtree(tmp)
+
+    assert list(ram_init([3, -3], 4, example)) == [3, -3, 0, 0]
+    wide = create_signals(1, 70)
+    assert ram_init([2 ** 69], 2, wide)[0] == 2 ** 69
+    try:
+        ram_init([128], 4, example)
+    except AssertionError:
+        pass
+    else:
+        assert False, "Values out of range should fail"
+
+
+def test_large_ram():
+    clk, we = create_signals(2)
+    addr = create_signals(1, 16)
+    din, dout = create_signals(2, 18)
+
+    ram = OnePortRam(clk, we, addr, din, dout,
+                     init_vals=np.arange(2 ** 16) % 1024)
+    # The 64K words are no Signals
+    assert not ram.memdict
+    ports = [clk, we, addr, din, dout]
+    assert all(any(signal is port for port in ports)
+               for signal in ram.sigdict.values())
+
+
+def test_convert_one_port_ram():
+    clk, we = create_signals(2)
+    addr = create_signals(1, 4)
+    din, dout = create_signals(2, 8, signed=True)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        OnePortRam(clk, we, addr, din, dout, init_vals=[1, 2]).convert(
+            hdl='VHDL', path=tmp)
+        with open(os.path.join(tmp, 'OnePortRam.vhd')) as f:
+            vhdl = f.read()
+    finally:
+        shutil.rmtree(tmp)
+
+    assert "type t_ram is array(0 to 16 - 1) of signed(8 - 1 downto 0);" in vhdl
+    assert '"00000001",\n        "00000010",\n        "00000000"' in vhdl
+    assert "dout_num <= ram(to_integer(addr_num));" in vhdl
+
+    # A RAM of bits
+    din, dout, rst = create_signals(3)
+    tmp = tempfile.mkdtemp()
+    try:
+        OnePortRam(clk, we, addr, din, dout, reset=rst,
+                   init_vals=[1, 0, 1]).convert(hdl='VHDL', path=tmp)
+        with open(os.path.join(tmp, 'OnePortRam.vhd')) as f:
+            vhdl = f.read()
+    finally:
+        shutil.rmtree(tmp)
+
+    assert "type t_ram is array(0 to 16 - 1) of std_logic;" in vhdl
+    assert "'1',\n        '0',\n        '1'" in vhdl
+    assert "dout <= '0';" in vhdl
+
+
+def two_port_ram_bench(vectors, mode, true_dual_port=False, collisions=.2):
+    """Random reads and byte enabled writes of 16 bit signed words, in a
+    fraction collisions of the clocks both ports use the same address. The
+    true dual port RAM then only writes with port a and only when that is
+    defined, in READ_FIRST mode."""
+    modes = (mode, mode) if isinstance(mode, str) else mode
+    init = np.random.randint(-2 ** 15, 2 ** 15, 2 ** 6)
+    addresses = np.random.randint(0, 2 ** 6, (2, vectors))
+    # Port b avoids the address of port a, except in the collisions
+    addresses[1] = (addresses[0] + np.random.randint(1, 2 ** 6, vectors)) % 2 ** 6
+    same = np.random.random(vectors) < collisions
+    addresses[1, same] = addresses[0, same]
+    enables = np.random.randint(0, 4, (2, vectors))
+    data = np.random.randint(-2 ** 15, 2 ** 15, (2, vectors))
+    resets = np.random.randint(0, 10, (2, vectors)) == 0
+    if true_dual_port:
+        enables[1, same] = 0
+        if modes[0] != READ_FIRST:
+            enables[0, same] = 0
+    else:
+        # A write port and a read port
+        enables[1] = 0
+        resets[0] = resets[1]
+    outputs = [[], []]
+
+    @block
+    def bench():
+        clk, rst = create_signals(2)
+        wea, web = create_signals(2, 2)
+        addra, addrb = create_signals(2, 6)
+        dina, douta, dinb, doutb = create_signals(4, 16, signed=True)
+
+        if true_dual_port:
+            ram = TrueTwoPortRam(clk, wea, addra, dina, douta,
+                                 clk, web, addrb, dinb, doutb, reset=rst,
+                                 init_vals=init, mode=mode)
+        else:
+            ram = SimpleTwoPortRam(clk, wea, addra, dina, clk, addrb, doutb,
+                                   reset=rst, init_vals=init, mode=mode)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors):
+                wea.next, web.next = [int(e) for e in enables[:, i]]
+                addra.next, addrb.next = [int(a) for a in addresses[:, i]]
+                dina.next, dinb.next = [int(d) for d in data[:, i]]
+                # One reset for both ports, port a resets with port b
+                rst.next = bool(resets[1, i])
+                yield clk.posedge
+                yield clk.negedge
+                outputs[0].append(int(douta))
+                outputs[1].append(int(doutb))
+
+            raise StopSimulation
+
+        return ram, clock_gen, stimulus
+
+    bench().run_sim()
+    resets[0] = resets[1]
+    expected = two_port_ram_model(
+        [(addresses[i], enables[i], data[i], resets[i]) for i in range(2)],
+        init, modes)
+    return outputs, expected
+
+
+def test_simple_two_port_ram(vectors=2000):
+    for mode in (READ_FIRST, WRITE_FIRST):
+        # Reading the address that is written gives the old or the new word
+        outputs, expected = two_port_ram_bench(vectors, mode)
+        assert outputs[1] == expected[1], mode
+
+
+def test_simple_two_port_ram_write_first(vectors=500):
+    # Reading the address that is written shows the new word
+    clk, we = create_signals(2)
+    addr = create_signals(1, 4)
+    din, dout = create_signals(2, 8)
+    outputs = []
+
+    @block
+    def bench():
+        ram = SimpleTwoPortRam(clk, we, addr, din, clk, addr, dout,
+                               mode=WRITE_FIRST)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors):
+                addr.next = i % 16
+                we.next = i % 3 == 0
+                din.next = i % 256
+                yield clk.posedge
+                yield clk.negedge
+                outputs.append(int(dout))
+            raise StopSimulation
+
+        return ram, clock_gen, stimulus
+
+    bench().run_sim()
+    contents = [0] * 16
+    for i, out in enumerate(outputs):
+        if i % 3 == 0:
+            contents[i % 16] = i % 256
+        assert out == contents[i % 16]
+
+
+def test_simple_two_port_ram_clocks():
+    # Write with one clock, read back with an unrelated slower one
+    init = np.random.randint(0, 256, 32)
+    values = np.random.randint(0, 256, 32)
+    outputs = []
+
+    @block
+    def bench():
+        wclk, rclk, we = create_signals(3)
+        waddr, raddr = create_signals(2, 5)
+        din, dout = create_signals(2, 8)
+
+        ram = SimpleTwoPortRam(wclk, we, waddr, din, rclk, raddr, dout,
+                               init_vals=init)
+        wclock_gen = generate_clock(wclk, 10)
+        rclock_gen = generate_clock(rclk, 17)
+
+        @instance
+        def write():
+            yield rclk.negedge
+            for i in range(16):
+                waddr.next = i
+                din.next = int(values[i])
+                we.next = True
+                yield wclk.posedge
+            we.next = False
+
+        @instance
+        def read():
+            # The first half is written by now
+            for i in range(3):
+                yield rclk.posedge
+            for i in range(32):
+                raddr.next = i
+                yield rclk.posedge
+                yield rclk.negedge
+                outputs.append(int(dout))
+            raise StopSimulation
+
+        return ram, wclock_gen, rclock_gen, write, read
+
+    bench().run_sim()
+    assert outputs == list(values[:16]) + list(init[16:])
+
+
+def test_true_two_port_ram(vectors=2000):
+    for mode in (READ_FIRST, WRITE_FIRST, NO_CHANGE, (NO_CHANGE, WRITE_FIRST)):
+        outputs, expected = two_port_ram_bench(vectors, mode,
+                                               true_dual_port=True)
+        assert outputs == expected, mode
+
+
+def test_two_port_ram_bits(vectors=500):
+    init = np.random.randint(0, 2, 16)
+    addresses = np.random.randint(0, 16, (2, vectors))
+    writes = np.random.randint(0, 2, vectors)
+    data = np.random.randint(0, 2, vectors)
+    outputs = [[], []]
+
+    @block
+    def bench():
+        clk, we, no_write, din, douta, doutb, rst = create_signals(7)
+        addra, addrb = create_signals(2, 4)
+
+        simple = SimpleTwoPortRam(clk, we, addra, din, clk, addrb, douta,
+                                  reset=rst, init_vals=init)
+        true = TrueTwoPortRam(clk, we, addra, din, create_signals(1), clk,
+                              no_write, addrb, din, doutb, reset=rst,
+                              init_vals=init)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors):
+                addra.next, addrb.next = [int(a) for a in addresses[:, i]]
+                we.next = bool(writes[i])
+                din.next = bool(data[i])
+                yield clk.posedge
+                yield clk.negedge
+                outputs[0].append(int(douta))
+                outputs[1].append(int(doutb))
+            raise StopSimulation
+
+        return simple, true, clock_gen, stimulus
+
+    bench().run_sim()
+    expected = two_port_ram_model(
+        [(addresses[0], writes, data, np.zeros(vectors)),
+         (addresses[1], np.zeros(vectors), data, np.zeros(vectors))],
+        init, (READ_FIRST, READ_FIRST))[1]
+    assert outputs[0] == expected and outputs[1] == expected
+
+    clk, we, din, douta, doutb = create_signals(5)
+    addra, addrb = create_signals(2, 4)
+    tmp = tempfile.mkdtemp()
+    try:
+        TrueTwoPortRam(clk, we, addra, din, douta, clk, we, addrb, din, doutb,
+                       reset=create_signals(1)).convert(hdl='VHDL', path=tmp)
+        with open(os.path.join(tmp, 'TrueTwoPortRam.vhd')) as f:
+            vhdl = f.read()
+    finally:
+        shutil.rmtree(tmp)
+    assert "type t_ram is array(0 to 16 - 1) of std_logic;" in vhdl
+    assert "douta <= '0';" in vhdl
+
+
+def test_convert_two_port_rams():
+    clk, rclk = create_signals(2)
+    we = create_signals(1, 4)
+    wea, web = create_signals(2)
+    addra, addrb = create_signals(2, 4)
+    dina, douta, dinb, doutb = create_signals(4, 32, signed=True)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        SimpleTwoPortRam(clk, we, addra, dina, rclk, addrb, doutb).convert(
+            hdl='VHDL', path=tmp)
+        SimpleTwoPortRam(clk, wea, addra, dina, clk, addrb, doutb,
+                         mode=WRITE_FIRST).convert(hdl='VHDL', path=tmp,
+                                                   name='WriteFirstRam')
+        TrueTwoPortRam(clk, wea, addra, dina, douta, rclk, we, addrb, dinb,
+                       doutb, mode=(READ_FIRST, NO_CHANGE)).convert(
+            hdl='VHDL', path=tmp)
+        vhdl = {}
+        for name in ('SimpleTwoPortRam', 'WriteFirstRam', 'TrueTwoPortRam'):
+            with open(os.path.join(tmp, name + '.vhd')) as f:
+                vhdl[name] = f.read()
+    finally:
+        shutil.rmtree(tmp)
+
+    assert "signal ram: t_ram" in vhdl['SimpleTwoPortRam']
+    assert "process (rclk)" in vhdl['SimpleTwoPortRam']
+    assert "ram(to_integer(waddr_num))((i + 1) * 8 - 1 downto i * 8) <= " \
+        "din_num((i + 1) * 8 - 1 downto i * 8);" in vhdl['SimpleTwoPortRam']
+    assert "shared variable ram: t_ram" in vhdl['WriteFirstRam']
+    assert "shared variable ram: t_ram" in vhdl['TrueTwoPortRam']
+    assert "if web_num = 0 then" in vhdl['TrueTwoPortRam']
+
+
+def shift_register_model(data, enables, resets, length):
+    """dout[n] as seen after clock edge n."""
+    pushed = []
+    dout, outputs = 0, []
+    for d, ce, rst in zip(data, enables, resets):
+        if rst:
+            pushed = []
+            dout = 0
+        elif ce:
+            pushed.append(int(d))
+            dout = pushed[-length] if len(pushed) >= length else 0
+        outputs.append(dout)
+    return outputs
+
+
+def shift_register_bench(vectors, length, style, reset=False, always=False):
+    data = np.random.randint(-128, 128, vectors)
+    enables = np.ones(vectors, dtype=bool) if always else \
+        np.random.randint(0, 4, vectors) > 0
+    resets = np.random.randint(0, 50, vectors) == 0 if reset else \
+        np.zeros(vectors, dtype=bool)
+    outputs = []
+
+    @block
+    def bench():
+        clk, ce, rst = create_signals(3)
+        din, dout = create_signals(2, 8, signed=True)
+
+        shift = ShiftRegister(clk, True if always else ce, din, dout,
+                              rst if reset else None, length=length,
+                              style=style)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for i in range(vectors):
+                din.next = int(data[i])
+                ce.next = bool(enables[i])
+                rst.next = bool(resets[i])
+                yield clk.posedge
+                yield clk.negedge
+                outputs.append(int(dout))
+            raise StopSimulation
+
+        return shift, clock_gen, stimulus
+
+    bench().run_sim()
+    return outputs, shift_register_model(data, enables, resets, length)
+
+
+def test_shift_register(vectors=1000):
+    for length, style, reset in [(1, 'registers', True), (5, 'registers', True),
+                                 (1, 'srl', False), (37, 'srl', False),
+                                 (2, 'bram', False), (3, 'bram', False),
+                                 (300, 'bram', False)]:
+        outputs, expected = shift_register_bench(vectors, length, style, reset)
+        assert outputs == expected, (length, style)
+
+    outputs, expected = shift_register_bench(vectors, 16, None, always=True)
+    assert outputs == expected
+
+
+def test_shift_register_style():
+    assert shift_register_style(5, reset=create_signals(1)) == 'registers'
+    assert shift_register_style(128) == 'srl'
+    assert shift_register_style(129) == 'bram'
+
+
+def test_long_shift_register():
+    outputs, expected = shift_register_bench(1000, 100000, 'bram')
+    assert outputs == expected
+
+    # A clock costs the same for every length: no Signal per word
+    clk, ce = create_signals(2)
+    din, dout = create_signals(2, 8, signed=True)
+    shift = ShiftRegister(clk, ce, din, dout, length=100000, style='bram')
+    assert not shift.memdict
+    assert len(shift.sigdict) < 10
+
+
+def test_convert_shift_register():
+    clk, ce, rst = create_signals(3)
+    din, dout = create_signals(2, 8, signed=True)
+
+    tmp = tempfile.mkdtemp()
+    vhdl = {}
+    try:
+        for length, style in [(4, 'registers'), (40, 'srl'), (1000, 'bram')]:
+            ShiftRegister(clk, ce, din, dout, rst if style == 'registers' else
+                          None, length=length, style=style).convert(
+                hdl='VHDL', path=tmp, name=style)
+            with open(os.path.join(tmp, style + '.vhd')) as f:
+                vhdl[style] = f.read()
+    finally:
+        shutil.rmtree(tmp)
+
+    assert 'attribute shreg_extract of shift: signal is "no";' in \
+        vhdl['registers']
+    assert "if reset = '1' then" in vhdl['registers']
+    assert 'attribute shreg_extract of shift: signal is "yes";' in vhdl['srl']
+    assert "type t_ram is array(0 to 2 ** 10 - 1) of signed(8 - 1 downto 0);" \
+        in vhdl['bram']
+    assert "dout_num <= ram(to_integer(ptr + 25));" in vhdl['bram']
@@ -4,83 +4,647 @@ __author__ = 'michiel'
 
 from random import randrange
 
-from myhdl import always, always_comb, instance, StopSimulation  # , always, concat
+import numpy as np
+from myhdl import always, block, instance, StopSimulation  # , always, concat
 
 import fpga.interfaces.aes3 as aes3
-from fpga.tests.test_utils import clocker, clockdiv, run_sim  # , int_to_bit_list
+from fpga.tests.test_utils import generate_clock, convert_vhdl
+from fpga.tests.test_utils import encode_aes3, aes3_channel_status, \
+    AES3_FRAMES, AES3_HALF_BITS, AES3_PREAMBLE_X, AES3_PREAMBLE_Y, \
+    AES3_PREAMBLE_Z, aes_crc_bytes
+from fpga.interfaces.aes3.transmitter import AES_TX_RATE_1FS, \
+    AES_TX_RATE_2FS, AES_TX_RATE_4FS
+from fpga.basics.counter import fractional_increment
 from fpga.utils import create_signals  # , binarystring
 
 
 def test_aes3_transmitter():
-    def bench(tests=24 * 64):
-        cs1, valid1, user1, cs2, valid2, user2 = create_signals(6)
-        audio1, audio2 = create_signals(2, 24, signed=True)
-        frame0, ce_word, ce_bit, ce_bp, sdata, clk, rst = create_signals(7)
+    # Clock enables from outside the transmitter
+    data, streams, _ = aes3_tx_bench(1, 4, AES_TX_RATE_1FS, auto_clk=False)
+    assert aes3_tx_frames(streams[0], *data[0], frames=slice(0, 4))
 
-        transmitter = aes3.AES3_TX(audio1, cs1, valid1, user1, audio2, cs2,
-                                   valid2, user2, frame0, ce_word, ce_bit,
-                                   ce_bp, sdata, clk, rst, auto_clk=False)
 
-        clk_count = create_signals(1, (0, 512), mod=True)
+def aes3_tx_bench(outputs, frames, rate, switches=(), multi=False,
+                  fractional=None, auto_clk=True):
+    """Random frames from the start of a block through an AES3_TX (or an
+    AES3_TX_Multi with multi) at rate, or a signal for a run-time rate that
+    changes to switches[k] after loading frame k, or with the fractional
+    (increment, remainder, denominator) clock enables. Without auto_clk an
+    AES_TX_ClockDivider next to the transmitter makes the enables. The
+    inputs (left, right, cs, user, valid per output), the sdata of every
+    output per biphase enable and the number of clocks."""
+    data = [(np.random.randint(-2 ** 23, 2 ** 23, frames),
+             np.random.randint(-2 ** 23, 2 ** 23, frames))
+            + tuple(np.random.randint(0, 2, (2, frames)) for _ in range(3))
+            for _ in range(outputs)]
+    streams = [[] for _ in range(outputs)]
+    clocks = [0]
 
-        clockgen = clocker(clk)
+    @block
+    def bench():
+        clk, rst, frame0, ce_word, ce_bit, ce_bp = create_signals(6)
+        audio1, audio2 = [[create_signals(1, 24, signed=True)
+                           for _ in range(outputs)] for _ in range(2)]
+        cs1, valid1, user1, cs2, valid2, user2, sdata = \
+            [[create_signals(1) for _ in range(outputs)] for _ in range(7)]
+        dividers = []
+        if not auto_clk:
+            enables = dict(auto_clk=False)
+            dividers = aes3.transmitter.AES_TX_ClockDivider(
+                clk, ce_bp, ce_bit, ce_word, rate)
+        elif fractional is None:
+            enables = dict(rate=rate)
+        else:
+            increment = create_signals(1, 32)
+            remainder = create_signals(1, (0, fractional[2]))
+            enables = dict(increment=increment, remainder=remainder,
+                           DENOMINATOR=fractional[2])
+        if multi:
+            transmitter = aes3.AES3_TX_Multi(
+                audio1, cs1, valid1, user1, audio2, cs2, valid2, user2,
+                frame0, ce_word, ce_bit, ce_bp, sdata, clk, rst, **enables)
+        else:
+            transmitter = aes3.AES3_TX(
+                audio1[0], cs1[0], valid1[0], user1[0], audio2[0], cs2[0],
+                valid2[0], user2[0], frame0, ce_word, ce_bit, ce_bp,
+                sdata[0], clk, rst, **enables)
+        clock_gen = generate_clock(clk)
+        recording = [False]
 
         @always(clk.posedge)
-        def counter():
-            clk_count.next = clk_count + 1
+        def recorder():
+            clocks[0] += 1
+            # sdata loaded at the last biphase enable
+            if recording[0]:
+                for stream, signal in zip(streams, sdata):
+                    stream.append(int(signal))
+            recording[0] = bool(ce_bp)
 
-        @always_comb
-        def biphase_clocker():
-            if clk_count[1:0] == 0:
-                ce_bp.next = 1
-            else:
-                ce_bp.next = 0
+        @instance
+        def stimulus():
+            rst.next = True
+            if fractional is not None:
+                increment.next, remainder.next = fractional[:2]
+            yield clk.posedge
+            rst.next = False
+            for k in range(frames):
+                frame0.next = k == 0
+                for i, (left, right, cs, user, valid) in enumerate(data):
+                    audio1[i].next = int(left[k])
+                    audio2[i].next = int(right[k])
+                    cs1[i].next, cs2[i].next = bool(cs[0, k]), bool(cs[1, k])
+                    user1[i].next, user2[i].next = bool(user[0, k]), \
+                        bool(user[1, k])
+                    valid1[i].next, valid2[i].next = bool(valid[0, k]), \
+                        bool(valid[1, k])
+                yield clk.negedge
+                while not ce_word:
+                    yield clk.negedge
+                yield clk.posedge
+                if k in switches:
+                    rate.next = switches[k]
+            # The last frame out
+            for _ in range(2):
+                yield clk.negedge
+                while not ce_word:
+                    yield clk.negedge
+                yield clk.posedge
+            raise StopSimulation
 
-        @always_comb
-        def bit_clocker():
-            if clk_count[2:0] == 0:
-                ce_bit.next = 1
-            else:
-                ce_bit.next = 0
+        return transmitter, dividers, clock_gen, recorder, stimulus
+
+    bench().run_sim()
+    return data, streams, clocks[0]
+
+
+def aes3_tx_frames(stream, left, right, cs, user, valid, frames):
+    """The frames (a slice of the frames from the start of a block) are in
+    the biphase stream, either polarity."""
+    pad = AES3_FRAMES - len(left)
+    expected = encode_aes3(*[np.pad(d, [(0, 0)] * (d.ndim - 1) + [(0, pad)])
+                             for d in (left, right, cs, user, valid)])
+    expected = expected[frames.start * AES3_HALF_BITS:
+                        frames.stop * AES3_HALF_BITS]
+    stream = np.array(stream, dtype=np.uint8)
+    return expected.tobytes() in stream.tobytes() or \
+        (expected ^ 1).tobytes() in stream.tobytes()
+
+
+def test_aes3_tx_rates():
+    for rate in (AES_TX_RATE_1FS, AES_TX_RATE_2FS, AES_TX_RATE_4FS):
+        data, streams, clocks = aes3_tx_bench(1, 6, rate)
+        assert aes3_tx_frames(streams[0], *data[0], frames=slice(0, 6)), rate
+        # 128 half bits per frame of 512 >> rate clocks
+        assert abs(len(streams[0]) - clocks * 2 ** rate // 4) <= 1
+
+    # Changing at run-time doesn't cut a frame
+    for first, second in [(AES_TX_RATE_1FS, AES_TX_RATE_4FS),
+                          (AES_TX_RATE_4FS, AES_TX_RATE_2FS),
+                          (AES_TX_RATE_2FS, AES_TX_RATE_1FS)]:
+        data, streams, _ = aes3_tx_bench(1, 10, create_signals(1, 2),
+                                         {0: first, 4: second})
+        assert aes3_tx_frames(streams[0], *data[0], frames=slice(0, 10)), \
+            (first, second)
+
+
+def test_aes3_tx_fractional():
+    # 44.1 kHz from a 100 MHz clock, the bit and word enables divide the
+    # 128Fs biphase enable
+    settings = fractional_increment(128 * 44100, 100000000)
+    data, streams, clocks = aes3_tx_bench(1, 3, None, fractional=settings)
+    assert aes3_tx_frames(streams[0], *data[0], frames=slice(0, 3))
+    # Give or take the reset and the enable before the first half bit
+    assert abs(len(streams[0]) - clocks * 128 * 44100 / 1e8) <= 2
+
+
+def test_aes_tx_clock_divider_fractional(clocks=20000):
+    # 44.1 kHz from a 100 MHz clock: a 128Fs biphase enable, divided by 2
+    # for the bit enable and by 128 for the word enable
+    increment, remainder, denominator = fractional_increment(128 * 44100,
+                                                             100000000)
+    enables = []
+
+    @block
+    def bench():
+        clk, rst, ce_bp, ce_bit, ce_word = create_signals(5)
+        increment_sig = create_signals(1, 32)
+        divider = aes3.transmitter.AES_TX_ClockDivider(
+            clk, ce_bp, ce_bit, ce_word, increment=increment_sig,
+            remainder=remainder, DENOMINATOR=denominator, rst=rst)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            rst.next = True
+            increment_sig.next = increment
+            yield clk.posedge
+            rst.next = False
+            for _ in range(clocks):
+                yield clk.posedge
+                yield clk.negedge
+                enables.append((int(ce_bp), int(ce_bit), int(ce_word)))
+            raise StopSimulation
 
-        @always_comb
-        def word_clocker():
-            if clk_count == 0:
-                ce_word.next = 1
+        return divider, clock_gen, stimulus
+
+    bench().run_sim()
+    ce_bp, ce_bit, ce_word = np.array(enables).T
+    assert abs(ce_bp.sum() - clocks * 128 * 44100 / 1e8) <= 1
+    # 17 or 18 clocks between the biphase enables
+    assert set(np.diff(np.flatnonzero(ce_bp))) == {17, 18}
+    assert np.flatnonzero(ce_bp)[::2].tolist() == \
+        np.flatnonzero(ce_bit).tolist()
+    assert np.flatnonzero(ce_bp)[::128].tolist() == \
+        np.flatnonzero(ce_word).tolist()
+
+
+def test_aes3_tx_multi():
+    data, streams, _ = aes3_tx_bench(3, 4, AES_TX_RATE_2FS, multi=True)
+    for stream, output in zip(streams, data):
+        assert aes3_tx_frames(stream, *output, frames=slice(0, 4))
+
+
+@block
+def aes3_tx_pair(audio_a, audio_b, cs_bit, valid_bit, user_bit, frame0,
+                 sdata_a, sdata_b, rate, clk, rst):
+    """Two AES3_TX_Multi outputs with the same channel bits everywhere."""
+    ce_word, ce_bit, ce_bp = create_signals(3)
+    cs, valid, user = [[bit, bit] for bit in (cs_bit, valid_bit, user_bit)]
+    return aes3.AES3_TX_Multi([audio_a, audio_b], cs, valid, user,
+                              [audio_a, audio_b], cs, valid, user, frame0,
+                              ce_word, ce_bit, ce_bp, [sdata_a, sdata_b], clk,
+                              rst, rate=rate)
+
+
+def test_convert_aes3_tx():
+    cs1, valid1, user1, cs2, valid2, user2, frame0, ce_word, ce_bit, ce_bp, \
+        sdata, sdata_b, clk, rst = create_signals(14)
+    audio1, audio2 = create_signals(2, 24, signed=True)
+    rate = create_signals(1, 2)
+    increment = create_signals(1, 32)
+    remainder = create_signals(1, (0, 390625))
+
+    for tx_rate in (AES_TX_RATE_4FS, rate):
+        convert_vhdl(aes3.AES3_TX(audio1, cs1, valid1, user1, audio2, cs2,
+                                  valid2, user2, frame0, ce_word, ce_bit,
+                                  ce_bp, sdata, clk, rst, rate=tx_rate))
+    convert_vhdl(aes3.AES3_TX(audio1, cs1, valid1, user1, audio2, cs2, valid2,
+                              user2, frame0, ce_word, ce_bit, ce_bp, sdata,
+                              clk, rst, increment=increment,
+                              remainder=remainder, DENOMINATOR=390625))
+    convert_vhdl(aes3_tx_pair(audio1, audio2, cs1, valid1, user1, frame0,
+                              sdata, sdata_b, rate, clk, rst))
+
+
+def test_encode_aes3():
+    blocks = 2
+    left = [randrange(-2 ** 23, 2 ** 23) for _ in range(blocks * AES3_FRAMES)]
+    right = [randrange(-2 ** 23, 2 ** 23) for _ in range(blocks * AES3_FRAMES)]
+    cs = aes3_channel_status()
+
+    # Bit by bit reference encoder
+    expected = []
+    prev = 0
+    for frame in range(blocks * AES3_FRAMES):
+        for subframe, sample in enumerate((left[frame], right[frame])):
+            if subframe == 1:
+                preamble = AES3_PREAMBLE_Y
+            elif frame % AES3_FRAMES == 0:
+                preamble = AES3_PREAMBLE_Z
             else:
-                ce_word.next = 0
+                preamble = AES3_PREAMBLE_X
+            expected.extend(p ^ prev for p in preamble)
+            prev = expected[-1]
+
+            bits = [(sample >> i) & 1 for i in range(24)]
+            bits += [0, 0, int(cs[frame % AES3_FRAMES])]
+            bits.append(sum(bits) % 2)
+            for bit in bits:
+                prev = 1 - prev
+                expected.append(prev)
+                if bit:
+                    prev = 1 - prev
+                expected.append(prev)
+
+    assert encode_aes3(left, right).tolist() == expected
+
+
+def aes3_rx_bank_bench(streams, symbols=2, settled=None):
+    """Oversampled AES3 streams (one row per input) through an AES3_RX_Bank.
+
+    :return: The subframes received per input, locked at the end and the
+             inputs that lost half bits while locked, or after clock settled
+    """
+    inputs, clocks = streams.shape
+    received = [[] for _ in range(inputs)]
+    flags = [0, 0]
+
+    @block
+    def bench():
+        din = create_signals(1, inputs)
+        audio = create_signals(1, 24, signed=True)
+        valid, user, cs, parity_error, subframe, out_en, clk, rst = \
+            create_signals(8)
+        frame = create_signals(1, 8)
+        channel = create_signals(1, (0, inputs))
+        locked, overflow = create_signals(2, inputs)
+
+        bank = aes3.AES3_RX_Bank(din, audio, valid, user, cs, parity_error,
+                                 frame, channel, subframe, out_en, locked,
+                                 overflow, clk, rst, SYMBOLS=symbols)
+        clock_gen = generate_clock(clk)
+        words = streams.T.dot(1 << np.arange(inputs)).tolist()
 
         @instance
-        def check():
-            had_frame_zero = False
+        def stimulus():
+            for i, word in enumerate(words):
+                din.next = word
+                yield clk.posedge
+                if out_en:
+                    received[int(channel)].append(
+                        (int(subframe), int(audio), int(valid), int(user),
+                         int(cs), int(parity_error), int(frame)))
+                if settled is None:
+                    flags[1] |= int(overflow) & int(locked)
+                elif i >= settled:
+                    flags[1] |= int(overflow)
+            flags[0] = int(locked)
+            raise StopSimulation
+
+        return bank, clock_gen, stimulus
+
+    bench().run_sim()
+    return received, flags[0], flags[1]
+
+
+def aes3_stream(left, right, user, frames, zero, oversampling):
+    """frames frames of AES3 half bits, every half bit oversampling clocks,
+    with the Z preamble of the block in frame zero."""
+    half_bits = encode_aes3(left, right, user=user)
+    half_bits = np.roll(half_bits, (zero - AES3_FRAMES) * AES3_HALF_BITS)
+    return np.repeat(half_bits[:frames * AES3_HALF_BITS], oversampling)
+
+
+def test_aes3_rx_bank():
+    # Inputs at different oversampling rates, all running for the same
+    # time. The clock recovery needs 2048 edges (about 23 frames) to settle,
+    # the frame numbers are known after the Z preamble that follows.
+    oversampling = [4, 5, 6, 7]
+    zero, clocks = 26, 30 * AES3_HALF_BITS * 7
+    streams, expected = [], []
+    for rate in oversampling:
+        left = np.random.randint(-2 ** 23, 2 ** 23, AES3_FRAMES)
+        right = np.random.randint(-2 ** 23, 2 ** 23, AES3_FRAMES)
+        user = np.random.randint(0, 2, AES3_FRAMES)
+        frames = -(-clocks // (AES3_HALF_BITS * rate))
+        streams.append(aes3_stream(left, right, user, frames, zero,
+                                   rate)[:clocks])
+
+        cs = aes3_channel_status()
+        subframes = [(sub, int(sample), 0, int(user[f]), int(cs[f]), 0, f)
+                     for f in range(AES3_FRAMES)
+                     for sub, sample in enumerate((left[f], right[f]))]
+        expected.append(subframes[-2 * zero:] + subframes)
+
+    received, locked, overflow = aes3_rx_bank_bench(np.array(streams))
+    assert locked == 2 ** len(oversampling) - 1 and overflow == 0
+    for rate, got, reference in zip(oversampling, received, expected):
+        z = [i for i, g in enumerate(got) if g[1] == reference[2 * zero][1]]
+        assert z and z[0] >= 4, rate
+        # Samples before the Z preamble, frame numbers after it
+        start = 2 * zero - z[0]
+        assert [g[:-1] for g in got[z[0] - 4:]] == \
+            [r[:-1] for r in reference[2 * zero - 4:start + len(got)]], rate
+        assert [g[-1] for g in got[z[0]:]] == \
+            [r[-1] for r in reference[2 * zero:start + len(got)]], rate
+
+
+def test_aes3_rx_bank_overflow():
+    # Four inputs at 3 clocks per half bit are too many to share with one
+    # half bit per input at a time, enough with two. All ones have the most
+    # edges, so the clock recovery settles soonest.
+    ones = np.full(AES3_FRAMES, -1)
+    stream = aes3_stream(ones, ones, None, 24, 0, 3)
+    for symbols, lost in [(1, True), (2, False)]:
+        received, locked, overflow = aes3_rx_bank_bench(
+            np.stack([stream] * 4), symbols, settled=len(stream) * 7 // 8)
+        assert (overflow == 2 ** 4 - 1) == lost, symbols
+
+
+def aes_dru_bench(stream, word_bits=None, out_bits=None, overflows=None):
+    """The half bits recovered from an oversampled stream by an AES_Dru, or
+    by an AES_Dru_Parallel with words of word_bits, which appends the words
+    with an overflow to overflows."""
+    recovered, overflowed = [], []
+
+    @block
+    def bench():
+        clk, rst = create_signals(2)
+        if word_bits is None:
+            din, dout, dout_valid = create_signals(3)
+            dru = aes3.receiver.AES_Dru(din, dout, dout_valid, clk, rst)
+            words = stream.tolist()
+        else:
+            din = create_signals(1, word_bits)
+            dout = create_signals(1, out_bits)
+            dout_count = create_signals(1, (0, out_bits + 1))
+            overflow = create_signals(1)
+            dru = aes3.receiver.AES_Dru_Parallel(din, dout, dout_count, clk,
+                                                 rst, overflow)
+            samples = stream[:len(stream) // word_bits * word_bits]
+            words = samples.reshape(-1, word_bits).dot(
+                1 << np.arange(word_bits)).tolist()
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for n, word in enumerate(words + [0] * 3):
+                din.next = word
+                yield clk.posedge
+                if word_bits is None:
+                    if dout_valid:
+                        recovered.append(int(dout))
+                else:
+                    recovered.extend((int(dout) >> i) & 1
+                                     for i in range(int(dout_count)))
+                    if overflow:
+                        overflowed.append(n)
+            raise StopSimulation
+
+        return dru, clock_gen, stimulus
+
+    bench().run_sim()
+    if overflows is not None:
+        overflows.extend(overflowed)
+    return recovered
+
+
+def test_aes_dru_parallel():
+    # 2048 edges for the minimum symbol length to settle
+    samples = np.random.randint(-2 ** 23, 2 ** 23, AES3_FRAMES)
+    half_bits = encode_aes3(samples, samples)[:26 * AES3_HALF_BITS]
+    for oversampling, word_bits in [(4, 8), (5, 16), (3, 10)]:
+        stream = np.repeat(half_bits, oversampling)
+        # Both start with a word of zeros, AES_Dru has 2 in its input
+        # registers and AES_Dru_Parallel a word
+        serial = aes_dru_bench(np.concatenate((np.zeros(word_bits - 2, int),
+                                               stream)))
+        # Every sample point, also while the symbol length is unknown
+        overflows = []
+        parallel = aes_dru_bench(stream, word_bits, word_bits, overflows)
+        common = min(len(serial), len(parallel))
+        assert common > len(half_bits)
+        assert parallel[:common] == serial[:common], oversampling
+        assert overflows == []
+
+        # After settling the half bits come through whole, the last ones
+        # are from the zeros after the stream. Only the words before the
+        # second update of the symbol length (and the latency) can have
+        # more half bits than dout.
+        parallel = aes_dru_bench(stream, word_bits, word_bits // 2 + 1,
+                                 overflows)
+        window = ''.join(map(str, parallel[-2 * AES3_HALF_BITS:-16]))
+        assert window in ''.join(map(str, half_bits)), oversampling
+        settled = np.nonzero(np.diff(stream))[0][2047] // word_bits
+        assert overflows and max(overflows) < settled + 16, oversampling
+
+
+def test_convert_aes3_rx_bank():
+    din = create_signals(1, 3)
+    audio = create_signals(1, 24, signed=True)
+    valid, user, cs, parity_error, subframe, out_en, clk, rst = \
+        create_signals(8)
+    frame = create_signals(1, 8)
+    channel = create_signals(1, (0, 3))
+    locked, overflow = create_signals(2, 3)
+
+    convert_vhdl(aes3.AES3_RX_Bank(din, audio, valid, user, cs, parity_error,
+                                   frame, channel, subframe, out_en, locked,
+                                   overflow, clk, rst))
+
+
+def test_convert_aes_dru_parallel():
+    clk, rst = create_signals(2)
+    din = create_signals(1, 16)
+    dout = create_signals(1, 9)
+    dout_count = create_signals(1, (0, 10))
+    overflow = create_signals(1)
+
+    convert_vhdl(aes3.receiver.AES_Dru_Parallel(din, dout, dout_count, clk,
+                                                rst, overflow))
+
+
+@block
+def block_reader(block_ready, crc_error, raddr, dout, clk, captured):
+    """Host reading the 96 bytes of a block capture after every
+    block_ready, appends the crc_error and the bytes to captured."""
+
+    @instance
+    def host():
+        while True:
             yield clk.posedge
+            if block_ready:
+                data = []
+                for addr in range(96):
+                    raddr.next = (addr // 24) << 5 | addr % 24
+                    yield clk.posedge
+                    yield clk.negedge
+                    data.append(int(dout))
+                captured.append((int(crc_error), data))
+
+    return host
+
+
+def block_capture_bench(cs, user, first=0, gap=2, lead=None):
+    """Frames first - 191 of a block, or the frame numbers in lead, and then
+    the blocks of cs and user bits (blocks x 2 channels x 192 frames)
+    through an AES_Block_Capture. The crc_error and the 96 bytes read after
+    every block_ready."""
+    if lead is None:
+        lead = np.arange(first, AES3_FRAMES)
+    frames = np.concatenate((lead, np.tile(np.arange(AES3_FRAMES),
+                                           cs.shape[0])))
+    captured = []
+
+    @block
+    def bench():
+        clk, rst, channel1, channel2, user_bit, cs_bit, block_ready = \
+            create_signals(7)
+        frame = create_signals(1, 8)
+        crc_error = create_signals(1, 2)
+        raddr = create_signals(1, 7)
+        dout = create_signals(1, 8)
+
+        capture = aes3.AES_Block_Capture(channel1, channel2, user_bit, cs_bit,
+                                         frame, block_ready, crc_error,
+                                         raddr, dout, clk, rst)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
             rst.next = True
-            frame0.next = 0
             yield clk.posedge
-            frame0.next = 0
-            yield ce_word.posedge
-
-            print('| ce_word | ce_bit  | ce_bp   | frame0  | sdata')
-            for i in range(tests):
-                rst.next = False
-                frame0.next = 0
-                if ce_bp:
-                    print("| {:>7} | {:>7} | {:>7} | {:>7} | {:>7}".format(
-                        ce_word, ce_bit, ce_bp, frame0, sdata))
-                if clk_count == 0 and not had_frame_zero:
-                    frame0.next = 1
-                    had_frame_zero = True
-
-                if ce_word:
-                    audio1.next = randrange(audio1.min, audio1.max)
-                    audio2.next = randrange(audio2.min, audio2.max)
-                yield clk.negedge
+            rst.next = False
+            for n, number in enumerate(frames.tolist()):
+                frame.next = number
+                for channel, strobe in enumerate((channel1, channel2)):
+                    if n >= len(lead):
+                        k, f = divmod(n - len(lead), AES3_FRAMES)
+                        cs_bit.next = bool(cs[k, channel, f])
+                        user_bit.next = bool(user[k, channel, f])
+                    strobe.next = True
+                    yield clk.posedge
+                    strobe.next = False
+                    for _ in range(gap):
+                        yield clk.posedge
+            # The last block_ready and its reads
+            for _ in range(200):
+                yield clk.posedge
+            raise StopSimulation
+
+        host = block_reader(block_ready, crc_error, raddr, dout, clk,
+                            captured)
+
+        return capture, clock_gen, stimulus, host
+
+    bench().run_sim()
+    return captured
+
+
+def test_aes_block_capture():
+    blocks = 3
+    cs_bytes = aes_crc_bytes(np.random.randint(0, 256, (blocks * 2, 24)))
+    # A CRC error on channel 2 of the second block
+    cs_bytes[3, 5] ^= 0x10
+    cs = np.unpackbits(cs_bytes, axis=1, bitorder='little').reshape(
+        blocks, 2, AES3_FRAMES)
+    user = np.random.randint(0, 2, (blocks, 2, AES3_FRAMES))
 
+    for first, gap in [(1, 2), (100, 0), (191, 5)]:
+        # Only the whole blocks after the Z preamble
+        captured = block_capture_bench(cs, user, first, gap)
+        assert len(captured) == blocks, (first, gap)
+        for k, (crc_error, data) in enumerate(captured):
+            assert crc_error == (2 if k == 1 else 0)
+            expected = np.concatenate((
+                np.packbits(cs[k], axis=1, bitorder='little'),
+                np.packbits(user[k], axis=1, bitorder='little'))).ravel()
+            assert data == list(expected), (first, gap, k)
+
+    # Without a Z preamble the frame counter wraps around after 255, the
+    # block it then counts is not handed out
+    lead = np.concatenate((np.arange(200, 256), np.arange(230)))
+    captured = block_capture_bench(cs, user, lead=lead)
+    assert [crc_error for crc_error, _ in captured] == [0, 2, 0]
+
+
+def test_aes3_rx_block_capture():
+    # A block with its Z preamble in frame zero, after the clock recovery
+    # has settled (about 23 frames) and the framer locked
+    zero, oversampling = 26, 4
+    cs_bytes = aes_crc_bytes(np.random.randint(0, 256, (2, 24)))
+    # A CRC error on channel 2
+    cs_bytes[1, 7] ^= 0x02
+    cs = np.unpackbits(cs_bytes, axis=1, bitorder='little')
+    user = np.random.randint(0, 2, (2, AES3_FRAMES))
+    samples = np.random.randint(-2 ** 23, 2 ** 23, AES3_FRAMES)
+    half_bits = np.tile(encode_aes3(samples, samples, cs=cs, user=user), 2)
+    half_bits = np.roll(half_bits, zero * AES3_HALF_BITS)
+    stream = np.repeat(half_bits[:(zero + AES3_FRAMES + 2) * AES3_HALF_BITS],
+                       oversampling).tolist()
+    captured = []
+
+    @block
+    def bench():
+        din, valid1, user1, cs1, out_en, valid2, user2, cs2, parity_error, \
+            frame0, locked, block_ready, clk, rst = create_signals(14)
+        audio1, audio2 = create_signals(2, 24, signed=True)
+        frames = create_signals(1, 8)
+        crc_error = create_signals(1, 2)
+        block_addr = create_signals(1, 7)
+        block_data = create_signals(1, 8)
+
+        rx = aes3.AES3_RX(din, audio1, valid1, user1, cs1, out_en, audio2,
+                          valid2, user2, cs2, parity_error, frames, frame0,
+                          locked, clk, rst, block_ready, crc_error,
+                          block_addr, block_data)
+        host = block_reader(block_ready, crc_error, block_addr, block_data,
+                            clk, captured)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for bit in stream:
+                din.next = bit
+                yield clk.posedge
             raise StopSimulation
 
-        return transmitter, clockgen, check, counter, biphase_clocker, bit_clocker, word_clocker
+        return rx, host, clock_gen, stimulus
+
+    bench().run_sim()
+    # Only the whole block after the Z preamble
+    assert len(captured) == 1
+    crc_error, data = captured[0]
+    assert crc_error == 2
+    expected = np.concatenate((cs_bytes,
+                               np.packbits(user, axis=1, bitorder='little')))
+    assert data == expected.ravel().tolist()
+
+
+def test_convert_aes3_rx_block_capture():
+    din, valid1, user1, cs1, out_en, valid2, user2, cs2, parity_error, \
+        frame0, locked, block_ready, clk, rst = create_signals(14)
+    audio1, audio2 = create_signals(2, 24, signed=True)
+    frames = create_signals(1, 8)
+    crc_error = create_signals(1, 2)
+    block_addr = create_signals(1, 7)
+    block_data = create_signals(1, 8)
+
+    convert_vhdl(aes3.AES3_RX(din, audio1, valid1, user1, cs1, out_en, audio2,
+                              valid2, user2, cs2, parity_error, frames,
+                              frame0, locked, clk, rst, block_ready,
+                              crc_error, block_addr, block_data))
 
-    run_sim(bench)
 
 if __name__ == '__main__':
     test_aes3_transmitter()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+__author__ = 'michiel'
+
+import numpy as np
+from myhdl import block, instance, StopSimulation
+
+from fpga.interfaces.aes3.crc import AES_CRC_Generator, AES_CRC_Checker, \
+    CRC, crc_serial, crc_matrix, reflect_bits, AES_CRC_PRESET
+from fpga.utils import create_signals
+from fpga.tests.test_utils import generate_clock, aes_crc_bytes, convert_vhdl
+
+
+#: Catalogued CRCs, the CRC of b'123456789'
+CRC_CATALOGUE = [
+    # CRC-8/EBU, the AES3 channel status CRC
+    (dict(), 0x97),
+    # CRC-3/GSM
+    (dict(poly=0x3, width=3, preset=0, reflect_in=False, reflect_out=False,
+          xor_out=0x7), 0x4),
+    # CRC-5/USB
+    (dict(poly=0x05, width=5, preset=0x1F, xor_out=0x1F), 0x19),
+    # CRC-16/CCITT-FALSE and CRC-16/ARC
+    (dict(poly=0x1021, width=16, preset=0xFFFF, reflect_in=False,
+          reflect_out=False), 0x29B1),
+    (dict(poly=0x8005, width=16, preset=0), 0xBB3D),
+    # CRC-16/RIELLO and CRC-24/BLE, reflected with an asymmetric preset
+    (dict(poly=0x1021, width=16, preset=0xB2AA), 0x63D0),
+    (dict(poly=0x00065B, width=24, preset=0x555555), 0xC25A56),
+    # CRC-32 and CRC-32/BZIP2
+    (dict(poly=0x04C11DB7, width=32, preset=0xFFFFFFFF,
+          xor_out=0xFFFFFFFF), 0xCBF43926),
+    (dict(poly=0x04C11DB7, width=32, preset=0xFFFFFFFF, reflect_in=False,
+          reflect_out=False, xor_out=0xFFFFFFFF), 0xFC891918),
+    # CRC-64/ECMA-182
+    (dict(poly=0x42F0E1EBA9EA3693, width=64, preset=0, reflect_in=False,
+          reflect_out=False), 0x6C40DF5F0B497347),
+]
+
+
+def test_crc_catalogue():
+    for parameters, check in CRC_CATALOGUE:
+        for slices in (1, 8):
+            crc = CRC(slices=slices, **parameters)
+            assert crc(b'123456789') == check, (parameters, slices)
+
+
+def test_crc_slices(blocks=100):
+    # Slice-by-8 and bytewise agree for any length and bit order
+    for parameters, _ in CRC_CATALOGUE:
+        for reflect_out in (False, True):
+            parameters = dict(parameters, reflect_out=reflect_out)
+            for length in (1, 7, 8, 9, 24, 61):
+                data = np.random.randint(0, 256, (blocks, length))
+                assert (CRC(slices=1, **parameters).blocks(data) ==
+                        CRC(slices=8, **parameters).blocks(data)).all()
+    # A reflected CRC is the reflected CRC of the register
+    crc = CRC(poly=0x1021, width=16, preset=0xFFFF, reflect_in=False,
+              reflect_out=True)
+    assert crc(b'123456789') == reflect_bits(0x29B1, 16)
+
+
+def test_crc_serial():
+    # The reflected LFSR bit order is the order bytes are sent in
+    data = np.random.randint(0, 256, 23).astype(np.uint8)
+    bits = np.unpackbits(data, bitorder='little')
+    register = crc_serial(AES_CRC_PRESET, bits)
+    assert reflect_bits(register, 8) == CRC()(data.tobytes())
+
+
+def test_crc_check_blocks(blocks=100000):
+    data = aes_crc_bytes(np.random.randint(0, 256, (blocks, 24)))
+    assert CRC().check_blocks(data).all()
+    # Every single bit error is found
+    errors = np.random.random(blocks) < .5
+    data[errors, np.random.randint(0, 24, errors.sum())] ^= \
+        (1 << np.random.randint(0, 8, errors.sum())).astype(np.uint8)
+    assert (CRC().check_blocks(data) == ~errors).all()
+
+    # Wider CRCs, LSB first as sent or MSB first
+    crc32 = CRC(**CRC_CATALOGUE[7][0])
+    data = np.random.randint(0, 256, (100, 32)).astype(np.uint8)
+    data[:, -4:] = crc32.blocks(data[:, :-4]).astype('<u4').view(
+        np.uint8).reshape(-1, 4)
+    assert crc32.check_blocks(data, 4).all()
+    crc16 = CRC(**CRC_CATALOGUE[3][0])
+    data[:, -2:] = crc16.blocks(data[:, :-2]).astype('>u2').view(
+        np.uint8).reshape(-1, 2)
+    assert crc16.check_blocks(data, 2).all()
+
+
+def test_crc_matrix():
+    # The matrix of a word is the serial CRC of its bits
+    for bits in (1, 8, 24, 32):
+        state_taps, data_taps = crc_matrix(bits)
+        for _ in range(20):
+            state = np.random.randint(0, 256)
+            data = np.random.randint(0, 2, bits)
+            expected = crc_serial(state, data)
+            for o in range(8):
+                parity = sum((state >> j) & 1 for j in state_taps[o]) + \
+                    sum(data[i] for i in data_taps[o])
+                assert parity % 2 == (expected >> o) & 1
+
+
+def crc_bench(blocks, bits, func):
+    """Channel status blocks through func(din, frames, ce, clk, out), bits
+    at a time, every word of out."""
+    words = blocks.reshape(-1, 192 // bits, bits).dot(1 << np.arange(bits))
+    outputs = []
+
+    @block
+    def bench():
+        clk, ce = create_signals(2)
+        din = create_signals(1, bits)
+        frames = create_signals(1, (0, 192 // bits))
+        if func is AES_CRC_Generator:
+            out = create_signals(1, bits)
+        else:
+            out = create_signals(1)
+
+        crc = func(din, frames, ce, clk, out)
+        clock_gen = generate_clock(clk)
+
+        @instance
+        def stimulus():
+            for block_words in words.tolist():
+                for i, word in enumerate(block_words):
+                    # Not every clock
+                    ce.next = False
+                    yield clk.posedge
+                    ce.next = True
+                    din.next = word
+                    frames.next = i
+                    yield clk.posedge
+                    outputs.append(int(out))
+            ce.next = False
+            yield clk.posedge
+            outputs.append(int(out))
+            raise StopSimulation
+
+        return crc, clock_gen, stimulus
+
+    bench().run_sim()
+    return outputs[1:]
+
+
+def test_aes_crc_generator(nr_blocks=3):
+    data = np.random.randint(0, 256, (nr_blocks, 24)).astype(np.uint8)
+    expected = aes_crc_bytes(data)
+    for bits in (1, 8, 32):
+        blocks = np.unpackbits(data, axis=1, bitorder='little')
+        outputs = crc_bench(blocks, bits, AES_CRC_Generator)
+        sent = (np.array(outputs)[:, None] >> np.arange(bits)) & 1
+        sent = np.packbits(sent.reshape(nr_blocks, 192).astype(np.uint8),
+                           axis=1, bitorder='little')
+        assert (sent == expected).all(), bits
+
+
+def test_aes_crc_checker(nr_blocks=6):
+    data = aes_crc_bytes(np.random.randint(0, 256, (nr_blocks, 24)))
+    blocks = np.unpackbits(data, axis=1, bitorder='little')
+    # Single bit errors in every other block, the CRC byte included
+    errors = np.arange(nr_blocks) % 2 == 1
+    blocks[errors, np.random.randint(0, 192, errors.sum())] ^= 1
+    for bits in (1, 8, 32):
+        outputs = crc_bench(blocks, bits, AES_CRC_Checker)
+        flags = np.array(outputs).reshape(nr_blocks, -1)[:, -1]
+        assert (flags == errors).all(), bits
+
+
+def test_convert_aes_crc():
+    clk, ce = create_signals(2)
+    din, dout = create_signals(2, 32)
+    frames = create_signals(1, (0, 6))
+    crc_err = create_signals(1)
+
+    convert_vhdl(AES_CRC_Generator(din, frames, ce, clk, dout))
+    convert_vhdl(AES_CRC_Checker(din, frames, ce, clk, crc_err))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+__author__ = 'michiel'
+
+import os
+import shutil
+import tempfile
+
+from fpga.build import find_targets, main
+
+SCRIPT = """
+def convert_{0}():
+    with open('out.vhd', 'w') as f:
+        f.write('{0}')
+
+
+def convert_broken_{0}():
+    raise ValueError('{0}')
+
+raise RuntimeError('Only run the convert functions')
+"""
+
+
+def test_build():
+    tmp = tempfile.mkdtemp()
+    try:
+        builds = os.path.join(tmp, 'builds')
+        output = os.path.join(tmp, 'vhdl')
+        os.makedirs(os.path.join(builds, 'sub'))
+        with open(os.path.join(builds, 'first.py'), 'w') as f:
+            f.write(SCRIPT.format('first').replace('raise Runtime', '# '))
+        with open(os.path.join(builds, 'sub', 'second.py'), 'w') as f:
+            f.write(SCRIPT.format('second').replace('raise Runtime', '# '))
+
+        targets = find_targets(builds, output)
+        assert [t.name for t in targets] == [
+            'first::convert_first', 'first::convert_broken_first',
+            os.path.join('sub', 'second') + '::convert_second',
+            os.path.join('sub', 'second') + '::convert_broken_second']
+
+        assert main([builds, '-o', output, '-j', '2', '-k', 'broken']) == 1
+        assert main([builds, '-o', output, '-j', '2', '-k', 'convert_s']) == 0
+        assert main([builds, '-o', output, '-j', '2', '-k', 'convert_f']) == 0
+
+        # Both targets wrote out.vhd, but each in its own directory
+        for name, directory in [('first', 'first/convert_first'),
+                                ('second', 'sub/second/convert_second')]:
+            with open(os.path.join(output, directory, 'out.vhd')) as f:
+                assert f.read() == name
+    finally:
+        shutil.rmtree(tmp)
+
+
+def test_find_targets_does_not_run_scripts():
+    tmp = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmp, 'script.py'), 'w') as f:
+            f.write(SCRIPT.format('script'))
+        assert len(find_targets(tmp, os.path.join(tmp, 'vhdl'))) == 2
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+__author__ = 'michiel'
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+import fpga
+
+PACKAGE = os.path.dirname(os.path.dirname(os.path.abspath(fpga.__file__)))
+
+#: The fpga modules may take at most this fraction of myhdl's import time on
+#: top of it; relative, so a loaded machine or coverage run slows both sides
+IMPORT_BUDGET = 0.5
+
+
+def _import(statement):
+    """Run an import in a fresh interpreter in an empty directory.
+
+    :return: (stdout, files written, {module: cumulative import seconds})
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        env = dict(os.environ, PYTHONPATH=PACKAGE, PYTHONDONTWRITEBYTECODE='1')
+        process = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                  statement], cwd=tmp, env=env,
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 universal_newlines=True, check=True)
+        files = os.listdir(tmp)
+    finally:
+        shutil.rmtree(tmp)
+
+    # import time: self [us] | cumulative | imported package
+    times = {}
+    for line in process.stderr.splitlines()[1:]:
+        if line.startswith('import time:'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(cumulative) / 1e6
+    return process.stdout, files, times
+
+
+def test_import_fpga():
+    stdout, files, times = _import('import fpga')
+    assert stdout == '' and files == []
+
+    # Only the package itself, the submodules are loaded on first use
+    assert [m for m in times if m.startswith('fpga')] == ['fpga']
+
+    own = times['fpga'] - times['myhdl']
+    assert own < IMPORT_BUDGET * times['myhdl'], \
+        "import fpga takes {:.3f} s on top of myhdl ({:.3f} s)".format(
+            own, times['myhdl'])
+
+
+def test_import_side_effects():
+    stdout, files, _ = _import('import fpga.interfaces.vga, '
+                               'fpga.templates.mux, fpga.encoders, '
+                               'fpga.generators')
+    assert stdout == '' and files == []
+
+
+def test_lazy_attributes():
+    assert fpga.dff is fpga.basics.dff
+    assert fpga.create_signals is fpga.utils.create_signals
+    assert 'dff' in fpga.__all__ and 'create_signals' in dir(fpga)
+    assert fpga.toVHDL.architecture == "ScryverDesign"
+    try:
+        fpga.not_a_module
+    except AttributeError:
+        pass
+    else:
+        assert False, "Unknown names should raise an AttributeError"
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+__author__ = 'michiel'
+
+import os
+import gzip
+import json
+import random
+import shutil
+import tempfile
+
+from myhdl import block, instance, now, StopSimulation
+
+from fpga.utils import create_signals
+from fpga.basics.flipflops import dff
+from fpga.sim import run_sim, run_sim_parallel, SignalTrace
+from fpga.tests.test_utils import clocker
+
+
+def test_run_sim_parallel():
+    @block
+    def bench():
+        clk = create_signals(1)
+        clock_gen = clocker(clk)
+
+        @instance
+        def check():
+            for i in range(10):
+                yield clk.negedge
+            assert random.randrange(4) != 0, "Unlucky seed"
+            raise StopSimulation
+
+        return clock_gen, check
+
+    lucky, unlucky = [], []
+    for seed in range(16):
+        random.seed(seed)
+        (lucky if random.randrange(4) != 0 else unlucky).append(seed)
+
+    results = run_sim_parallel(bench, lucky, processes=4)
+    assert [r.seed for r in results] == lucky
+    assert all(r.passed and r.sim_time > 0 for r in results)
+
+    try:
+        run_sim_parallel(bench, 16, processes=4)
+    except AssertionError as e:
+        assert "Failing seeds {}".format(unlucky) in str(e)
+    else:
+        assert False, "Unlucky seeds should fail"
+
+    try:
+        run_sim(bench, seed=unlucky[0])
+    except AssertionError as e:
+        assert "Unlucky seed" in str(e)
+    else:
+        assert False, "Replaying an unlucky seed should fail"
+
+
+def test_run_sim_profile(cycles=50):
+
+    @block
+    def bench():
+        clk = create_signals(1)
+        d, q = create_signals(2, 8)
+        clock_gen = clocker(clk)
+        dut = dff(clk, d, q)
+
+        @instance
+        def stimulus():
+            for i in range(cycles):
+                d.next = i
+                yield clk.negedge
+            raise StopSimulation
+
+        return clock_gen, dut, stimulus
+
+    fd, filename = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        profile = run_sim(bench, profile=filename)
+        with open(filename) as f:
+            data = json.load(f)
+    finally:
+        os.remove(filename)
+
+    processes = dict((p['path'], p) for p in data['processes'])
+    assert sorted(processes) == ['bench/clock_gen/clock_generator',
+                                 'bench/dut/logic', 'bench/stimulus']
+    # Started once, then resumed every edge or negedge
+    assert processes['bench/dut/logic']['activations'] == cycles + 1
+    assert processes['bench/stimulus']['activations'] == cycles + 1
+    assert processes['bench/clock_gen/clock_generator']['activations'] >= 2 * cycles
+    assert data['sim_time'] == profile.sim_time > 0
+    assert [p['seconds'] for p in data['processes']] == \
+        sorted((p['seconds'] for p in data['processes']), reverse=True)
+
+    # Profiling doesn't change the simulation
+    assert run_sim(bench) is None
+
+
+def test_run_sim_signal_trace(cycles=50):
+
+    @block
+    def bench():
+        clk = create_signals(1)
+        d, q = create_signals(2, 8)
+        start = create_signals(1)
+        clock_gen = clocker(clk)
+        dut = dff(clk, d, q)
+
+        @instance
+        def stimulus():
+            for i in range(cycles):
+                d.next = i
+                start.next = i >= 10
+                yield clk.negedge
+            raise StopSimulation
+
+        return clock_gen, dut, stimulus
+
+    def changes(filename, opener):
+        with opener(filename, 'rt') as f:
+            lines = f.read().splitlines()
+        header = lines[:lines.index('$enddefinitions $end') + 1]
+        times = [int(l[1:]) for l in lines[len(header):] if l.startswith('#')]
+        return header, times
+
+    tmp = tempfile.mkdtemp()
+    try:
+        plain = os.path.join(tmp, 'plain.vcd')
+        run_sim(bench, trace=SignalTrace(plain, ['bench/d', 'bench/dut/q']))
+        header, times = changes(plain, open)
+        assert sorted(l for l in header if l.startswith('$var')) == \
+            ['$var reg 8 ! q $end', '$var reg 8 " d $end']
+        assert times[0] == 0 and len(times) > cycles
+
+        # Glob and window, through a gzip stream and a tiny buffer
+        zipped = os.path.join(tmp, 'window.vcd.gz')
+        trace = SignalTrace(zipped, 'bench/dut/*', windows=[(300, 600)],
+                            buffer_size=16)
+        run_sim(bench, trace=trace)
+        assert sorted(trace.signals) == ['bench/clk', 'bench/d', 'bench/q']
+        header, times = changes(zipped, gzip.open)
+        assert times[0] == 300 and all(300 <= t < 600 for t in times)
+
+        triggered = os.path.join(tmp, 'triggered.vcd')
+        run_sim(bench, trace=SignalTrace(triggered, '*/q',
+                                         trigger=lambda: now() >= 400))
+        header, times = changes(triggered, open)
+        assert times[0] >= 400 and len(times) > 1
+    finally:
+        shutil.rmtree(tmp)
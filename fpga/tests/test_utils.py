@@ -5,71 +5,22 @@ from fpga.utils import create_signals
 
 __author__ = 'michiel'
 
+import os
 import math
 import random
+import shutil
+import tempfile
+import warnings
+import numpy as np
 import fpga.utils as utils
-from myhdl import block, always, instance, delay, StopSimulation, Simulation, traceSignals, bin
+from fpga.interfaces.aes3.crc import CRC
+from fpga.sim import run_sim, run_sim_parallel, SignalTrace, SimProfile
+from myhdl import block, always, instance, delay, StopSimulation, bin, \
+    ToVHDLWarning
 
 
 
 # NOTE(michiel): OLD CODE BELOW
-# def clocker(clock, half_cycle=10):
-#     @always(delay(half_cycle))
-#     def clock_generator():
-#         clock.next = not clock
-#
-#     return clock_generator
-#
-#
-# def clockdiv(edge, clockdivided, counter, cycles, single_pulse=False):
-#     """
-#
-#     :param edge:
-#     :param clockdivided:
-#     :param counter:
-#     :param cycles:
-#     :param single_pulse:     If True a single cycle pulse will be created, if False a clock with 50% duty cycle
-#     :return:
-#     """
-#     @always(edge)
-#     def clock_divider():
-#         if counter < cycles - 1:
-#             counter.next += 1
-#             if single_pulse:
-#                 clockdivided.next = False
-#         else:
-#             counter.next = 0
-#             if single_pulse:
-#                 clockdivided.next = True
-#             else:
-#                 clockdivided.next = not clockdivided
-#
-#     return clock_divider
-#
-#
-# def run_sim(bench, time_steps=None, trace=False, **kwargs):
-#     try:
-#         M = len(bench)
-#         benches = tuple(bench)
-#     except TypeError:
-#         M = 1
-#         benches = (bench, )
-#
-#     b = []
-#     if trace:
-#         for i in range(M):
-#             b.append(traceSignals(benches[i]))
-#     else:
-#         for i in range(M):
-#             b.append(benches[i](**kwargs))
-#
-#     if M == 1:
-#         s = Simulation(b[0])
-#     else:
-#         s = Simulation(tuple(b))
-#     s.run(time_steps)
-#
-#
 # def benchEdgeDetect(tests=100):
 #
 #     din, p_edge, n_edge, clock, reset = create_signals(5)
@@ -265,6 +216,255 @@ def generate_reset(clk, rst, periods=3):
     return reset_gen
 
 
+@block
+def clocker(clock, half_cycle=10):
+
+    @always(delay(half_cycle))
+    def clock_generator():
+        clock.next = not clock
+
+    return clock_generator
+
+
+@block
+def clockdiv(edge, clockdivided, counter, cycles, single_pulse=False):
+    """
+
+    :param edge:
+    :param clockdivided:
+    :param counter:
+    :param cycles:
+    :param single_pulse:     If True a single cycle pulse will be created, if False a clock with 50% duty cycle
+    :return:
+    """
+    @always(edge)
+    def clock_divider():
+        if counter < cycles - 1:
+            counter.next += 1
+            if single_pulse:
+                clockdivided.next = False
+        else:
+            counter.next = 0
+            if single_pulse:
+                clockdivided.next = True
+            else:
+                clockdivided.next = not clockdivided
+
+    return clock_divider
+
+
+def convert_vhdl(inst, name=None):
+    """Convert a block instance to VHDL in a temporary directory, asserting
+    the file is written without any ToVHDLWarning.
+
+    :param inst:    Block instance
+    :param name:    Design and file name, defaults to the block name
+    :return:        The VHDL code
+    """
+    name = name or inst.func.__name__
+    tmp = tempfile.mkdtemp()
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ToVHDLWarning)
+            inst.convert(hdl='VHDL', path=tmp, name=name)
+        filename = os.path.join(tmp, name + '.vhd')
+        assert os.path.isfile(filename)
+        with open(filename) as f:
+            vhdl = f.read()
+    finally:
+        shutil.rmtree(tmp)
+
+    warned = [str(w.message) for w in caught
+              if issubclass(w.category, ToVHDLWarning)]
+    assert not warned, "{} converts with warnings:\n{}".format(
+        name, "\n".join(warned))
+    return vhdl
+
+
+# NOTE(michiel): AES3 stimulus, see fpga/interfaces/aes3/AES3.md
+AES3_FRAMES = 192                   # Frames per audio block
+AES3_HALF_BITS = 2 * 32 * 2         # Biphase half bits per frame
+
+# Preambles as send after a low level, inverted after a high level
+AES3_PREAMBLE_X = (1, 1, 1, 0, 0, 0, 1, 0)
+AES3_PREAMBLE_Y = (1, 1, 1, 0, 0, 1, 0, 0)
+AES3_PREAMBLE_Z = (1, 1, 1, 0, 1, 0, 0, 0)
+
+
+def aes3_channel_status():
+    """Default channel status block, AES/EBU without preemphasis."""
+    cs = np.zeros(AES3_FRAMES, dtype=np.uint8)
+    cs[0] = 1
+    cs[4] = 1
+    return cs
+
+
+def aes_crc_bytes(data):
+    """Blocks of 24 bytes with the AES3 CRC in byte 23."""
+    data = np.array(data, dtype=np.uint8)
+    data[:, 23] = CRC().blocks(data[:, :23])
+    return data
+
+
+def _aes3_transitions(preamble):
+    return np.diff(np.array(preamble, dtype=np.uint8), prepend=0) & 1
+
+
+def _aes3_subframes(samples, valid, user, cs):
+    """Time slots 4 - 31 (audio LSB first, V, U, C and P) per subframe."""
+    samples = np.asarray(samples, dtype=np.int64) & 0xFFFFFF
+    bits = ((samples[:, None] >> np.arange(24)) & 1).astype(np.uint8)
+    slots = np.concatenate((bits, valid[:, None], user[:, None],
+                            cs[:, None]), axis=1)
+    parity = np.bitwise_xor.reduce(slots, axis=1)
+    return np.concatenate((slots, parity[:, None]), axis=1)
+
+
+def encode_aes3(left, right, cs=None, user=None, valid=None, prev=0):
+    """Biphase mark encode complete AES3 audio blocks in one go.
+
+    Every block of 192 frames starts with a Z preamble. The channel status,
+    user and valid bits are either one value per frame for both channels
+    (shape (192, ) or (frames, )) or per channel (shape (2, ...)).
+
+    :param left:    int32 array, 24 bit samples for channel A (multiple of 192)
+    :param right:   int32 array, 24 bit samples for channel B
+    :param cs:      Channel status bits, defaults to aes3_channel_status()
+    :param user:    User data bits, defaults to 0
+    :param valid:   Valid bits, defaults to 0
+    :param prev:    Line level before the first half bit
+    :return:        uint8 array with 128 half bits per frame
+    """
+    left = np.asarray(left)
+    right = np.asarray(right)
+    frames = len(left)
+    assert len(right) == frames, "Channels should have the same length"
+    assert frames % AES3_FRAMES == 0, \
+        "Only complete blocks of {} frames can be encoded".format(AES3_FRAMES)
+
+    def per_channel(bits, default):
+        if bits is None:
+            bits = default
+        bits = np.asarray(bits, dtype=np.uint8) & 1
+        if bits.ndim == 1:
+            bits = np.stack((bits, bits))
+        if bits.shape[1] != frames:
+            bits = np.tile(bits, (1, frames // bits.shape[1]))
+        return bits
+
+    cs = per_channel(cs, aes3_channel_status())
+    user = per_channel(user, np.zeros(AES3_FRAMES, dtype=np.uint8))
+    valid = per_channel(valid, np.zeros(AES3_FRAMES, dtype=np.uint8))
+
+    sub_a = _aes3_subframes(left, valid[0], user[0], cs[0])
+    sub_b = _aes3_subframes(right, valid[1], user[1], cs[1])
+    slots = np.stack((sub_a, sub_b), axis=1).reshape(2 * frames, 28)
+
+    # Every time slot starts with a transition, a one adds one in the middle
+    transitions = np.empty((2 * frames, 64), dtype=np.uint8)
+    transitions[:, 8::2] = 1
+    transitions[:, 9::2] = slots
+    transitions[0::2, :8] = _aes3_transitions(AES3_PREAMBLE_X)
+    transitions[0::2 * AES3_FRAMES, :8] = _aes3_transitions(AES3_PREAMBLE_Z)
+    transitions[1::2, :8] = _aes3_transitions(AES3_PREAMBLE_Y)
+
+    stream = np.bitwise_xor.accumulate(transitions.ravel())
+    if prev:
+        stream ^= 1
+    return stream
+
+
+def generate_aes(frequency, fs=44100):
+    """Endless AES3 half bit stream with a sine on both channels."""
+    block = 0
+    while True:
+        i = np.arange(block * AES3_FRAMES + 1, (block + 1) * AES3_FRAMES + 1)
+        channel = np.sin(np.pi * 2. * i * frequency / float(fs))
+        channel = np.clip(np.round(channel * 2 ** 23), -2 ** 23, 2 ** 23 - 1)
+        channel = channel.astype(np.int32)
+        for half_bit in encode_aes3(channel, channel).tolist():
+            yield half_bit
+        block += 1
+
+
+
+# NOTE(michiel): Multiplier reference models, see fpga/basics/multiplier.py
+MULT35_LATENCY = 5                      # Clocks from a, b to p
+SHARED_MULT35_LATENCY = MULT35_LATENCY + 2  # Load and output register extra
+
+
+def mult35_partials(a, b):
+    """The four 18x18 products of Multiplier35Bit.
+
+    The operands are split like the hardware does it: a signed upper part
+    (bits 34 - 17) and a zero extended lower part (bits 16 - 0).
+
+    :param a:   Array of 35 bit signed operands
+    :param b:   Array of 35 bit signed operands
+    :return:    int64 arrays (mult1, mult2, mult3, mult4) = (au * bu, al * bl,
+                au * bl, al * bu)
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    assert np.all((-2 ** 34 <= a) & (a < 2 ** 34)), "a should be 35 bit signed"
+    assert np.all((-2 ** 34 <= b) & (b < 2 ** 34)), "b should be 35 bit signed"
+
+    a_upper, a_lower = a >> 17, a & 0x1FFFF
+    b_upper, b_lower = b >> 17, b & 0x1FFFF
+    return (a_upper * b_upper, a_lower * b_lower,
+            a_upper * b_lower, a_lower * b_upper)
+
+
+def mult35_model(a, b):
+    """Products of Multiplier35Bit as an object array of python ints."""
+    mult1, mult2, mult3, mult4 = mult35_partials(a, b)
+    add_low = (mult3 + mult4).astype(object)
+    return ((mult1.astype(object) << 34) + (add_low << 17) +
+            mult2.astype(object))
+
+
+def pipeline_model(values, latency=MULT35_LATENCY, reset_value=0):
+    """Output sequence of a pipeline that takes one value per clock.
+
+    out[n] is the output seen while values[n] is presented at the input.
+    """
+    values = np.asarray(values)
+    out = np.empty_like(values)
+    out[:latency] = reset_value
+    out[latency:] = values[:max(len(values) - latency, 0)]
+    return out
+
+
+def shared_mult35_model(a, b, load):
+    """Outputs of SharedMultiplier and ThreePortMultiplier35Bit.
+
+    :param a:       Operands per port per clock, shape (ports, clocks)
+    :param b:       Operands per port per clock, shape (ports, clocks)
+    :param load:    Loaded port per clock (1 based, 0 loads nothing)
+    :return:        (p, rdy) both shaped (ports, clocks), p holds the last
+                    product of that port
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    load = np.asarray(load, dtype=np.int64)
+    ports, clocks = a.shape
+
+    loaded = np.nonzero(load > 0)[0]
+    products = np.zeros(clocks, dtype=object)
+    products[loaded] = mult35_model(a[load[loaded] - 1, loaded],
+                                    b[load[loaded] - 1, loaded])
+    products = pipeline_model(products, SHARED_MULT35_LATENCY)
+
+    p = np.zeros((ports, clocks), dtype=object)
+    rdy = np.zeros((ports, clocks), dtype=bool)
+    for port in range(ports):
+        rdy[port] = pipeline_model(load == port + 1, SHARED_MULT35_LATENCY,
+                                   False)
+        last = np.maximum.accumulate(np.where(rdy[port],
+                                              np.arange(clocks), -1))
+        p[port] = np.where(last >= 0, products[last], 0)
+    return p, rdy
+
 if __name__ == '__main__':
     # test_bench()
     # print(int_to_bit_list(-8, 4, signed=True))
@@ -274,142 +474,10 @@ if __name__ == '__main__':
     # print(bin(-8))
     # test_external_clocks(500000000, 500000000.)
 
-    # PAGE 430
-
-    def generate_aes(frequency, fs=44100):
-        i = 0
-        prev = 0
-
-        def channel_status():
-            csbit = 0
-            while True:
-                if csbit == 0:
-                    yield 1         # 1 = AES/EBU, 0 = S/PDIF
-                elif csbit == 4:
-                    yield 1         # Preemphasis = None
-                else:
-                    yield 0
-                csbit += 1
-                csbit %= 192
-
-        def user_data():
-            while True:
-                yield 0
-
-        def valid_data():
-            while True:
-                yield 0
-
-        def preamble_x(prev=0):
-            yield 0 if prev else 1
-            yield 1 if prev else 0
-            for i in range(3):
-                yield 0 if prev else 1
-            for i in range(3):
-                yield 1 if prev else 0
-
-        def preamble_y(prev=0):
-            for i in range(2):
-                yield 0 if prev else 1
-            yield 1 if prev else 0
-            for i in range(2):
-                yield 0 if prev else 1
-            for i in range(3):
-                yield 1 if prev else 0
-
-        def preamble_z(prev=0):
-            for i in range(3):
-                yield 0 if prev else 1
-            yield 1 if prev else 0
-            yield 0 if prev else 1
-            for i in range(3):
-                yield 1 if prev else 0
-
-        def biphase_mark(sample, prev):
-            bit = int(not prev)
-            yield bit
-            if int(sample):
-                yield int(not bit)
-            else:
-                yield bit
-
-        block = 0
-        chan_gen = channel_status()
-        user_gen = user_data()
-        valid_gen = valid_data()
-        while True:
-            for frame in range(192):
-                i += 1.
-                cs = next(chan_gen)
-                ud = next(user_gen)
-                vd = next(valid_gen)
-                for subframe in range(2):
-                    if frame == subframe == 0:
-                        for z in preamble_z(prev):
-                            yield z
-                        prev = z
-                    elif subframe == 0:
-                        for x in preamble_x(prev):
-                            yield x
-                        prev = x
-                    else:
-                        for y in preamble_y(prev):
-                            yield y
-                        prev = y
-                    channel = math.sin(math.pi * 2. * i * frequency / float(fs))
-                    channel = bin(int(round(channel * 2 ** 23)), 24)
-
-                    parity_list = []
-                    for time_slot in range(28):  # 32 - preamble bits
-                        if time_slot < 24:
-                            parity_list.append(channel[time_slot])
-                            for k in biphase_mark(channel[time_slot], prev):
-                                yield k
-                            prev = k
-                        elif time_slot == 24:
-                            parity_list.append(cs)
-                            for k in biphase_mark(cs, prev):
-                                yield k
-                            prev = k
-                        elif time_slot == 25:
-                            parity_list.append(ud)
-                            for k in biphase_mark(ud, prev):
-                                yield k
-                            prev = k
-                        elif time_slot == 26:
-                            parity_list.append(vd)
-                            for k in biphase_mark(vd, prev):
-                                yield k
-                            prev = k
-                        else:
-                            ones = 0
-                            for p in range(len(parity_list)):
-                                if int(parity_list[p]):
-                                    ones += 1
-                            if ones % 2 == 0:
-                                par = 0
-                            else:
-                                par = 1
-                            for k in biphase_mark(par, prev):
-                                yield k
-                            prev = k
-
-            block += 1
-
     aes = generate_aes(100)
 
     for i in range(200):
-        preamble = [next(aes) for j in range(64)]
+        subframe = [next(aes) for j in range(64)]
 
         if i % 2 == 0:
-            print(''.join(map(str, preamble)))
-
-        ones = 0
-        for x in preamble:
-            if int(x):
-                ones += 1
-
-        # Assertion to check for 0-DC offset
-        assert len(preamble) - ones == ones, \
-            "{} zeros, {} ones (should be equal)".format(len(preamble) - ones,
-                                                         ones)
+            print(''.join(map(str, subframe)))
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+__author__ = 'michiel'
+
+import os
+import shutil
+import tempfile
+
+import fpga.basics.flipflops as ff
+from fpga.utils import create_signals
+from fpga.vhdl_cache import cached_vhdl, vhdl_cache_key
+
+
+def test_cache_key():
+    clk = create_signals(1)
+    d, q = create_signals(2, 8)
+    d_signed, q_signed = create_signals(2, 8, signed=True)
+    d_mod, q_mod = create_signals(2, 8, mod=True)
+    d_wide, q_wide = create_signals(2, 9)
+
+    key = vhdl_cache_key(ff.dff, clk, d, q)
+    assert key == vhdl_cache_key(ff.dff, clk, *create_signals(2, 8))
+    assert key != vhdl_cache_key(ff.dff, clk, d_signed, q_signed)
+    assert key != vhdl_cache_key(ff.dff, clk, d_mod, q_mod)
+    assert key != vhdl_cache_key(ff.dff, clk, d_wide, q_wide)
+    assert key != vhdl_cache_key(ff.dff, clk, d, q, reset_active=0)
+
+
+def test_cached_vhdl():
+    tmp = tempfile.mkdtemp()
+    try:
+        cache_dir = os.path.join(tmp, 'cache')
+        first, second = os.path.join(tmp, 'first'), os.path.join(tmp, 'second')
+        os.makedirs(first)
+        os.makedirs(second)
+
+        clk = create_signals(1)
+        d, q = create_signals(2, 8, delay=None)
+
+        assert not cached_vhdl(ff.dff, clk, d, q, path=first,
+                               cache_dir=cache_dir)
+        assert cached_vhdl(ff.dff, clk, d, q, path=second, cache_dir=cache_dir)
+
+        assert sorted(os.listdir(first)) == sorted(os.listdir(second))
+        with open(os.path.join(first, 'dff.vhd')) as f:
+            converted = f.read()
+        with open(os.path.join(second, 'dff.vhd')) as f:
+            assert f.read() == converted
+        assert 'ScryverDesign' in converted
+    finally:
+        shutil.rmtree(tmp)
@@ -87,7 +87,7 @@ def create_signals(nr_signals, bits=1, signed=False, enum=None, mod=False,
 def create_clock_reset_old(rst_value=True, rst_active=True, rst_async=False):
     print("Warning: Don't use the ResetSignal as a precaution, the default values don't seem to work...")
     return Signal(False), ResetSignal(val=rst_value, active=rst_active,
-                                      async=rst_async)
+                                      isasync=rst_async)
 
 
 def create_clock_reset(rst_active=1):
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+__author__ = 'michiel'
+
+import os
+import ast
+import shutil
+import hashlib
+import inspect
+import tempfile
+import importlib.util
+
+import myhdl
+import myhdl.conversion._toVHDL as conv2vhdl
+from myhdl import modbv, EnumItemType
+from myhdl._Signal import _Signal
+from myhdl._block import block_decorator
+
+__all__ = [
+    'cached_vhdl',
+    'vhdl_cache_key',
+]
+
+#: Default cache location, override with the FPGA_VHDL_CACHE environment var
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'fpga-vhdl')
+
+
+def _fpga_modules(source, package, modules):
+    """Collect the sources of all fpga modules imported by source."""
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level:
+                base = importlib.util.resolve_name('.' * node.level + base,
+                                                   package)
+            # from x import y, where y might be a module itself
+            names = [base] + [base + '.' + alias.name for alias in node.names]
+        else:
+            continue
+
+        for name in names:
+            parts = name.split('.')
+            if parts[0] != 'fpga':
+                continue
+            # Importing a module also runs the __init__ of its packages
+            for i in range(1, len(parts) + 1):
+                _fpga_module(".".join(parts[:i]), modules)
+
+
+def _fpga_module(name, modules):
+    if name in modules:
+        return
+    try:
+        spec = importlib.util.find_spec(name)
+    except (ImportError, AttributeError, ValueError):
+        spec = None
+    if spec is None or spec.origin is None or not os.path.isfile(spec.origin):
+        return      # Not a module but a name imported from one
+
+    with open(spec.origin, 'rb') as f:
+        source = f.read()
+    modules[name] = source
+    if spec.submodule_search_locations:
+        package = name
+    else:
+        package = name.rpartition('.')[0]
+    _fpga_modules(source, package, modules)
+
+
+def _signature(arg):
+    """Hashable description of a block argument."""
+    if isinstance(arg, _Signal):
+        val = arg._val
+        if isinstance(val, bool):
+            return 'bool'
+        elif isinstance(val, EnumItemType):
+            return 'enum({})'.format(val._type)
+        return '{}({}, min={}, max={})'.format(
+            'modbv' if isinstance(val, modbv) else 'intbv', arg._nrbits,
+            arg.min, arg.max)
+    elif isinstance(arg, (list, tuple)):
+        return '[{}]'.format(', '.join(_signature(a) for a in arg))
+    return repr(arg)
+
+
+def vhdl_cache_key(func, *args, **kwargs):
+    """Hash of everything that ends up in the VHDL of func(*args, **kwargs).
+
+    That is the source of the module defining func, all fpga modules it
+    (transitively) imports, the port signatures (width, signedness and mod),
+    the other arguments and the convertor settings.
+    """
+    top = func.func if isinstance(func, block_decorator) else func
+    with open(inspect.getsourcefile(top), 'rb') as f:
+        source = f.read()
+
+    modules = {}
+    module = inspect.getmodule(top)
+    package = getattr(module, '__package__', None) or ''
+    _fpga_modules(source, package, modules)
+
+    convertor = conv2vhdl.toVHDL
+    h = hashlib.sha256()
+    h.update(source)
+    for name in sorted(modules):
+        h.update(name.encode())
+        h.update(modules[name])
+    h.update(top.__qualname__.encode())
+    h.update(_signature(args).encode())
+    h.update(_signature(sorted(kwargs.items())).encode())
+    h.update(repr((myhdl.__version__, convertor.library,
+                   convertor.architecture, convertor.numeric_ports,
+                   convertor.std_logic_ports)).encode())
+    return h.hexdigest()
+
+
+def cached_vhdl(func, *args, name=None, path='', cache_dir=None, **kwargs):
+    """Convert func(*args, **kwargs) to VHDL in path, but copy the result of
+    an earlier conversion from the cache when nothing has changed.
+
+    :param func:        The (@block) function to convert
+    :param name:        Entity and file name, defaults to the function name
+    :param path:        Output directory
+    :param cache_dir:   Cache directory, defaults to $FPGA_VHDL_CACHE or
+                        ~/.cache/fpga-vhdl
+    :return:            True if the VHDL came from the cache
+    """
+    if name is None:
+        name = func.__name__
+    if cache_dir is None:
+        cache_dir = os.environ.get('FPGA_VHDL_CACHE', CACHE_DIR)
+
+    entry = os.path.join(cache_dir, name + '-' +
+                         vhdl_cache_key(func, *args, **kwargs))
+    if os.path.isdir(entry):
+        for filename in os.listdir(entry):
+            shutil.copy(os.path.join(entry, filename), path or '.')
+        return True
+
+    # Convert in a private directory, so parallel builds don't collide
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cache_dir)
+    convertor = conv2vhdl.toVHDL
+    try:
+        if isinstance(func, block_decorator):
+            func(*args, **kwargs).convert(hdl='VHDL', path=tmp, name=name)
+        else:
+            convertor.directory = tmp
+            convertor.name = name
+            convertor(func, *args, **kwargs)
+
+        for filename in os.listdir(tmp):
+            shutil.copy(os.path.join(tmp, filename), path or '.')
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            pass    # Someone else stored the same conversion first
+    finally:
+        convertor.directory = None
+        convertor.name = None
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+
+    return False
@@ -10,5 +10,6 @@ setup(name='fpga',
       version='0.1.1',
       description='FPGA modules for conversion to VHDL',
       author='Michiel',
-      install_requires=['myhdl>=0.10'],
-      packages=['fpga', 'fpga.basics', 'fpga.encoders', 'fpga.generators', 'fpga.interfaces', 'fpga.tests'])
+      install_requires=['myhdl>=0.10', 'numpy'],
+      packages=['fpga', 'fpga.basics', 'fpga.encoders', 'fpga.generators', 'fpga.interfaces', 'fpga.tests'],
+      entry_points={'console_scripts': ['fpga-build = fpga.build:main']})